@@ -1,8 +1,7 @@
-import xml.etree.ElementTree as ET
 import os
+import math
 import osmium
 import numpy
-import geopy.distance as distance
 from .Node import  Node
 from .Way import Way
 from .Road import Road
@@ -68,7 +67,7 @@ class Map(osmium.SimpleHandler):
         self.num_nodes += 1
         temp =  Node()
         temp.fill(n)
-        self.nodesDict[f"n{n.id}"] = temp
+        self.nodesDict[n.id] = temp
         self.nodes.append(temp)
         
     def way(self, n):
@@ -79,9 +78,27 @@ class Map(osmium.SimpleHandler):
         self.num_ways += 1
         temp =  Way()
         temp.fill(n,self.nodesDict)
-        self.waysDict[f"n{n.id}"] = temp
+        self.waysDict[n.id] = temp
         self.ways.append(temp)
         
+    def locatedWay(self, n):
+        """
+        [Method] locatedWay
+        Do not use this method, it is called by WayLocationReader for each way. Nodes are
+        created from the locations of the way node references, only for the nodes used by ways.
+        """
+        for nodeRef in n.nodes:
+            if not nodeRef.location.valid():
+                return
+        for nodeRef in n.nodes:
+            if nodeRef.ref not in self.nodesDict:
+                self.num_nodes += 1
+                temp = Node()
+                temp.fillLocation(nodeRef)
+                self.nodesDict[nodeRef.ref] = temp
+                self.nodes.append(temp)
+        self.way(n)
+
     def __str__(self):
         """
         [Method] __str__
@@ -94,23 +111,24 @@ class Map(osmium.SimpleHandler):
         tempstring = tempstring + f" number of roads node = {self.roadNodes.__len__()}\n number of building = {self.buildings.__len__()}"
         return tempstring
     
-    def setBounds(self,filepath):
+    def setBounds(self, box=None):
         """
-        [Method] __str__
-        Setup the bounds using the file path
+        [Method] setBounds
+        Setup the bounds from the box of the file header (osmium reads the <bounds> tag of
+        XML files into it). When the file has no bounds, they are derived from the nodes.
         
         Parameter:
-            - filepath : path to the OSM file
-        """
-        tree = ET.parse(filepath)
-        root = tree.getroot()
-        for child in root:
-            if (child.tag == 'bounds'):
-                self.minlat = float(child.attrib['minlat'])
-                self.maxlat = float(child.attrib['maxlat'])
-                self.minlon = float(child.attrib['minlon'])
-                self.maxlon = float(child.attrib['maxlon'])
-                break
+            - box : osmium Box of the file header.
+        """
+        if box is not None and box.valid():
+            self.minlat = box.bottom_left.lat
+            self.minlon = box.bottom_left.lon
+            self.maxlat = box.top_right.lat
+            self.maxlon = box.top_right.lon
+        elif self.nodes.__len__() > 0:
+            coordinates = numpy.array([(x.lat, x.lon) for x in self.nodes])
+            self.minlat, self.minlon = coordinates.min(axis=0)
+            self.maxlat, self.maxlon = coordinates.max(axis=0)
                 
     def constructMap(self):
         """
@@ -153,22 +171,96 @@ class Map(osmium.SimpleHandler):
                 
             node.addWay(road)
             startingNode = node
-            temp = self.roadNodesDict.get(f"{node.osmId}")
+            temp = self.roadNodesDict.get(node.osmId)
             if temp is None:
                 self.roadNodesDict[node.osmId] = node
                 self.roadNodes.append(node)
                
             
-def readFile(filepath):
+class WayLocationReader(osmium.SimpleHandler):
+    """
+    [Class] WayLocationReader
+    Handler that only reads the ways of a file and hands them to a Map. The node locations
+    come from the osmium node location index, so no object is created for nodes that are
+    not used by any way.
+    """
+    def __init__(self, generatedMap):
+        """
+        [Constructor]
+        Parameter:
+            - generatedMap : Map receiving the ways.
+        """
+        osmium.SimpleHandler.__init__(self)
+        self.generatedMap = generatedMap
+
+    def way(self, n):
+        self.generatedMap.locatedWay(n)
+
+def toPrecision(coordinate):
+    """
+    [Function] toPrecision
+    Round a coordinate to the precision of OSM files (7 decimals), as osmium does (halves
+    are rounded away from zero).
+    """
+    fixed = math.floor(abs(coordinate) * 10000000 + 0.5)
+    return math.copysign(fixed, coordinate) / 10000000
+
+def fromData(nodes, ways, bounds=None):
+    """
+    [Function] fromData
+    Function to generate map from nodes and ways in memory (e.g. a generated city), without
+    writing and reading an OSM file. The map is the same readFile gives for the file they
+    would be written to.
+    
+    parameter:
+        - nodes : node objects with id, location (lon, lat) and tags.
+        - ways : way objects with id, nodes (list of node IDs) and tags.
+        - bounds : (minlat, minlon, maxlat, maxlon), derived from the nodes if not given.
+    """
+    generatedMap = Map()
+    for n in nodes:
+        temp = Node()
+        temp.fillData(n.id, toPrecision(n.location[0]), toPrecision(n.location[1]), n.tags)
+        generatedMap.num_nodes += 1
+        generatedMap.nodesDict[n.id] = temp
+        generatedMap.nodes.append(temp)
+    for w in ways:
+        temp = Way()
+        temp.fillData(w.id, w.nodes, w.tags, generatedMap.nodesDict)
+        generatedMap.num_ways += 1
+        generatedMap.waysDict[w.id] = temp
+        generatedMap.ways.append(temp)
+    if bounds is None:
+        generatedMap.setBounds()
+    else:
+        generatedMap.minlat, generatedMap.minlon, generatedMap.maxlat, generatedMap.maxlon = \
+            [toPrecision(x) for x in bounds]
+    generatedMap.constructMap()
+    return generatedMap
+
+def readFile(filepath, idx=None):
     """
     [Function] readFile
-    Function to generate map fom osm File
+    Function to generate map fom osm File. The file is read once: the bounds come from
+    its header and nodes and ways from the same reader (relations are skipped).
     
     parameter:
-        - filepath : path to the OSM file
+        - filepath : path to the OSM file (.osm, .osm.pbf, ...)
+        - idx : optional osmium node location index type (e.g. "flex_mem" or
+                "sparse_file_array,nodes.idx" to keep it in a memory-mapped file).
+                When given, only the nodes used by ways are created.
     """
     generatedMap = Map()
-    generatedMap.apply_file(filepath)
-    generatedMap.setBounds(filepath)
+    entities = osmium.osm.osm_entity_bits.NODE | osmium.osm.osm_entity_bits.WAY
+    reader = osmium.io.Reader(filepath, entities)
+    box = reader.header().box()
+    if idx is None:
+        osmium.apply(reader, generatedMap)
+    else:
+        locations = osmium.NodeLocationsForWays(osmium.index.create_map(idx))
+        locations.ignore_errors()
+        osmium.apply(reader, locations, WayLocationReader(generatedMap))
+    reader.close()
+    generatedMap.setBounds(box)
     generatedMap.constructMap()
-    return generatedMap
\ No newline at end of file
+    return generatedMap
@@ -4,7 +4,7 @@ class Node():
     A class to represent the Open Street Map Node.
     
     Properties:
-        - osmId : Open Street Map ID.
+        - osmId : Open Street Map ID (integer).
         - lat : Latitude of this cell.
         - lon : Longitude of this cell.
         - isRoad : Boolean to mark whether this Node is a part of a road.
@@ -12,13 +12,14 @@ class Node():
         - ways : A dictionary of Open Street Map Ways.
         - tags :  dictionary of the Map Feature of this object (check Open Street Map - Map Features).
     """
+    __slots__ = ("osmId", "lat", "lon", "isRoad", "connections", "ways", "tags")
     
     def __init__(self):
         """
         [Constructor]
         Initialize an empty node.
         """
-        self.osmId = ""
+        self.osmId = 0
         self.lat = 0.0
         self.lon = 0.0
         self.isRoad = False
@@ -39,14 +40,46 @@ class Node():
         Parameter:
             - osmNode = osmium library node.
         """
-        self.osmId = f"{osmNode.id}"
+        self.osmId = osmNode.id
         self.lat = osmNode.location.lat
         self.lon = osmNode.location.lon
-        for tag in osmNode.tags:
-            self.tags[tag.k] = tag.v
+        if len(osmNode.tags) > 0:
+            for tag in osmNode.tags:
+                self.tags[tag.k] = tag.v
         if 'highway' in self.tags.keys():
             isRoad = True
         
+    def fillLocation(self, nodeRef):
+        """
+        [Method]fillLocation
+        Fill up the osmId, lat and lon of this object from a way node reference
+        whose location was resolved by an osmium node location index (the node
+        tags are not available in this case).
+
+        Parameter:
+            - nodeRef = osmium library node reference.
+        """
+        self.osmId = nodeRef.ref
+        self.lat = nodeRef.location.lat
+        self.lon = nodeRef.location.lon
+
+    def fillData(self, osmId, lon, lat, tags):
+        """
+        [Method]fillData
+        Fill up the osmId, lat, lon and tags of this object from plain values (e.g. a node
+        generated in memory).
+
+        Parameter:
+            - osmId = Open Street Map ID.
+            - lon, lat = coordinates.
+            - tags = dictionary of tags.
+        """
+        self.osmId = osmId
+        self.lat = lat
+        self.lon = lon
+        if tags:
+            self.tags.update(tags)
+
     def addWay(self,way):
         """
         [Method] addWay
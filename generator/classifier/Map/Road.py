@@ -1,9 +1,18 @@
 import geopy.distance as distance
 
 class Road:
+    __slots__ = ("name", "start", "destination", "_length")
+
     def __init__(self,node1, node2):
         self.name,self.start,self.destination = genName(node1,node2)
-        self.length = distance.distance(self.start.getPosition(), self.destination.getPosition()).km * 1000
+        self._length = None
+
+    @property
+    def length(self):
+        # geodesic length in meters, only computed when it is first used
+        if self._length is None:
+            self._length = distance.distance(self.start.getPosition(), self.destination.getPosition()).km * 1000
+        return self._length
         
     def getPath(self):
         return (self.start.lat, self.start.lon, self.destination.lat,self.destination.lon)
@@ -29,12 +38,11 @@ def genName(node1, node2):
     start = None 
     destination = None
     if (node1.osmId < node2.osmId):
-        name = f"{node1.osmId}-{node2.osmId}"
+        name = (node1.osmId, node2.osmId)
         start = node1 
         destination = node2 
     else:
-        name = f"{node2.osmId}-{node1.osmId}"        
+        name = (node2.osmId, node1.osmId)
         start = node2
         destination = node1
     return (name, start, destination)
-    
\ No newline at end of file
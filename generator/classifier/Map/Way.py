@@ -1,20 +1,25 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
 class Way():
     """
     [Class] Way
     A class to represent the Open Street Map Way.
        
     Properties:
-        - osmId : Open Street Map ID.
+        - osmId : Open Street Map ID (integer).
         - nodes : List of Nodes included in this way.
         - tags : A dictionary of the Map Feature of this object (check Open Street Map - Map Features).
     """
+    __slots__ = ("osmId", "nodes", "tags")
     
     def __init__(self):
         """
         [Constructor]
         Initialize an empty way.
         """
-        self.osmId = ""
+        self.osmId = 0
         self.nodes = []    
         self.tags = {}
         
@@ -28,12 +33,12 @@ class Way():
         
         Parameter:
             - osmWay = osmium way node.
-            - nodes = list of Namazu Nodes.
+            - nodes = dictionary of Namazu Nodes by Open Street Map ID.
         """
-        self.osmId = f"{osmWay.id}"
+        self.osmId = osmWay.id
 
         for node in osmWay.nodes:
-            temp = nodes[f"n{node.ref}"]
+            temp = nodes.get(node.ref)
             if (temp is not None):
                 self.nodes.append(temp)
                 temp.addWay(self)
@@ -43,6 +48,31 @@ class Way():
         for tag in osmWay.tags:
             self.tags[tag.k] = tag.v
             
+    def fillData(self, osmId, nodeRefs, tags, nodes):
+        """
+        [Method] fillData
+        Fill up the osmId, nodes and tags of this object from plain values (e.g. a way
+        generated in memory).
+
+        Parameter:
+            - osmId = Open Street Map ID.
+            - nodeRefs = list of Open Street Map IDs of the nodes of the way.
+            - tags = dictionary of tags.
+            - nodes = dictionary of Namazu Nodes by Open Street Map ID.
+        """
+        self.osmId = osmId
+
+        for ref in nodeRefs:
+            temp = nodes.get(ref)
+            if (temp is not None):
+                self.nodes.append(temp)
+                temp.addWay(self)
+            else:
+                logger.debug("Node %s of way %s not found", ref, osmId)
+
+        if tags:
+            self.tags.update(tags)
+            
     def __str__(self):
         """
         [Method] __str__
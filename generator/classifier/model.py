@@ -12,7 +12,15 @@ def load_model(model_filename="classifier/Tsukuba.hdf5"):
 
 def accuracy(image_filename, model):
     mymap =  map.readFile(image_filename)
+    return evaluate(mymap, model)
 
+# same as accuracy, for nodes and ways in memory (e.g. a generated individual)
+# instead of an OSM file. bounds are (minlat, minlon, maxlat, maxlon)
+def accuracy_data(nodes, ways, model, bounds=None):
+    mymap = map.fromData(nodes, ways, bounds)
+    return evaluate(mymap, model)
+
+def evaluate(mymap, model):
     imageName = "temp"
     renderer.render(mymap)
     renderer.osmToImage(imageName)
@@ -0,0 +1,41 @@
+import sys
+import optparse
+import lib.clip as clip
+
+def parse_args(args):
+    usage = "usage: %prog [options]"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-i', action="store", type="string", dest="filename",
+	   help="OSM input file", default="data/sumidaku.osm")
+    parser.add_option('-o', action="store", type="string", dest="output",
+        help="OSM output file (.osm, .osm.gz, .osm.pbf...), by default the "\
+             "input name with _clipped (e.g. data/sumidaku_clipped.osm)",
+        default=None)
+    parser.add_option('-x', action="store", type="string", dest="bbox",
+        help="Bounding box to keep \"min_lon,min_lat,max_lon,max_lat\"",
+        default=None)
+    parser.add_option('-p', action="store", type="string", dest="polygon",
+        help="Polygon to keep \"lon,lat lon,lat lon,lat ...\" (instead of "\
+             "-x)", default=None)
+    parser.add_option('-s', action="store_false", dest="complete_ways",
+        help="Cut the ways crossing the border, instead of keeping them "\
+             "whole with their nodes outside of the area", default=True)
+    opt, args = parser.parse_args()
+    if (opt.bbox == None) == (opt.polygon == None):
+        parser.error("pass the area to keep with either -x or -p")
+    return opt, args
+
+def main():
+    opt, args = parse_args(sys.argv[1:])
+    bbox = polygon = None
+    if opt.bbox != None:
+        bbox = [float(x) for x in opt.bbox.split(",")]
+    if opt.polygon != None:
+        polygon = [[float(x) for x in point.split(",")]
+                                            for point in opt.polygon.split()]
+    n_nodes, n_ways = clip.clip(opt.filename, opt.output, bbox, polygon,
+                                opt.complete_ways)
+    print("nodes: {}, ways: {}".format(n_nodes, n_ways))
+
+if __name__ == '__main__':
+    main()
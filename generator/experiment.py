@@ -2,11 +2,19 @@ import optparse
 import os, sys, logging
 from lib.logger import log
 import lib.handler as handler
+import lib.cache as map_cache
+import lib.delta as delta
 import lib.helper as helper
+from lib.spatial import SpatialIndex
+from lib.blocks import BlockTable, ADJACENCY
+import lib.neighbors as neighbors
 import lib.mapelites.evolution as evo
-from lib.parcel import generate_parcel_density
+from lib.parcel import generate_parcels, generate_parcels_parallel
+import lib.ids as ids
 from lib.plotter import plot, plot_cycles_w_density
-from classifier.model import load_model, accuracy
+from classifier.model import load_model, accuracy_data
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 import copy
 from lib.mapelites.metrics import similarity_order, similarity_range
 
@@ -23,95 +31,78 @@ def set_colors(nodes, ways):
     helper.set_node_type(ways, nodes)
     helper.color_nodes(nodes.values(), "black")
     helper.color_ways(ways, nodes, ways_colors, nodes_colors, default="black")
-def generate_ind(nodes,ways,cycles,ind,chrom_idx,output="data/ind.osm"):
+def generate_ind(nodes,ways,cycles,ind,chrom_idx,output=None,pool=None,
+                 workers=1,seed=0):
     import copy
     _nodes = copy.deepcopy(nodes)
     _ways = copy.deepcopy(ways)
-    for idx in chrom_idx:
-        cycle_data = cycles[idx]
-        cycle_nodes = cycle_data["n_ids"]
-        density = ind.chromosome[idx]
-        generate_parcel_density(_nodes, _ways, cycle_nodes, density)
-    handler.write_data(output,_nodes.values(),_ways.values())
+    n_ids = [cycles[idx]["n_ids"] for idx in chrom_idx]
+    partitions = [ind.chromosome[idx] for idx in chrom_idx]
+    boxes = [cycles[idx]["obb"] for idx in chrom_idx]
+    if pool == None:
+        # every block is partitioned in the same batch (see generate_parcels)
+        generate_parcels(_nodes, _ways, n_ids, partitions, boxes)
+    else:
+        # blocks are split among the workers, each one taking its ids from
+        # its own range for this seed (see lib.ids)
+        ranges = [ids.block_range(idx, seed) for idx in chrom_idx]
+        generate_parcels_parallel(_nodes, _ways, n_ids, partitions, boxes,
+                                  ranges, pool, workers)
+    if output != None:
+        handler.write_data(output,_nodes.values(),_ways.values())
     return _nodes, _ways
-def compute_building_density(cycles, input, nodes, ways):
-    _output = "{}_building_density_data".format(input)
+def compute_building_density(cycles, prefix, nodes, ways, blocks):
+    # v4: the ids of the buildings of each block, for the blocks kept with
+    # the obbs of v4 blocks (older files hold way objects, or were indexed
+    # by the blocks kept with other obbs)
+    _output = "{}_building_density_data_v4".format(prefix)
     density = helper.load(_output)
     if density == None:
         log("Computing building density data...", "DEBUG")
-        density = {}
-        for c_id, cycle in cycles.items():
-            d = helper.building_density(nodes, ways, cycle["n_ids"])
-            density[c_id] = d
+        c_ids = list(cycles)
+        buildings = helper.assign_buildings(nodes, ways,
+                                    [cycles[c_id]["n_ids"] for c_id in c_ids])
+        density = {c_id: b.tolist() for c_id, b in zip(c_ids, buildings)}
         helper.save(density, _output)
     else:
         log("Loaded building density from file {}".format(_output), "DEBUG")
 
     for c_id, d in density.items():
-        nodes_coord = [nodes[x].location for x in cycles[c_id]["n_ids"]]
         cycles[c_id]["density"] = len(d)
-        cycles[c_id]["area"] = helper.get_area(nodes_coord)/1000000 # in km2
+        cycles[c_id]["area"] = blocks.area[c_id]/1000000 # in km2
         cycles[c_id]["actual_density"] = len(d) / cycles[c_id]["area"]
         #print("cycle_id {}: b{}, a{:.2f}, d{:.2f}".format(c_id, len(d), cycles[c_id]["area"], cycles[c_id]["actual_density"]))
         cycles[c_id]["buildings"] = d
-def compute_neighbors_closest(cycles, n=3):
-    import lib.trigonometry as trig
-    log("Calculating nearest {} neighbours for each cycle.".format(n), "DEBUG")
-    for i in range(len(cycles)):
-        distances = []
-        for j in range(len(cycles)):
-            if i == j: continue
-            dist = trig.dist(*cycles[i]["centroid"], *cycles[j]["centroid"])
-            distances.append((dist,j))
-        distances = [id for coord, id in sorted(distances)]
-        cycles[i]["neighbors"] = distances[:n]
-def compute_neighbors_MST(cycles, input):
-    import lib.trigonometry as trig
-    _output = "{}_neighbor_data".format(input)
-    neighbor_values = helper.load(_output)
-
-    if neighbor_values == None:
-        log("Computing neighbors with MST...", "DEBUG")
-        neighbor_values = {}
-        for i in cycles:
-            neighbor_values[i] = []
-
-        added = [0]
-        while len(added) != len(cycles):
-            distances = []
-            for i in range(len(cycles)):
-                for j in range(len(cycles)):
-                    if i in added and j not in added:
-                       dist = trig.dist(*cycles[i]["centroid"], *cycles[j]["centroid"])
-                       distances.append((dist,i,j))
-            distances = sorted(distances)
-            dist, i, j = distances.pop(0)
-            neighbor_values[i].append(j)
-            neighbor_values[j].append(i)
-            added.append(j)
-        helper.save(neighbor_values, _output)
+# sets the neighbors of each cycle from a graph over the centroids of the
+# blocks (see lib.neighbors): their minimum spanning tree ("mst"), the k
+# nearest ones ("knn") or the ones at most radius meters away ("radius"),
+# or from the roads they share (see BlockTable.adjacency): a street
+# ("edges") or a street or junction ("nodes")
+def compute_neighbors(cycles, blocks, mode="mst", k=3, radius=100):
+    log("Computing {} neighbors...".format(mode), "DEBUG")
+    if mode in ADJACENCY:
+        offsets, indices = blocks.adjacency(mode)
     else:
-        log("Loaded MST data from file {}".format(_output), "DEBUG")
-
-    for i in neighbor_values:
-        cycles[i]["neighbors"] = neighbor_values[i]
-def compute_centroids(cycles, nodes):
+        offsets, indices = neighbors.neighbor_graph(blocks.centroid, mode, k,
+                                                    radius)
+    for i, n_ids in enumerate(neighbors.to_lists(offsets, indices)):
+        cycles[i]["neighbors"] = n_ids
+def compute_centroids(cycles, blocks):
     for i in cycles:
-        centroid = helper.centroid([nodes[n_id].location for n_id in
-                                                        cycles[i]["n_ids"]])
-        cycles[i]["centroid"] = centroid
-def get_roads(nodes, ways, input):
+        cycles[i]["centroid"] = tuple(blocks.centroid[i].tolist())
+def get_roads(nodes, ways, prefix, index=None):
     road_nodes, road_ways = helper.filter_by_tag(nodes, ways, {"highway":None})
-    _output = "{}_roads_only.osm".format(input)
-    handler.write_data(_output, road_nodes.values(), road_ways.values())
-    road_cycles = helper.get_cycles(_output)
-    log("All road cycles in {}: {}".format(input, len(road_cycles)), "DEBUG")
+    road_cycles = helper.get_cycles(road_nodes, road_ways)
+    log("All road cycles in {}: {}".format(prefix, len(road_cycles)), "DEBUG")
 
-    _output = "{}_roads_data".format(input)
+    # v2: the empty faces of the road graph (older files hold cycles of a
+    # cycle basis, which do not line up with them)
+    _output = "{}_roads_data_v2".format(prefix)
     usable_cycles = helper.load(_output)
     if usable_cycles == None:
-        log("Computing empty road cycles of {}...".format(input), "DEBUG")
-        usable_cycles = helper.remove_nonempty_cycles(road_nodes, road_cycles)
+        log("Computing empty road cycles of {}...".format(prefix), "DEBUG")
+        usable_cycles = helper.remove_nonempty_cycles(road_nodes, road_cycles,
+                                                      index=index)
         helper.save(usable_cycles, _output)
     else:
         log("Empty road cycles from file {}".format(_output), "DEBUG")
@@ -119,16 +110,22 @@ def get_roads(nodes, ways, input):
     log("Number of usable cycles identified: {}".format(len(usable_cycles)),
                                                                        "DEBUG")
     return road_nodes, road_ways, road_cycles, usable_cycles
-def filter_small_cycles(nodes, cycles):
-    _cycles = []
-    for c in cycles:
-        largest, shortest = helper.get_obb_data(nodes, c)
-        ratio = shortest/largest
-        area = helper.get_area([nodes[n_id].location for n_id in c])
-        #print("Area: {:0.2f}, Ratio: {:0.2f}, Largest: {}, Shortest: {}".format(area, shortest/largest, largest, shortest))
-        if area < 3000 or ratio < 0.25: continue
-        _cycles.append(c)
-    return _cycles
+def compute_blocks(nodes, cycles, prefix):
+    # v4: geometry in meters, with the obbs of the original per-block
+    # function (older files hold it in degrees, or obbs that may be aligned
+    # with the edge closing the hull)
+    _output = "{}_blocks_data_v4".format(prefix)
+    blocks = helper.load(_output)
+    if blocks == None:
+        log("Computing block geometry...", "DEBUG")
+        blocks = BlockTable.from_cycles(nodes, cycles)
+        helper.save(blocks, _output)
+    else:
+        log("Loaded block geometry from file {}".format(_output), "DEBUG")
+    return blocks
+def filter_small_cycles(blocks):
+    keep = (blocks.area >= 3000) & (blocks.ratio >= 0.25)
+    return blocks.subset(keep)
 def parse_args(args):
     usage = "usage: %prog [options]"
     parser = optparse.OptionParser(usage=usage)
@@ -146,13 +143,55 @@ def parse_args(args):
         help="Maximum buildings for the area", default=300)
     parser.add_option('-g', action="store", type="int", dest="n_iterations",
         help="Number of iterations for MAP-Elites", default=500)
+    parser.add_option('-f', action="store_true", dest="filter_tags",
+        help="Only load highway and building ways (other features are not "\
+             "written to the outputs)", default=False)
+    parser.add_option('-x', action="store", type="string", dest="bbox",
+        help="Only load ways inside the bounding box "\
+             "\"min_lon,min_lat,max_lon,max_lat\"", default=None)
+    parser.add_option('-l', action="store", type="string", dest="index",
+        help="Read ways in a single pass through an osmium node location "\
+             "index, e.g. \"sparse_file_array,nodes.idx\" to keep it in a "\
+             "memory-mapped file (for large .osm.pbf inputs)", default=None)
+    parser.add_option('-n', action="store_false", dest="use_cache",
+        help="Parse the input file again instead of loading the parsed map "\
+             "cache saved next to it", default=True)
+    parser.add_option('-e', action="store", type="choice", dest="format",
+        choices=["osm", "osm.gz", "osm.bz2", "osm.pbf"],
+        help="Format of the output files: osm, osm.gz, osm.bz2 or osm.pbf",
+        default="osm")
+    parser.add_option('-c', action="store_true", dest="delta",
+        help="Write the input map once to the output folder and each elite "\
+             "as an osmChange file over it (see lib/delta.py)", default=False)
+    parser.add_option('-w', action="store_false", dest="write_elites",
+        help="Only evaluate the elites, without writing them to the output "\
+             "folder", default=True)
+    parser.add_option('-a', action="store", type="choice", dest="neighbors",
+        choices=list(neighbors.MODES + ADJACENCY),
+        help="Neighbors of each block for the density error: \"mst\" (tree "\
+             "of the closest centroids), \"knn\" (3 closest centroids), "\
+             "\"radius\" (centroids at most 100 m away), \"edges\" (blocks "\
+             "sharing a street) or \"nodes\" (blocks sharing a street or "\
+             "junction)", default="mst")
+    parser.add_option('-p', action="store", type="int", dest="processes",
+        help="Processes generating the blocks of each elite in parallel (0 "\
+             "for one per core). With more than one, the ids of the "\
+             "generated objects depend only on the block and the elite "\
+             "(see lib/ids.py)", default=1)
 
     def parse_metric(metric):
         if metric == "range": return similarity_range
         if metric == "order": return similarity_order
         raise ValueError("invalid similarity metric")
+    def parse_bbox(bbox):
+        if bbox == None: return None
+        bbox = [float(x) for x in bbox.split(",")]
+        if len(bbox) != 4: raise ValueError("invalid bounding box")
+        return bbox
     opt, args = parser.parse_args()
     opt.similarity_metric = parse_metric(opt.similarity_metric)
+    opt.bbox = parse_bbox(opt.bbox)
+    if opt.processes == 0: opt.processes = multiprocessing.cpu_count()
     return opt, args
 
 def main():
@@ -175,9 +214,17 @@ def main():
     # Loading OSM data
     ##########################
     log("Loading OSM file '{}'...".format(input))
-    nodes, ways = handler.extract_data(input)
+    load_tags = {"highway":None, "building":None} if opt.filter_tags else None
+    nodes, ways = handler.extract_data(input, load_tags, opt.bbox, opt.index,
+                                       opt.use_cache)
+    # the data computed from the map is saved under a prefix of its own for
+    # each part of the file loaded (see lib.cache.data_prefix)
+    prefix = map_cache.data_prefix(input, *handler.load_params(load_tags,
+                                                    opt.bbox, opt.index))
     helper.update_id_counter(nodes.values())
     set_colors(nodes, ways)
+    index = SpatialIndex(nodes)
+    ways.build_node_index() # shared by the copies made for each individual
 
     ##########################
     # Fetching cycles
@@ -185,8 +232,8 @@ def main():
     log("Computing road information and cycles...")
     # use these functions to attempt to fetch cycles from
     # the road network graph of the input data
-    # #r_nodes, r_ways, r_cycles, cycles = get_roads(nodes, ways, input)
-    # cycles = filter_small_cycles(nodes, cycles)
+    # #r_nodes, r_ways, r_cycles, cycles = get_roads(nodes, ways, prefix, index)
+    # cycles = filter_small_cycles(compute_blocks(nodes, cycles, prefix)).cycles()
 
     # fixed pre-fetched cycles for sumidaku
     cycles = [[1197987560, 1197987449, 1361175762, 1361175760, 1361175752, 1361176778],
@@ -245,14 +292,16 @@ def main():
                 [1809711614, 1809711594, 1809711595, 1809711597, 1809711615],
                 [1809711597, 1809711615, 1695023628, 1695023539, 1809711598]
                 ]
-    cycles = {id:{"n_ids":cycle} for id, cycle in enumerate(cycles)}
+    blocks = BlockTable.from_cycles(nodes, cycles)
+    cycles = {id:{"n_ids":blocks.cycle(id), "obb":blocks.obb[id]}
+                                            for id in range(len(blocks))}
 
     ##########################
     # Compute various data for each cycle
     ##########################
-    compute_centroids(cycles, nodes)
-    compute_neighbors_MST(cycles, input)
-    compute_building_density(cycles, input, nodes, ways)
+    compute_centroids(cycles, blocks)
+    compute_neighbors(cycles, blocks, opt.neighbors)
+    compute_building_density(cycles, prefix, nodes, ways, blocks)
 
     ##########################
     # Easy to visualize plot (only roads, then roads+buildings)
@@ -260,7 +309,8 @@ def main():
     # buildings = {}
     # for c_id in cycles:
     #    try:
-    #        buildings.update(cycles[c_id]["buildings"])
+    #        buildings.update({w_id: ways[w_id] for w_id in
+    #                          cycles[c_id]["buildings"]})
     #    except:
     #        print("Failed to fetch density of {}".format(c_id))
     #
@@ -306,10 +356,29 @@ def main():
 
     top_acc = (0,0)
     pop_range = 10
-    output_file = "{}/experiment_top[{}][{}].osm"
+    output_file = "{}/experiment_top[{}][{}]." + opt.format
     accuracies = [[[] for i in range(pop_range)] for j in range(pop_range)]
     log("Starting evaluation process...")
     file1 = open("_log_accuracies".format(output),"w")
+    # elites are evaluated in memory, their files are written in the
+    # background while the next ones are generated
+    writer = ThreadPoolExecutor(max_workers=1)
+    writes = []
+    # the workers are started from a clean process rather than forked from
+    # this one, which runs the classifier and the writer thread
+    pool = None
+    if opt.processes > 1:
+        context = "forkserver" \
+            if "forkserver" in multiprocessing.get_all_start_methods() \
+            else "spawn"
+        pool = ProcessPoolExecutor(opt.processes,
+                                   multiprocessing.get_context(context))
+    if opt.delta:
+        manifest = delta.write_base(output, nodes, ways, opt.format)
+        # the changes are written against a copy of the map of their own,
+        # which the writer thread reads while the map is copied for the
+        # next elite
+        base_nodes, base_ways = nodes.copy(), ways.copy()
     for i in range(len(top_individuals)):
         for j in range(len(top_individuals[i])):
             pop = top_individuals[i][j]
@@ -317,11 +386,21 @@ def main():
             if len(pop) > 0:
                 top_ind = top_individuals[i][j][0]
                 ind_file = output_file.format(output, i,j)
-                log("Saving generated output to {}...".format(ind_file))
-                _n, _w = generate_ind(nodes,ways,cycles,top_ind,
-                                       chrom_idx,ind_file)
-                acc = accuracy(ind_file, model)
+                _n, _w = generate_ind(nodes,ways,cycles,top_ind,chrom_idx,
+                                      pool=pool, workers=opt.processes,
+                                      seed=i*pop_range+j)
+                acc = accuracy_data(_n.values(), _w.values(), model,
+                                    handler.get_bounds(_n.values()))
                 log("Accuracy: {:.5f}".format(acc))
+                if opt.delta:
+                    name = "experiment_top[{}][{}]".format(i, j)
+                    writes.append(writer.submit(delta.add_map, output,
+                                  manifest, name, base_nodes, base_ways, _n, _w,
+                                  accuracy=acc))
+                elif opt.write_elites:
+                    log("Saving generated output to {}...".format(ind_file))
+                    writes.append(writer.submit(handler.write_data, ind_file,
+                                                _n.values(), _w.values()))
 
             accuracies[i][j].append(acc)
             if accuracies[i][j] > accuracies[top_acc[0]][top_acc[1]]:
@@ -329,12 +408,18 @@ def main():
             file1.write("{},{},{}\n".format(i,j,acc))
 
     file1.close()
+    for w in writes: w.result()
+    writer.shutdown()
+    if pool != None: pool.shutdown()
     for i in range(len(accuracies)):
         for j in range(len(accuracies[i])):
             print("Accuracies for [{}][{}]: {}".format(i,j, accuracies[i][j]))
 
     best_output = output_file.format(output, top_acc[0], top_acc[1])
     print("Best output in terms of similarity: {}".format(best_output))
+    if opt.delta:
+        print("Elites are stored as changes to {}/{}, load them with "\
+              "lib.delta.load_map".format(output, manifest["base"]))
 
     ##########################
     # Plot of the output (optional)
@@ -1,31 +1,25 @@
 import osmium
 import copy
+from lib.store import NodeStore, WayStore
 
 class Map(osmium.SimpleHandler):
     def __init__(self):
         osmium.SimpleHandler.__init__(self)
-        self.nodes = {}
-        self.ways = {}
+        self.nodes = NodeStore()
+        self.ways = WayStore()
 
     def node(self, n):
-        node = OSMNode(n)
-        #print("Original: {} \nCopied:   {}".format(n, node))
-        self.nodes[node.id] = node
+        self.nodes.add_osmium_node(n)
 
     def way(self, w):
-        way = OSMWay(w)
-        #print("Original: {} \nCopied:   {}".format(w, way))
-        self.ways[way.id] = way
+        self.ways.add_osmium_way(w)
 
     def relation(self, r):
         pass
 
     def get_ways_by_tag(self, tag):
-        ways = []
-        for id, w in self.ways.items():
-            if tag in w.tags.keys():
-                ways.append(w)
-        return ways
+        return [self.ways[w_id] for w_id in
+                        self.ways.query({tag: None}).tolist()]
 
     def get_highways(self):
         highway_ways = self.get_ways_by_tag("highway")
@@ -36,6 +30,91 @@ class Map(osmium.SimpleHandler):
 
         return highway_ways, highway_nodes
 
+# Readers used for filtered loading (see handler.extract_data). Each one only
+# implements the callback of the object type it needs, so osmium skips the
+# other types, and only the objects that pass the filter are copied.
+
+# checks osm tags against a filter in the format of WayStore.query
+def tags_match(tags, query):
+    for key, values in query.items():
+        if key not in tags: continue
+        if values == None: return True
+        if isinstance(values, str): values = [values]
+        if tags[key] in values: return True
+    return False
+
+# reads the ways matching tags (same format as in WayStore.query, None
+# accepts every way) that reference at least one of node_ids (if given)
+class WayReader(osmium.SimpleHandler):
+    def __init__(self, tags=None, node_ids=None):
+        osmium.SimpleHandler.__init__(self)
+        self.ways = WayStore()
+        self.tags = tags
+        self.node_ids = node_ids
+
+    def way(self, w):
+        if self.tags != None and not tags_match(w.tags, self.tags): return
+        if self.node_ids != None:
+            for n in w.nodes:
+                if n.ref in self.node_ids: break
+            else:
+                return
+        self.ways.add_osmium_way(w)
+
+# reads the nodes in node_ids (if given) that are inside bbox (if given),
+# bbox being (min_lon, min_lat, max_lon, max_lat). With ids_only, just the
+# ids of the accepted nodes are collected
+class NodeReader(osmium.SimpleHandler):
+    def __init__(self, node_ids=None, bbox=None, ids_only=False):
+        osmium.SimpleHandler.__init__(self)
+        self.nodes = NodeStore()
+        self.ids = set()
+        self.node_ids = node_ids
+        self.bbox = bbox
+        self.ids_only = ids_only
+
+    def node(self, n):
+        if self.node_ids != None and n.id not in self.node_ids: return
+        if self.bbox != None:
+            min_lon, min_lat, max_lon, max_lat = self.bbox
+            lon, lat = n.location.lon, n.location.lat
+            if lon < min_lon or lon > max_lon or lat < min_lat or lat > max_lat:
+                return
+        if self.ids_only: self.ids.add(n.id)
+        else: self.nodes.add_osmium_node(n)
+
+# reads, in a single pass, the ways matching tags (and touching bbox, if
+# given) together with the locations of their nodes, taken from the node
+# location index that osmium fills before calling way(). Use it with
+# apply_file(input, locations=True, idx=...), where idx can keep the index
+# on disk (e.g. "sparse_file_array,nodes.idx") for very large extracts.
+# Nodes are created only for the ways kept, without their tags and metadata
+class LocatedWayReader(osmium.SimpleHandler):
+    def __init__(self, tags=None, bbox=None):
+        osmium.SimpleHandler.__init__(self)
+        self.nodes = NodeStore()
+        self.ways = WayStore()
+        self.tags = tags
+        self.bbox = bbox
+
+    def way(self, w):
+        if self.tags != None and not tags_match(w.tags, self.tags): return
+        locations = []
+        for n in w.nodes:
+            # nodes missing from the extract (ways cut at its border)
+            if not n.location.valid(): return
+            locations.append((n.ref, n.location.lon, n.location.lat))
+        if self.bbox != None:
+            min_lon, min_lat, max_lon, max_lat = self.bbox
+            for ref, lon, lat in locations:
+                if min_lon <= lon <= max_lon and min_lat <= lat <= max_lat:
+                    break
+            else:
+                return
+        self.ways.add_osmium_way(w)
+        for ref, lon, lat in locations:
+            if ref not in self.nodes: self.nodes.add(ref, lon, lat)
+
 class OSMNode():
     def __init__(self, obj=None):
         if obj == None: return
@@ -79,3 +158,21 @@ class OSMWay():
 
     def __repr__(self):
         return ("w{}: nodes={} tags={}".format(self.id, self.nodes, self.tags))
+
+# reads an osmChange file: created and modified objects go to the nodes and
+# ways stores, the ids of deleted ones to deleted_nodes and deleted_ways
+class ChangeReader(osmium.SimpleHandler):
+    def __init__(self):
+        osmium.SimpleHandler.__init__(self)
+        self.nodes = NodeStore()
+        self.ways = WayStore()
+        self.deleted_nodes = []
+        self.deleted_ways = []
+
+    def node(self, n):
+        if n.deleted: self.deleted_nodes.append(n.id)
+        else: self.nodes.add_osmium_node(n)
+
+    def way(self, w):
+        if w.deleted: self.deleted_ways.append(w.id)
+        else: self.ways.add_osmium_way(w)
@@ -0,0 +1,121 @@
+import numpy as np
+import lib.obb as obb
+import lib.neighbors as neighbors
+
+# what two blocks can share to be adjacent (see BlockTable.adjacency)
+ADJACENCY = ("edges", "nodes")
+
+# Geometry of the blocks (road cycles) of a map, computed once for all of
+# them and kept as one array per property (struct of arrays), row i being
+# the block cycles[i]. Everything is in the projected coordinates of the
+# nodes (NodeStore.xy, meters):
+#   area      area in m2
+#   centroid  mean of the nodes of the block (as helper.centroid)
+#   bbox      min_x, min_y, max_x, max_y
+#   obb       the 4 corners of its minimum bounding rectangle
+#   longest   longest side of the obb
+#   shortest  shortest side of the obb
+#   ratio     shortest / longest
+# The node ids of the blocks are kept packed as (node ids, offsets). The
+# table is pickled next to the input map by the scripts and read by every
+# stage that needs the geometry of a block (filtering, centroids, density,
+# parcel generation).
+class BlockTable():
+    def __init__(self, node_ids, offsets, area, centroid, bbox, obb, longest,
+                 shortest):
+        self.node_ids = node_ids
+        self.offsets = offsets
+        self.area = area
+        self.centroid = centroid
+        self.bbox = bbox
+        self.obb = obb
+        self.longest = longest
+        self.shortest = shortest
+        self.ratio = shortest / longest
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # params: the nodes store and a list of cycles (lists of node ids)
+    @classmethod
+    def from_cycles(cls, nodes, cycles):
+        lengths = np.array([len(cycle) for cycle in cycles], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        if len(cycles) == 0:
+            empty = np.zeros(0)
+            return cls(np.zeros(0, dtype=np.int64), offsets, empty,
+                       np.zeros((0, 2)), np.zeros((0, 4)), np.zeros((0, 4, 2)),
+                       empty, empty)
+        node_ids = np.concatenate([np.asarray(cycle, dtype=np.int64)
+                                                        for cycle in cycles])
+        points = nodes.xy(node_ids)
+        starts = offsets[:-1]
+
+        # shoelace formula: sum of x[i] * (y[i+1] - y[i-1])
+        owner = np.repeat(np.arange(len(cycles)), lengths)
+        position = np.arange(len(node_ids)) - starts[owner]
+        after = starts[owner] + (position + 1) % lengths[owner]
+        before = starts[owner] + (position - 1) % lengths[owner]
+        x, y = points[:,0], points[:,1]
+        terms = x * (y[after] - y[before])
+        area = np.abs(np.add.reduceat(terms, starts)) / 2
+        area[lengths <= 2] = 0
+
+        centroid = np.add.reduceat(points, starts) / lengths[:,None]
+        bbox = np.column_stack((np.minimum.reduceat(points, starts),
+                                np.maximum.reduceat(points, starts)))
+
+        boxes = obb.minimum_bounding_rectangles(points, offsets)
+        delta = np.roll(boxes, -1, axis=1) - boxes
+        sides = np.sqrt(delta[:,:,0]**2 + delta[:,:,1]**2)
+        return cls(node_ids, offsets, area, centroid, bbox, boxes,
+                   sides.max(axis=1), sides.min(axis=1))
+
+    # params: what two blocks have to share to be adjacent: a road segment
+    # ("edges", the blocks on both sides of a street) or a road node
+    # ("nodes", which also links the blocks meeting at a junction)
+    # returns: the CSR arrays (offsets, indices) of the adjacency of the
+    # blocks (see lib.neighbors), found by grouping the segments or nodes
+    # of every block in one pass
+    def adjacency(self, shared="edges"):
+        if shared not in ADJACENCY:
+            raise ValueError("Unknown adjacency {}, use one of {}".format(
+                                                        shared, ADJACENCY))
+        lengths = np.diff(self.offsets)
+        owner = np.repeat(np.arange(len(self)), lengths)
+        keys = self.node_ids[:,None]
+        if shared == "edges":
+            starts = self.offsets[:-1]
+            position = np.arange(len(self.node_ids)) - starts[owner]
+            after = starts[owner] + (position + 1) % lengths[owner]
+            keys = np.sort(np.column_stack((keys[:,0],
+                                            self.node_ids[after])), axis=1)
+        # each segment/node once per block, grouped by segment/node
+        table = np.unique(np.column_stack((keys, owner)), axis=0)
+        keys, owner = table[:,:-1], table[:,-1]
+        pairs = [np.zeros((0, 2), dtype=np.int64)]
+        for d in range(1, len(table)):
+            same = (keys[d:] == keys[:-d]).all(axis=1)
+            if not same.any(): break
+            pairs.append(np.column_stack((owner[:-d][same], owner[d:][same])))
+        return neighbors.from_pairs(len(self), np.concatenate(pairs))
+
+    # the node ids of block i as a list
+    def cycle(self, i):
+        return self.node_ids[self.offsets[i]:self.offsets[i+1]].tolist()
+
+    def cycles(self):
+        return [self.cycle(i) for i in range(len(self))]
+
+    # a new table with the blocks selected by a boolean mask or indexes
+    def subset(self, selection):
+        index = np.arange(len(self))[selection]
+        lengths = np.diff(self.offsets)[index]
+        node_ids = np.concatenate([self.node_ids[self.offsets[i]:
+                                   self.offsets[i+1]] for i in index]) \
+                   if len(index) > 0 else self.node_ids[:0]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        return BlockTable(node_ids, offsets, self.area[index],
+                          self.centroid[index], self.bbox[index],
+                          self.obb[index], self.longest[index],
+                          self.shortest[index])
@@ -1,5 +1,5 @@
 from lib.Map import OSMWay, OSMNode
-from lib import settings
+import lib.ids as ids
 import lib.trigonometry as trig
 import numpy as np
 import random
@@ -8,59 +8,172 @@ import logging
 import pyclipper
 import lib.helper as helper
 
-def new_node(lon, lat, color="black"):
+# a node at x, y in the projected coordinates of the map (meters), its
+# lon/lat are computed when it is added to the nodes store
+# (id_range is an IdRange to take its id from, the global counter by default)
+def new_node(x, y, color="black", id_range=None):
     n = OSMNode()
-    n.id = settings.id_counter
-    settings.id_counter += 1
-    n.location = (lon, lat)
+    n.id = int(new_ids(1, id_range)[0])
+    n.xy = (x, y)
     n.color = color
     return n
 
-def new_way(nodes=[], tags={}):
+# returns: count consecutive new ids from an IdRange (see lib.ids) or, by
+# default, from the global counter
+def new_ids(count, id_range=None):
+    if id_range == None: return ids.take(count)
+    return id_range.take(count)
+
+def new_way(nodes=[], tags={}, id_range=None):
     way = OSMWay()
-    way.id = settings.id_counter
-    settings.id_counter += 1
+    way.id = int(new_ids(1, id_range)[0])
     way.color = "blue" #  manually set buildings as specific color
     way.nodes = nodes
     way.tags = tags
     return way
 
-# find a polygon that has less than 50% of the area
-# of the lot and use that for the building itself
-def generate_offset_polygon_iterative(lot, threshold=0.8, offset=-10000):
-    
-    nodes, ways = {}, {}
-    subj = []
-    initial_area = generated_area = helper.get_area(lot)
-    for x, y in lot:
-        subj.append((pyclipper.scale_to_clipper(x),
-                     pyclipper.scale_to_clipper(y)))
-
-    while generated_area/initial_area > 0.4:
-        pco = pyclipper.PyclipperOffset()
-        pco.AddPath(subj, pyclipper.JT_MITER, pyclipper.ET_CLOSEDPOLYGON)
-        solution = pco.Execute(offset)
-
-        if len(solution) == 0:
-            # failed to get offset polygon with the fixed param
-            return nodes, ways
+# clipper works on integers: coordinates (meters) are scaled to millimeters
+CLIPPER_SCALE = 1000
 
-        building_lot = [(pyclipper.scale_from_clipper(x),
-                        pyclipper.scale_from_clipper(y)) for x, y in solution[0]]
-
-
-        generated_area = helper.get_area(building_lot)
-        offset *= 1.5
+# fraction of the area of a lot covered by the footprint of its building
+FOOTPRINT_AREA = 0.4
 
+# params: the clipper path of a footprint (see inset_polygons)
+# returns: the nodes and the way of a building on it
+def new_building(footprint, id_range=None):
+    nodes, ways = {}, {}
     building_nodes = []
-    for x, y in building_lot:
-        n = new_node(x, y)
+    for x, y in (footprint / CLIPPER_SCALE).tolist():
+        n = new_node(x, y, id_range=id_range)
         building_nodes.append(n.id)
         nodes[n.id] = n
 
-    way = new_way()
+    way = new_way(id_range=id_range)
     way.nodes = building_nodes+[building_nodes[0]]
     way.tags = {"building":"residential"}
     ways[way.id] = way
 
     return nodes, ways
+
+# Insets a batch of lots until their area is a fraction of the original one.
+# The area left decreases with the inset (to 0, when the polygon vanishes),
+# so the inset giving that fraction is a root, found by false position
+# (Illinois) on the planar area: it is first bracketed by an inset growing
+# 1.5 times per step from a first one (by default estimated from the area
+# and perimeter of the lot), then narrowed down until the fraction is
+# within tolerance or the bracket is 1 clipper unit wide.
+# Every lot is solved at once: the brackets of all of them are arrays
+# updated together, and at each step the lots still being solved are inset
+# (clipper insets all the paths it is given by the same distance, so it is
+# called once per lot, on an offsetter built for it once) and the areas of
+# all the polygons left are computed in one pass. Coordinates stay in
+# clipper space (integers, see CLIPPER_SCALE) from the lots to the
+# footprints.
+# params: the lots (lists of x, y in meters), the area fraction, the first
+# inset tried (meters, positive inwards, None to estimate it), the
+# tolerance on the fraction and the maximum number of insets tried per lot
+# returns: the footprint of each lot as an (k, 2) int64 array of clipper
+# coordinates (the largest polygon left after the inset), or None
+def inset_polygons(lots, fraction=FOOTPRINT_AREA, inset=None, tolerance=0.01,
+                   max_iterations=50):
+    # truncated, as pyclipper.scale_to_clipper does
+    paths = [(np.asarray(lot, dtype=np.float64).reshape(-1, 2) *
+              CLIPPER_SCALE).astype(np.int64) for lot in lots]
+    area, perimeter = _measure(paths)
+    if inset == None:
+        # the inset that would remove the area wanted if the perimeter did
+        # not shrink (less than the one wanted for convex lots)
+        d = area * (1 - fraction) / np.maximum(perimeter, 1)
+    else:
+        d = np.full(len(paths), inset * CLIPPER_SCALE, dtype=np.float64)
+    d = np.maximum(d, 1)
+
+    offsetters = []
+    for path in paths:
+        pco = pyclipper.PyclipperOffset()
+        pco.AddPath(path.tolist(), pyclipper.JT_MITER,
+                    pyclipper.ET_CLOSEDPOLYGON)
+        offsetters.append(pco)
+
+    # brackets [lo, hi] with more area than wanted at lo, not more at hi
+    # (hi is only known once bracketed), the end moved last (-1 for lo, 1
+    # for hi) and the best footprint found so far
+    lo, e_lo = np.zeros(len(paths)), np.full(len(paths), 1 - fraction)
+    hi, e_hi = d.copy(), np.zeros(len(paths))
+    bracketed = np.zeros(len(paths), dtype=bool)
+    side = np.zeros(len(paths), dtype=np.int64)
+    footprints = [None] * len(paths)
+    best_error = np.full(len(paths), np.inf)
+    active = area > 0
+
+    for _ in range(max_iterations):
+        lots = np.flatnonzero(active)
+        if len(lots) == 0: break
+        e, polygons = _inset(offsetters, lots, d[lots], area[lots], fraction)
+        for i, lot, polygon in zip(range(len(lots)), lots.tolist(), polygons):
+            if polygon is not None and abs(e[i]) < best_error[lot]:
+                footprints[lot], best_error[lot] = polygon, abs(e[i])
+
+        # still bracketing: move past the inset while there is more area
+        growing = ~bracketed[lots] & (e > 0)
+        g = lots[growing]
+        lo[g], e_lo[g], hi[g] = d[g], e[growing], d[g] * 1.5
+        # false position, halving the weight of an end kept twice (Illinois)
+        moved = ~growing
+        up = moved & (e > 0)
+        down = moved & (e <= 0)
+        u, w = lots[up], lots[down]
+        e_hi[u[side[u] == -1]] /= 2
+        e_lo[w[side[w] == 1]] /= 2
+        lo[u], e_lo[u], side[u] = d[u], e[up], -1
+        hi[w], e_hi[w], side[w] = d[w], e[down], 1
+        # the inset closing the bracket does not count as a move
+        side[lots[moved & ~bracketed[lots]]] = 0
+        bracketed[lots[moved]] = True
+
+        m = lots[moved]
+        d[g] = hi[g]
+        d[m] = (lo[m] * e_hi[m] - hi[m] * e_lo[m]) / (e_hi[m] - e_lo[m])
+        active[lots[np.abs(e) <= tolerance]] = False
+        active[m[hi[m] - lo[m] <= 1]] = False
+    return footprints
+
+# returns: the area and perimeter of clipper paths
+def _measure(paths):
+    if len(paths) == 0: return np.zeros(0), np.zeros(0)
+    lengths = np.array([len(path) for path in paths], dtype=np.int64)
+    points = np.concatenate(paths).astype(np.float64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    owner = np.repeat(np.arange(len(paths)), lengths)
+    after = starts[owner] + (np.arange(len(points)) - starts[owner] + 1) % \
+            lengths[owner]
+    x, y = points[:,0], points[:,1]
+    cross = x * y[after] - x[after] * y
+    delta = points[after] - points
+    area = np.abs(np.bincount(owner, cross, minlength=len(paths))) / 2
+    perimeter = np.bincount(owner, np.sqrt((delta**2).sum(axis=1)),
+                            minlength=len(paths))
+    return area, perimeter
+
+# insets lots (indexes in offsetters) by d (clipper units)
+# returns: the fraction of their area left minus the one wanted, and the
+# largest polygon left of each (or None)
+def _inset(offsetters, lots, d, area, fraction):
+    pieces, owner = [], []
+    for i, lot in enumerate(lots.tolist()):
+        solution = offsetters[lot].Execute(-d[i])
+        pieces += [np.array(path, dtype=np.int64) for path in solution]
+        owner += [i] * len(solution)
+    owner = np.array(owner, dtype=np.int64)
+    piece_area, _ = _measure(pieces)
+    left = np.bincount(owner, piece_area, minlength=len(lots))
+
+    polygons = [None] * len(lots)
+    if len(pieces) > 0:
+        # the largest piece of each lot: the last of its pieces sorted by area
+        order = np.lexsort((piece_area, owner))
+        last = np.flatnonzero(np.append(owner[order][1:] !=
+                                        owner[order][:-1], True))
+        for k in order[last].tolist():
+            polygons[owner[k]] = pieces[k]
+    return left / area - fraction, polygons
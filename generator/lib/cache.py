@@ -0,0 +1,59 @@
+import os
+import shutil
+import hashlib
+from lib.store import NodeStore, WayStore
+from lib.logger import log
+
+# Binary cache of parsed maps. The node and way stores of an input file are
+# saved as .npy columns (plus the tag dictionary) under "{input}_map_cache",
+# in a folder named after the hash of the file contents, the cache format
+# version and the parameters used to parse it. Loading memory-maps the
+# columns, so a warm start does not parse the OSM file at all.
+
+# change it whenever the saved layout changes, so that old caches are ignored
+CACHE_VERSION = 2
+
+def cache_folder(filename):
+    return "{}_map_cache".format(filename)
+
+# returns a key for the contents of a file parsed with the passed params
+def cache_key(filename, *params):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(repr((CACHE_VERSION,) + params).encode())
+    return digest.hexdigest()
+
+# returns the prefix of the files of the data computed from a map (e.g.
+# "{prefix}_roads_data_v2"): the name of its file plus a short hash of the
+# params it was loaded with (see handler.load_params), since the cycles,
+# blocks and meters of the map depend on the part of the file loaded
+def data_prefix(filename, *params):
+    digest = hashlib.sha1(repr(params).encode()).hexdigest()
+    return "{}_{}".format(filename, digest[:12])
+
+# returns the cached nodes and ways of filename for key, or None, None
+def load_map(filename, key):
+    folder = os.path.join(cache_folder(filename), key)
+    if not os.path.isdir(folder): return None, None
+    try:
+        nodes = NodeStore.load(os.path.join(folder, "nodes"))
+        ways = WayStore.load(os.path.join(folder, "ways"))
+    except Exception:
+        log("FAILED load map cache {}".format(folder))
+        return None, None
+    return nodes, ways
+
+# saves nodes and ways as the cache of filename for key, replacing the
+# previous one for that key only (the maps parsed with other params are kept)
+def save_map(filename, key, nodes, ways):
+    root = cache_folder(filename)
+    os.makedirs(root, exist_ok=True)
+    temp = os.path.join(root, "{}.tmp".format(key))
+    shutil.rmtree(temp, ignore_errors=True)
+    nodes.save(os.path.join(temp, "nodes"))
+    ways.save(os.path.join(temp, "ways"))
+    folder = os.path.join(root, key)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.rename(temp, folder)
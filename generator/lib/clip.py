@@ -0,0 +1,127 @@
+import os
+import osmium
+import matplotlib.path
+import numpy as np
+from lib.logger import log
+
+# Streaming clipper for OSM files. The input is read twice and never loaded:
+# the first pass marks the nodes inside the area and the ways touching them,
+# the second one copies the marked objects straight to the output, which is
+# written once. Relations are not copied.
+
+# tells if nodes are inside a bounding box (min_lon, min_lat, max_lon,
+# max_lat) or, if given, a polygon [(lon, lat), ...] (checked against its
+# bounding box first)
+class Area():
+    def __init__(self, bbox=None, polygon=None):
+        self.path = None
+        if polygon != None:
+            polygon = np.array(polygon, dtype=np.float64)
+            self.path = matplotlib.path.Path(polygon)
+            bbox = (*polygon.min(axis=0), *polygon.max(axis=0))
+        self.min_lon, self.min_lat, self.max_lon, self.max_lat = bbox
+
+    def contains(self, lon, lat):
+        if lon < self.min_lon or lon > self.max_lon or \
+           lat < self.min_lat or lat > self.max_lat:
+            return False
+        return self.path == None or self.path.contains_point((lon, lat))
+
+# first pass: ids of the nodes inside the area, of the ways with at least
+# one node inside it and of the nodes those ways need
+class _ClipReader(osmium.SimpleHandler):
+    def __init__(self, area, complete_ways):
+        osmium.SimpleHandler.__init__(self)
+        self.region = area
+        self.complete_ways = complete_ways
+        self.inside = set()
+        self.nodes = set()
+        self.ways = set()
+
+    def node(self, n):
+        if n.location.valid() and self.region.contains(n.location.lon,
+                                                     n.location.lat):
+            self.inside.add(n.id)
+
+    def way(self, w):
+        refs = [n.ref for n in w.nodes]
+        for ref in refs:
+            if ref in self.inside: break
+        else:
+            return
+        self.ways.add(w.id)
+        if self.complete_ways: self.nodes.update(refs)
+
+# second pass: copies the selected objects to writer
+class _ClipWriter(osmium.SimpleHandler):
+    def __init__(self, writer, nodes, ways, inside, complete_ways):
+        osmium.SimpleHandler.__init__(self)
+        self.writer = writer
+        self.nodes = nodes
+        self.ways = ways
+        self.inside = inside
+        self.complete_ways = complete_ways
+        self.node_count = 0
+        self.way_count = 0
+
+    def node(self, n):
+        if n.id in self.nodes:
+            self.writer.add_node(n)
+            self.node_count += 1
+
+    def way(self, w):
+        if w.id not in self.ways: return
+        if self.complete_ways:
+            self.writer.add_way(w)
+        else:
+            refs = [n.ref for n in w.nodes if n.ref in self.inside]
+            self.writer.add_way(w.replace(nodes=refs))
+        self.way_count += 1
+
+# the input file name with _clipped before its extension (.osm, .osm.pbf...)
+def clipped_name(filename):
+    folder, name = os.path.split(filename)
+    dot = name.find(".osm")
+    if dot < 0: dot = len(os.path.splitext(name)[0])
+    return os.path.join(folder, name[:dot] + "_clipped" + name[dot:])
+
+# params: the input and output files (any format osmium reads/writes, the
+# output defaults to the input name with _clipped, see clipped_name, and
+# can be the input itself to replace it), the area to keep, as either a
+# bounding box (min_lon, min_lat, max_lon, max_lat) or a polygon
+# [(lon, lat), ...], and how to treat the ways crossing its border: with complete_ways they are
+# kept whole together with their nodes outside of the area, so that every
+# way written is intact; otherwise their nodes outside of the area are
+# dropped from them
+# returns: the number of nodes and ways written
+def clip(input, output=None, bbox=None, polygon=None, complete_ways=True):
+    if (bbox == None) == (polygon == None):
+        raise ValueError("Pass either a bounding box or a polygon to clip")
+    area = Area(bbox, polygon)
+    reader = _ClipReader(area, complete_ways)
+    reader.apply_file(input)
+    nodes = reader.inside
+    if complete_ways: nodes = reader.nodes | reader.inside
+
+    if output == None: output = clipped_name(input)
+    target = output
+    if output == input:
+        # the file being read cannot be overwritten, so write next to it
+        folder, name = os.path.split(input)
+        target = os.path.join(folder, "_clip_" + name)
+    try:
+        os.remove(target)
+    except FileNotFoundError: pass
+    header = osmium.io.Header()
+    header.add_box(osmium.osm.Box(
+                        osmium.osm.Location(area.min_lon, area.min_lat),
+                        osmium.osm.Location(area.max_lon, area.max_lat)))
+    writer = osmium.SimpleWriter(target, 4096*1024, header)
+    copier = _ClipWriter(writer, nodes, reader.ways, reader.inside,
+                         complete_ways)
+    copier.apply_file(input)
+    writer.close()
+    if target != output: os.replace(target, input)
+    log("Clipped {} to {} nodes and {} ways".format(input, copier.node_count,
+                                                   copier.way_count), "DEBUG")
+    return copier.node_count, copier.way_count
@@ -0,0 +1,120 @@
+import os
+import json
+import osmium
+import lib.handler as handler
+from lib.Map import ChangeReader
+from lib.logger import log
+
+# Delta output for generated maps. The input map is written once as the base
+# of an output folder and every generated map (e.g. an elite of MAP-Elites)
+# as an osmChange file holding only the nodes and ways it created, modified
+# or deleted. A manifest lists the base file and the change file (plus any
+# extra info, e.g. the accuracy) of each map, and load_map rebuilds any of
+# them on demand.
+
+MANIFEST = "manifest.json"
+
+# the metadata a stored object has (generated objects have none)
+def _meta(obj):
+    meta = {}
+    for attr in ("changeset", "timestamp", "uid"):
+        try:
+            meta[attr] = getattr(obj, attr)
+        except AttributeError: pass
+    return meta
+
+def _node(n, version, visible=True):
+    return osmium.osm.mutable.Node(id=n.id, location=n.location,
+                                   tags=n.tags if visible else {},
+                                   version=version, visible=visible, **_meta(n))
+
+def _way(w, version, visible=True):
+    return osmium.osm.mutable.Way(id=w.id, nodes=list(w.nodes) if visible else [],
+                                  tags=w.tags if visible else {},
+                                  version=version, visible=visible, **_meta(w))
+
+# params: a filename (.osc, .osc.gz, ...), the nodes and ways a map was
+# generated from and the nodes and ways of the generated map
+# writes the differences as an osmChange file. Created objects get version 1
+# and modified ones the version of the base object + 1, which is how osmium
+# sorts them into the create and modify blocks
+# returns: the number of objects written
+def write_change(filename, base_nodes, base_ways, nodes, ways):
+    created_nodes, modified_nodes, deleted_nodes = nodes.diff(base_nodes)
+    created_ways, modified_ways, deleted_ways = ways.diff(base_ways)
+    handler.delete_file(filename)
+    writer = osmium.SimpleWriter(filename)
+    for n_id in created_nodes.tolist():
+        writer.add_node(_node(nodes[n_id], 1))
+    for n_id in modified_nodes.tolist():
+        version = getattr(base_nodes[n_id], "version", 0) + 1
+        writer.add_node(_node(nodes[n_id], version))
+    for w_id in created_ways.tolist():
+        writer.add_way(_way(ways[w_id], 1))
+    for w_id in modified_ways.tolist():
+        version = getattr(base_ways[w_id], "version", 0) + 1
+        writer.add_way(_way(ways[w_id], version))
+    for w_id in deleted_ways.tolist():
+        w = base_ways[w_id]
+        writer.add_way(_way(w, max(getattr(w, "version", 0), 1), False))
+    for n_id in deleted_nodes.tolist():
+        n = base_nodes[n_id]
+        writer.add_node(_node(n, max(getattr(n, "version", 0), 1), False))
+    writer.close()
+    return len(created_nodes) + len(modified_nodes) + len(deleted_nodes) + \
+           len(created_ways) + len(modified_ways) + len(deleted_ways)
+
+# applies the osmChange file filename to nodes and ways (in place)
+def apply_change(nodes, ways, filename):
+    change = ChangeReader()
+    change.apply_file(filename)
+    nodes.update(change.nodes)
+    ways.update(change.ways)
+    for w_id in change.deleted_ways:
+        if w_id in ways: del ways[w_id]
+    for n_id in change.deleted_nodes:
+        if n_id in nodes: del nodes[n_id]
+
+def save_manifest(folder, manifest):
+    with open(os.path.join(folder, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+def load_manifest(folder):
+    with open(os.path.join(folder, MANIFEST), "r") as f:
+        return json.load(f)
+
+# params: the output folder, the nodes and ways of the input map and the
+# format of the base file (osm, osm.gz, osm.bz2, osm.pbf)
+# writes the base map and an empty manifest
+# returns: the manifest
+def write_base(folder, nodes, ways, extension="osm"):
+    base = "base.{}".format(extension)
+    handler.write_data(os.path.join(folder, base), nodes.values(), ways.values())
+    compression = extension.split(".")[-1]
+    change_extension = "osc"
+    if compression in ("gz", "bz2"):
+        change_extension += "." + compression
+    manifest = {"base": base, "change_extension": change_extension, "maps": {}}
+    save_manifest(folder, manifest)
+    return manifest
+
+# params: the output folder and its manifest, the name of a generated map,
+# the nodes and ways of the base map and of the generated one, and any extra
+# info to keep in the manifest
+# writes the change file of the map and records it in the manifest
+def add_map(folder, manifest, name, base_nodes, base_ways, nodes, ways, **info):
+    change = "{}.{}".format(name, manifest["change_extension"])
+    count = write_change(os.path.join(folder, change), base_nodes, base_ways,
+                         nodes, ways)
+    log("Map {} written as {} changes to {}".format(name, count, change), "DEBUG")
+    manifest["maps"][name] = dict(info, change=change)
+    save_manifest(folder, manifest)
+
+# returns: the nodes and ways of the map name of an output folder, i.e.
+# its base map with the changes of the map applied
+def load_map(folder, name, use_cache=True):
+    manifest = load_manifest(folder)
+    base = os.path.join(folder, manifest["base"])
+    nodes, ways = handler.extract_data(base, use_cache=use_cache)
+    apply_change(nodes, ways, os.path.join(folder, manifest["maps"][name]["change"]))
+    return nodes, ways
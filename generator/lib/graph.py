@@ -0,0 +1,308 @@
+import numpy as np
+
+# values of the oneway tag for ways that can only be traveled in one
+# direction, and the ones meaning against the order of their nodes (the
+# same rules osmnx uses when it reads an OSM file)
+ONEWAY_VALUES = ["yes", "true", "1", "-1", "reverse", "T", "F"]
+REVERSED_VALUES = ["-1", "reverse", "T"]
+
+# Undirected road graph as compact arrays: the road node ids, the edges
+# between consecutive nodes of the ways (each edge stored once, as a pair of
+# node ids) and the way each edge comes from. It is built straight from the
+# node and way stores and only turned into a networkx graph by to_networkx
+# when an algorithm needs one. Nodes and edges are kept in the order osmnx
+# (graph_from_xml) followed by nx.Graph used to add them for the same ways,
+# so networkx algorithms give the same results as with the parsed file.
+# A contracted graph (see contract) also keeps the road nodes along each of
+# its edges in polylines, packed as (node ids, offsets).
+class RoadGraph():
+    def __init__(self, node_ids, edges, edge_ways, polylines=None,
+                 walk_keys=None):
+        self.node_ids = node_ids
+        self.edges = edges
+        self.edge_ways = edge_ways
+        self.polylines = polylines
+        self.walk_keys = walk_keys
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    # returns: the node ids along edge e, from its first node to its second one
+    def polyline(self, e):
+        flat, offsets = self._polylines()
+        return flat[offsets[e]:offsets[e+1]].tolist()
+
+    def _polylines(self):
+        if self.polylines != None: return self.polylines
+        return self.edges.reshape(-1), np.arange(0, 2*len(self.edges)+1, 2)
+
+    # for each half-edge (the edges, then the edges reversed), the lowest
+    # half-edge of the uncontracted graph along it and its position there.
+    # faces uses them to return the blocks in the same order and starting at
+    # the same node whether the graph was contracted or not
+    def _walk_keys(self):
+        if self.walk_keys != None: return self.walk_keys
+        n_half = 2*len(self.edges)
+        return np.arange(n_half), np.zeros(n_half, dtype=np.int64)
+
+    # params: the nodes and ways of the roads (e.g. filter_by_tag(nodes, ways,
+    # {"highway": None})). Every node of ways must be in nodes
+    @classmethod
+    def from_ways(cls, nodes, ways):
+        node_ids = nodes.ids
+        way_ids = ways.ids
+        refs, lengths = ways.node_refs()
+        owner = np.repeat(np.arange(len(way_ids)), lengths)
+
+        # drop consecutive repeated nodes of a way
+        keep = np.ones(len(refs), dtype=bool)
+        keep[1:] = (refs[1:] != refs[:-1]) | (owner[1:] != owner[:-1])
+        refs, owner = refs[keep], owner[keep]
+
+        # edges between consecutive nodes of the same way, numbered by their
+        # position in the way
+        same = owner[1:] == owner[:-1]
+        u, v, way = refs[:-1][same], refs[1:][same], owner[:-1][same]
+        first = np.searchsorted(way, np.arange(len(way_ids)))
+        position = np.arange(len(way)) - first[way]
+        count = np.bincount(way, minlength=len(way_ids))
+
+        oneway = np.isin(way_ids, ways.query({"oneway": ONEWAY_VALUES})) | \
+                 np.isin(way_ids, ways.query({"junction": ["roundabout"]}))
+        reverse = oneway & np.isin(way_ids,
+                                   ways.query({"oneway": REVERSED_VALUES}))
+
+        # directed edges in the order they are added: each way forwards
+        # (oneway reversed ways from their last node), then backwards for
+        # two-way ways
+        flip = reverse[way]
+        forward_u = np.where(flip, v, u)
+        forward_v = np.where(flip, u, v)
+        forward_position = np.where(flip, count[way] - 1 - position, position)
+        back = ~oneway[way]
+        d_u = np.concatenate((forward_u, v[back]))
+        d_v = np.concatenate((forward_v, u[back]))
+        d_way = np.concatenate((way, way[back]))
+        d_phase = np.concatenate((np.zeros(len(way), dtype=np.int64),
+                                  np.ones(np.count_nonzero(back), dtype=np.int64)))
+        d_position = np.concatenate((forward_position, position[back]))
+        order = np.lexsort((d_position, d_phase, d_way))
+        d_u, d_v, d_way = d_u[order], d_v[order], d_way[order]
+
+        # nx.Graph adds the edges going through the nodes in order and, for
+        # each node, through its (distinct) successors in insertion order
+        _, first_seen = np.unique(np.column_stack((d_u, d_v)), axis=0,
+                                  return_index=True)
+        first_seen = np.sort(first_seen)
+        sorter = np.argsort(node_ids)
+        rank = sorter[np.searchsorted(node_ids, d_u[first_seen], sorter=sorter)]
+        sequence = first_seen[np.lexsort((first_seen, rank))]
+
+        # each undirected edge is created the first time it is seen
+        pairs = np.column_stack((np.minimum(d_u, d_v), np.maximum(d_u, d_v)))
+        _, created = np.unique(pairs[sequence], axis=0, return_index=True)
+        sequence = sequence[np.sort(created)]
+        edges = np.column_stack((d_u[sequence], d_v[sequence]))
+        return cls(node_ids, edges, way_ids[d_way[sequence]])
+
+    # the graph as a networkx Graph with node ids as nodes. Contracted graphs
+    # may have parallel edges and loops, so they become a MultiGraph with the
+    # polyline of each edge as its "polyline" attribute
+    def to_networkx(self):
+        import networkx as nx
+        if self.polylines == None:
+            G = nx.Graph()
+            G.add_nodes_from(self.node_ids.tolist())
+            G.add_edges_from(self.edges.tolist())
+            return G
+        G = nx.MultiGraph()
+        G.add_nodes_from(self.node_ids.tolist())
+        for e, (u, v) in enumerate(self.edges.tolist()):
+            G.add_edge(u, v, polyline=self.polyline(e))
+        return G
+
+    # returns: the graph with every chain of degree-2 nodes (the shape nodes
+    # along a street) contracted into a single edge between the nodes at its
+    # ends (junctions and dead ends), or into a loop on one of its nodes for
+    # rings of roads with no junction. The nodes along each new edge are kept
+    # in polylines, so blocks found on the contracted graph are expanded back
+    # to every road node (see faces). Each new edge comes from the way of its
+    # first segment. Must be called on a graph built by from_ways
+    def contract(self):
+        n_edges = len(self.edges)
+        sorter = np.argsort(self.node_ids)
+        index = sorter[np.searchsorted(self.node_ids, self.edges.reshape(-1),
+                                       sorter=sorter)].reshape(-1, 2)
+        tail = np.concatenate((index[:,0], index[:,1]))
+        head = np.concatenate((index[:,1], index[:,0]))
+        degree = np.bincount(tail, minlength=len(self.node_ids))
+        twin = np.concatenate((np.arange(n_edges, 2*n_edges),
+                               np.arange(n_edges)))
+
+        # the half-edge a chain continues with after arriving at a degree-2
+        # node through h (-1 when the head of h is not a chain node)
+        order = np.argsort(tail, kind="stable")
+        start = np.cumsum(degree) - degree
+        chain_nodes = np.flatnonzero(degree == 2)
+        a, b = order[start[chain_nodes]], order[start[chain_nodes]+1]
+        through = np.full(2*n_edges, -1, dtype=np.int64)
+        through[twin[a]] = b
+        through[twin[b]] = a
+
+        through, tail_list = through.tolist(), tail.tolist()
+        junction = (degree != 2).tolist()
+        used = [False] * n_edges
+        chains = []
+        def walk(h):
+            chain = []
+            while h >= 0 and not used[h % n_edges]:
+                used[h % n_edges] = True
+                chain.append(h)
+                h = through[h]
+            return chain
+        for h in range(2*n_edges):
+            if junction[tail_list[h]] and not used[h % n_edges]:
+                chains.append(walk(h))
+        for e in range(n_edges):
+            if not used[e]:
+                junction[tail_list[e]] = True
+                chains.append(walk(e))
+
+        lengths = np.array([len(chain) for chain in chains], dtype=np.int64)
+        segments = np.array([h for chain in chains for h in chain],
+                            dtype=np.int64)
+        first = np.cumsum(lengths) - lengths
+        last = first + lengths - 1
+        node_ids = self.node_ids[np.array(junction, dtype=bool)]
+        edges = np.column_stack((self.node_ids[tail[segments[first]]],
+                                 self.node_ids[head[segments[last]]]))
+        edge_ways = self.edge_ways[segments[first] % n_edges]
+
+        # polylines: the tail of every segment plus the head of the last one
+        owner = np.repeat(np.arange(len(chains)), lengths)
+        flat = np.insert(self.node_ids[tail[segments]], last + 1,
+                         self.node_ids[head[segments[last]]])
+        offsets = np.concatenate(([0], np.cumsum(lengths + 1)))
+
+        # walk keys: the lowest segment along each chain, in both directions
+        back = twin[segments]
+        key, position = [], []
+        for values, flip in ((segments, False), (back, True)):
+            lowest = np.lexsort((values, owner))[first]
+            key.append(values[lowest])
+            at = lowest - first
+            position.append(lengths - 1 - at if flip else at)
+        walk_keys = (np.concatenate(key), np.concatenate(position))
+        return RoadGraph(node_ids, edges, edge_ways, (flat, offsets), walk_keys)
+
+    # params: the nodes store with the coordinates of the road nodes
+    # returns: the blocks of the road network, i.e. the bounded faces of its
+    # planar embedding, each as a list of node ids going counterclockwise
+    # around it. The half-edges leaving each node are sorted by angle and
+    # every face is walked by turning as left as possible at each node, so
+    # this is O(E log E). Dangling edges and spurs (walked on both sides in
+    # the same face) are dropped from the rings; when they connect a face to
+    # an inner group of roads, only the outer ring of the face is returned.
+    # The unbounded face of each connected part (clockwise) is left out. On a
+    # contracted graph the faces are walked over its edges and only the rings
+    # kept are expanded to their polylines, giving the same blocks
+    def faces(self, nodes):
+        n_edges = len(self.edges)
+        if n_edges == 0: return []
+        flat, offsets = self._polylines()
+        tail = np.concatenate((self.edges[:,0], self.edges[:,1]))
+        head = np.concatenate((self.edges[:,1], self.edges[:,0]))
+        # the node each half-edge leaves its tail towards
+        towards = np.concatenate((flat[offsets[:-1]+1], flat[offsets[1:]-2]))
+        sorter = np.argsort(self.node_ids)
+        tail_index = sorter[np.searchsorted(self.node_ids, tail, sorter=sorter)]
+        head_index = sorter[np.searchsorted(self.node_ids, head, sorter=sorter)]
+
+        # angles measured in the projected (metric) coordinates
+        road_ids = np.unique(flat)
+        coordinates = nodes.xy(road_ids)
+        delta = coordinates[np.searchsorted(road_ids, towards)] - \
+                coordinates[np.searchsorted(road_ids, tail)]
+        angle = np.arctan2(delta[:,1], delta[:,0])
+
+        # half-edges leaving each node, counterclockwise
+        order = np.lexsort((angle, tail_index))
+        rank = np.empty(2*n_edges, dtype=np.int64)
+        rank[order] = np.arange(2*n_edges)
+        degree = np.bincount(tail_index, minlength=len(self.node_ids))
+        start = np.cumsum(degree) - degree
+
+        # the half-edge after u->v in its face is the one leaving v right
+        # before v->u in counterclockwise order
+        twin = np.concatenate((np.arange(n_edges, 2*n_edges),
+                               np.arange(n_edges)))
+        first = start[head_index]
+        next_edge = order[first + (rank[twin] - first - 1) % degree[head_index]]
+
+        next_edge = next_edge.tolist()
+        face = [-1] * (2*n_edges)
+        rings = []
+        for h in range(2*n_edges):
+            if face[h] >= 0: continue
+            walk = []
+            while face[h] < 0:
+                face[h] = len(rings)
+                walk.append(h)
+                h = next_edge[h]
+            rings.append(walk)
+
+        # the nodes each half-edge goes through, up to its head (excluded)
+        lines = np.split(flat, offsets[1:-1])
+        lines = [line[:-1].tolist() for line in lines] + \
+                [line[:0:-1].tolist() for line in lines]
+        key, position = (k.tolist() for k in self._walk_keys())
+        twin = twin.tolist()
+        tail, head = tail.tolist(), head.tolist()
+        point = dict(zip(road_ids.tolist(), coordinates.tolist()))
+        blocks = []
+        for f, walk in enumerate(rings):
+            # walk from the lowest half-edge of the uncontracted graph
+            lowest = min(range(len(walk)), key=lambda i: key[walk[i]])
+            walk = walk[lowest:] + walk[:lowest]
+            kept = [h for h in walk if face[twin[h]] != f]
+            # a walk starting inside a chain only closes where it started
+            shift = position[walk[0]] if kept and kept[0] == walk[0] else 0
+            loops = _split_loops(kept, tail, head, shift > 0)
+            if len(loops) == 0: continue
+            rings_nodes = []
+            for loop in loops:
+                ring = [n for h in loop for n in lines[h]]
+                if loop[0] == walk[0]: ring = ring[shift:] + ring[:shift]
+                rings_nodes.append(ring)
+            areas = [_signed_area([point[n] for n in ring])
+                                                for ring in rings_nodes]
+            best = int(np.argmax(areas))
+            if areas[best] > 0:
+                blocks.append((key[walk[0]], rings_nodes[best]))
+        blocks.sort(key=lambda block: block[0])
+        return [ring for _, ring in blocks]
+
+# splits the half-edges left in a face walk (after removing the ones walked
+# on both sides) into the closed loops they form, as lists of half-edges.
+# Inner loops are walked between the two removed sides of the edge leading
+# to them, so they are nested like brackets in the walk. With whole_first,
+# the loop started by the first half-edge is only closed by the last one
+def _split_loops(walk, tail, head, whole_first=False):
+    loops = []
+    stack = []
+    current = []
+    for h in walk:
+        if current and head[current[-1]] != tail[h]:
+            stack.append(current)
+            current = []
+        current.append(h)
+        if head[h] == tail[current[0]] and (not whole_first or
+                                current[0] != walk[0] or h == walk[-1]):
+            loops.append(current)
+            current = stack.pop() if stack else []
+    return loops
+
+# signed area of a polygon (positive when counterclockwise)
+def _signed_area(points):
+    x, y = np.array(points).T
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
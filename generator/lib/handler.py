@@ -1,45 +1,106 @@
 from lib.Map import *
+from lib.store import NodeStore, StoreValues
+import lib.cache as map_cache
+import numpy as np
 import osmium
 import os
 
-# params: the path to an osm file in the system
-# returns: a list of node objects and a list of ways objects from the file
-def extract_data(input):
-    reader = Map()
-    reader.apply_file(input)
-    return reader.nodes, reader.ways
+# params: the path to an osm file in the system (.osm, .osm.pbf, ...),
+# optionally a tag filter (e.g. {"highway": None, "building": None}, see
+# WayStore.query), a bounding box (min_lon, min_lat, max_lon, max_lat) and
+# the type of node location index to read ways through (see below)
+# returns: a list of node objects and a list of ways objects from the file.
+# When filtering, only the matching ways (with at least one node inside bbox)
+# and the nodes they reference are ever copied; nodes of those ways that fall
+# outside of bbox are kept so that ways crossing its border stay complete.
+# With an index (e.g. "flex_mem", "dense_mmap_array" or
+# "sparse_file_array,nodes.idx" for a memory-mapped file on disk) the file is
+# read once and node locations are resolved by osmium for the kept ways only,
+# which is the way to load country-sized pbf extracts (node tags are lost)
+# With use_cache, the parsed map is saved in a binary cache next to the input
+# (see lib.cache) and memory-mapped from there while the file is unchanged.
+# The nodes are projected (see NodeStore.project) to meters around the center
+# of the map, the coordinates every geometric step of the generator uses
+def extract_data(input, tags=None, bbox=None, index=None, use_cache=False):
+    if use_cache:
+        key = map_cache.cache_key(input, *load_params(tags, bbox, index))
+        nodes, ways = map_cache.load_map(input, key)
+        if nodes == None:
+            nodes, ways = _read_data(input, tags, bbox, index)
+            map_cache.save_map(input, key, nodes, ways)
+    else:
+        nodes, ways = _read_data(input, tags, bbox, index)
+    nodes.project()
+    return nodes, ways
 
-# params: a path/name for the file, a list of nodes and list of ways
-# writes the osm XML file for the list of nodes and ways
+# returns: the params of extract_data that change the map loaded (which
+# index is used does not, only whether there is one)
+def load_params(tags=None, bbox=None, index=None):
+    tag_filter = sorted(tags.items()) if tags != None else None
+    return tag_filter, bbox, index != None
+
+def _read_data(input, tags, bbox, index):
+    if index != None:
+        reader = LocatedWayReader(tags, bbox)
+        reader.apply_file(input, locations=True, idx=index)
+        return reader.nodes, reader.ways
+
+    if tags == None and bbox == None:
+        reader = Map()
+        reader.apply_file(input)
+        return reader.nodes, reader.ways
+
+    inside = None
+    if bbox != None:
+        node_reader = NodeReader(bbox=bbox, ids_only=True)
+        node_reader.apply_file(input)
+        inside = node_reader.ids
+
+    way_reader = WayReader(tags, inside)
+    way_reader.apply_file(input)
+    refs, _ = way_reader.ways.node_refs()
+
+    node_reader = NodeReader(node_ids=set(refs.tolist()))
+    node_reader.apply_file(input)
+    return node_reader.nodes, way_reader.ways
+
+# params: a filename, the nodes and ways to write and the extra margin
+# for the bounds. The output format follows the extension (.osm, .osm.gz,
+# .osm.bz2, .osm.pbf). The bounds are computed first and written in the file
+# header, so the file is written in a single pass
 # returns: None
 def write_data(filename, nodes, ways, ex=0.002):
     delete_file(filename)
-    writer = osmium.SimpleWriter(filename)
+    min_lat, min_lon, max_lat, max_lon = get_bounds(nodes, ex)
+    header = osmium.io.Header()
+    header.add_box(osmium.osm.Box(osmium.osm.Location(min_lon, min_lat),
+                                  osmium.osm.Location(max_lon, max_lat)))
+    writer = osmium.SimpleWriter(filename, 4096*1024, header)
     for n in nodes: writer.add_node(n)
     for w in ways:  writer.add_way(w)
     writer.close()
 
-    min_lat, min_lon, max_lat, max_lon = get_bounds(nodes, ex)
-    insert_bounds(filename, min_lat, min_lon, max_lat, max_lon)
-
 def delete_file(filename):
     try:
         os.remove(filename) #clean file if exists
     except: pass
 
-# params: a filename and the bounds of a osm file
-# rewrites the osm XML file containing the bounds tag
-# returns: None
-def insert_bounds(filename, min_lat, min_lon, max_lat, max_lon):
-    lines = []
-    with open(filename, 'r') as f:
-        for line in f.readlines():
-            lines.append(line)
-    bounds = "  <bounds minlat=\"{}\" minlon=\"{}\" maxlat=\"{}\" maxlon=\"{}\"/>  \n"
-    lines.insert(2, bounds.format(min_lat, min_lon, max_lat, max_lon))
-    with open(filename, 'w') as f:
-        for line in lines:
-            f.write(line)
+# returns a (k, 2) array with the lon, lat of the passed nodes, which can be
+# a NodeStore, its values() view, an array of coordinates or any iterable
+# of node objects
+def get_coordinates(nodes):
+    if isinstance(nodes, NodeStore): return nodes.lonlat()
+    if isinstance(nodes, StoreValues): return nodes.store.lonlat()
+    if isinstance(nodes, np.ndarray): return nodes.reshape(-1, 2)
+    coordinates = []
+    for n in nodes:
+        # there are two possible formating options for Location
+        # this try catch block tries to handle both
+        try:
+            coordinates.append((n.location[0], n.location[1]))
+        except:
+            coordinates.append((n.location.lon, n.location.lat))
+    return np.array(coordinates, dtype=np.float64).reshape(-1, 2)
 
 # Finds the bounding box that encompasses all the nodes
 # in the list. The border coordinates are given an extra
@@ -47,19 +108,8 @@ def insert_bounds(filename, min_lat, min_lon, max_lat, max_lon):
 # params: list of nodes, extra margin for the bounds
 # returns: min_lat, min_lon, max_lat, max_lon
 def get_bounds(nodes, ex=0.002):
-    base_lon, base_lat = list(nodes)[0].location
-    min_lat, min_lon, max_lat, max_lon = base_lat, base_lon, base_lat, base_lon
-    for n in nodes:
-        # there are two possible formating options for Location
-        # this try catch block tries to handle both
-        try:
-            lon, lat = n.location[0], n.location[1]
-        except:
-            lon, lat = n.location.lon, n.location.lat
-
-        if lon < min_lon: min_lon = lon
-        if lon > max_lon: max_lon = lon
-        if lat < min_lat: min_lat = lat
-        if lat > max_lat: max_lat = lat
-    #print(min_lat, min_lon, max_lat, max_lon, ex)
-    return min_lat-ex, min_lon-ex, max_lat+ex, max_lon+ex
+    coordinates = get_coordinates(nodes)
+    min_lon, min_lat = coordinates.min(axis=0)
+    max_lon, max_lat = coordinates.max(axis=0)
+    return (float(min_lat)-ex, float(min_lon)-ex,
+            float(max_lat)+ex, float(max_lon)+ex)
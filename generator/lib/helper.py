@@ -1,13 +1,13 @@
 import os
-from area import area
 import numpy as np
-from bisect import bisect
 from lib.logger import log
 from lib import settings
 import lib.trigonometry as trig
 import lib.handler as handler
-import osmnx as ox
-import networkx as nx
+import lib.clip as clip
+from lib.store import StoreValues
+from lib.graph import RoadGraph
+from lib.spatial import SpatialIndex
 import pickle
 import lib.handler as handler
 
@@ -25,150 +25,60 @@ def load(filename):
         return None
 
 # given an OSM file, remove all nodes and ways outside of passed bounds
-# and save it back on the same file
+# and save it back on the same file (see lib.clip for polygons and for
+# keeping the ways crossing the bounds whole)
 def remove_out_of_bounds(filename, min_lon, min_lat, max_lon, max_lat):
-    nodes, ways = handler.extract_data(filename)
-    print("nodes: {}, ways: {}".format(len(nodes), len(ways)))
-    delete_nodes = []
-    for n_id, n in nodes.items():
-        lon, lat = n.location
-        if lon < min_lon or lon > max_lon or lat < min_lat or lat > max_lat:
-            delete_nodes.append(n_id)
-
-    for n_id in delete_nodes:
-        del nodes[n_id]
-        for w_id, w in ways.items():
-            if n_id in w.nodes:
-                w.nodes.remove(n_id)
-
-    delete_ways = []
-    for w_id, w in ways.items():
-        if len(w.nodes) == 0:
-            delete_ways.append(w_id)
-    for w in delete_ways:
-        del ways[w]
-
-    print("nodes: {}, ways: {}".format(len(nodes), len(ways)))
-    handler.write_data(filename, nodes.values(), ways.values(), 0.00002)
-
-# try to fetch all cycles from an input OSM file
-# (this function considers that the file contains only the road nodes and ways)
-def get_cycles(input_file):
-    # the cycle basis does not give all the chordless cycles
-    # but getting all the cycles from cycle basis and filtering the ones
-    # with nodes inside is quite fast
-    G = ox.graph.graph_from_xml(input_file, simplify=False, retain_all=True)
-    H = nx.Graph(G) # make a simple undirected graph from G
-
-    cycles = nx.cycles.cycle_basis(H) # I think a cycle basis should get all the neighborhoods, except
-                                      # we'll need to filter the cycles that are too small.
-    return cycles
-
-# alternative to fetch cycles from an input OSM file
-# tends to yield more cycles than the previous approach but takes longer
-# (this function considers that the file contains only the road nodes and ways)
-def get_cycles_minimum(input_file):
-    # this is extremely slow, took about 11 minutes to get cycles
-    # from residential/unclassified streets of "smaller_tsukuba.osm"
-    G = ox.graph.graph_from_xml(input_file, simplify=False, retain_all=True)
-    H = nx.Graph(G) # make a simple undirected graph from G
-
-    cycles = nx.cycles.minimum_cycle_basis(H) # I think a cycle basis should get all the neighborhoods, except
-                                      # we'll need to filter the cycles that are too small.
-
-    def order_cycles(H, cycle):
-        for i in range(len(cycle)-1):
-            for j in range(i+1, len(cycle)):
-                if H.has_edge(cycle[i], cycle[j]):
-                    temp = cycle[i+1]
-                    cycle[i+1] = cycle[j]
-                    cycle[j] = temp
-                    break
-
-    for c in cycles:
-        log("Ordering cycle...")
-        order_cycles(H, c)
-    log("Ordering finished.")
-
-    return cycles
+    n_nodes, n_ways = clip.clip(filename, filename, bbox=(min_lon, min_lat,
+                                max_lon, max_lat), complete_ways=False)
+    print("nodes: {}, ways: {}".format(n_nodes, n_ways))
+
+# fetch all the cycles (city blocks) formed by the passed road nodes and ways,
+# as the faces of the road network (see RoadGraph.faces). Unlike a cycle
+# basis, these are always the minimal cycles, but they may still contain
+# roads inside (see remove_nonempty_cycles). The faces are found on the graph
+# with the shape nodes along the streets contracted and expanded back to
+# every road node
+def get_cycles(nodes, ways):
+    graph = RoadGraph.from_ways(nodes, ways)
+    contracted = graph.contract()
+    log("Road graph contracted from {} nodes, {} edges to {} nodes, {} "
+        "edges".format(len(graph), len(graph.edges), len(contracted),
+                       len(contracted.edges)), "DEBUG")
+    return contracted.faces(nodes)
 
 # get all the cycles formed by road nodes in an OSM file
 def get_cycles_highway(input_file):
-    nodes, ways = handler.extract_data(input_file)
     tags = {"highway":None}
-    _nodes, _ways = filter_by_tag(nodes, ways, tags)
-    _output = "_temp.osm"
-    handler.write_data(_output, _nodes.values(), _ways.values())
-    cycles = get_cycles(_output)
-    handler.delete_file(_output)
-    return cycles
-
-# returns the area of a polygon given by a list of points
-def get_area(points):
-    coordinates = []
-    for lon, lat in points:
-        coordinates.append([lon,lat])
-    polygon = {'type':'Polygon','coordinates':[coordinates]}
-    return area(polygon)
-
-# splits the passed coordinate space into nxn cells and return the
-# a matrix containing the ids of nodes for each cell
-def split_into_matrix(min_lat, min_lon, max_lat, max_lon, nodes, n=1000):
-    lat_range = np.linspace(min_lat, max_lat, n)[1:]
-    lon_range = np.linspace(min_lon, max_lon, n)[1:]
-
-    matrix = [[[] for y in range(n)] for x in range(n)]
-
-    for n in nodes.values():
-        lon, lat = n.location
-        assigned_x, assigned_y = get_node_cell(lon_range, lat_range, lon, lat)
-        matrix[assigned_x][assigned_y].append(n.id)
-
-    return matrix, lon_range, lat_range
-
-# given a nxn splitted area, returns the cell indexes for a given lat/lon
-def get_node_cell(lon_range, lat_range, lon, lat):
-    x = bisect(lon_range, lon)
-    y = bisect(lat_range, lat)
-    return x, y
-
-
-def nodes_in_area(min_lat, min_lon, max_lat, max_lon, lat_range, lon_range):
-    x_min = bisect(lon_range, min_lon)
-    y_min = bisect(lat_range, min_lat)
-    x_max = bisect(lon_range, max_lon)
-    y_max = bisect(lat_range, max_lat)
-    return x_min, y_min, x_max, y_max
+    _nodes, _ways = handler.extract_data(input_file, tags)
+    return get_cycles(_nodes, _ways)
 
 # set an extre property for nodes describing if they are road or not
 def set_node_type(ways, nodes):
-    for n in nodes.values():
-        n.type = "unspecified"
+    nodes.set_attr("type", "unspecified")
 
-    for w_id, w in ways.items():
-        type = "highway" if "highway" in w.tags else "other"
-        for n_id in w.nodes:
-            nodes[n_id].type = type
+    refs, lengths = ways.node_refs()
+    if len(refs) == 0: return
+    highway = np.isin(ways.live_rows(), ways.rows_with_tag("highway"))
+    types = np.where(np.repeat(highway, lengths), "highway", "other")
+    # a node shared by several ways gets the type of the last of them
+    last = len(refs) - 1 - np.unique(refs[::-1], return_index=True)[1]
+    nodes.set_attr("type", types[last].astype(object), refs[last])
 
 # used for a prettier plotting
 def color_nodes(nodes, color):
+    if isinstance(nodes, StoreValues):
+        nodes.store.set_attr("color", color)
+        return
     for n in nodes:
         n.color = color
 
 # used for a prettier plotting
 def color_ways(ways, nodes, ways_colors, nodes_colors, default="black"):
-    tags = {}
-    for id, way in ways.items():
-        for tag, color in ways_colors.items():
-            if tag in way.tags:
-                way.color = color
-                for n_id in way.nodes:
-                    nodes[n_id].color = "black"
-                break
-        else:
-            way.color = default
-            for n_id in way.nodes:
-                nodes[n_id].color = "black"
+    ways.set_attr("color", default)
+    # the first tag of ways_colors found in a way gives its color
+    for tag, color in reversed(list(ways_colors.items())):
+        ways.set_attr("color", color, ways.query({tag: None}))
+    nodes.set_attr("color", "black", ways.node_refs()[0])
 
 # used for a prettier plotting
 def color_highways(ways, nodes):
@@ -180,12 +90,12 @@ def color_highways(ways, nodes):
     # passed ways. It gets too colorful and hard to understand
     def all_labels(ways, pltcolors):
         tags = {}
-        for id, way in ways.items():
-            if "highway" in way.tags:
-                tag = way.tags["highway"]
-                if tag not in tags:
-                    tags[tag] = "black"#next(pltcolors)
-                way.color = tags[tag]
+        for id in ways.query({"highway": None}).tolist():
+            way = ways[id]
+            tag = way.tags["highway"]
+            if tag not in tags:
+                tags[tag] = "black"#next(pltcolors)
+            way.color = tags[tag]
         return tags
 
     # assigns colors for specific highways and group all the
@@ -194,15 +104,15 @@ def color_highways(ways, nodes):
         search_tags = ["trunk","primary","secondary","tertiary"]
         other = "gray"
         tags = {}
-        for id, way in ways.items():
-            if "highway" in way.tags:
-                tag = way.tags["highway"]
-                if tag not in search_tags:
-                    way.color = other
-                else:
-                    if tag not in tags:
-                        tags[tag] = next(pltcolors)
-                    way.color = tags[tag]
+        for id in ways.query({"highway": None}).tolist():
+            way = ways[id]
+            tag = way.tags["highway"]
+            if tag not in search_tags:
+                way.color = other
+            else:
+                if tag not in tags:
+                    tags[tag] = next(pltcolors)
+                way.color = tags[tag]
         tags["others"] = other
         return tags
 
@@ -210,125 +120,77 @@ def color_highways(ways, nodes):
     return tags
 
 # given a list of cycles, remove any that are not chordless (i.e. there are
-# some road nodes inside the cycle)
-def remove_nonempty_cycles(nodes, cycles):
-    min_lat, min_lon, max_lat, max_lon = handler.get_bounds(nodes.values())
-    matrix, lon_range, lat_range = split_into_matrix(min_lat,
-                                            min_lon, max_lat, max_lon, nodes)
-
-    empty_cycles = []
-    for cycle in cycles:
-        log("Nodes in Cycle:", "DEBUG")
-        for n_id in cycle:
-            log("{} - {}".format(n_id, nodes[n_id].location), "DEBUG")
-
-        min_lat, min_lon, max_lat, max_lon = handler.get_bounds(
-                                                    [nodes[x] for x in cycle])
-        log("Bounds of cycle: {}".format((min_lat, min_lon, max_lat, max_lon)),
-                                                                    "DEBUG")
-        x_min, y_min, x_max, y_max = nodes_in_area(min_lat, min_lon,
-                                     max_lat, max_lon, lat_range, lon_range)
-        detected_nodes = {}
-        for x in range(x_min, x_max+1):
-            for y in range(y_min, y_max+1):
-                node_ids_list = matrix[x][y]
-                for n_id in node_ids_list:
-                    detected_nodes[n_id] = nodes[n_id]
-
-        log("Nodes inside matrix area of cycle: ", "DEBUG")
-        for n_id, n in detected_nodes.items():
-            log("{} - {}".format(n_id, n.location), "DEBUG")
-
-        cycle_polygon = []
-        for n_id in cycle:
-            cycle_polygon.append(nodes[n_id].location)
-
-        # remove cycle nodes from the detected nodes dict
-        # obs: we use set(cycle) in case the cycle list has the same node at
-        # the beginning and end of the list, so we only del it once
-        for n_id in set(cycle):
-           del detected_nodes[n_id]
-
-        log("Cycle polygon: {}".format(cycle_polygon), "DEBUG")
-        for id, n in detected_nodes.items():
-           lon, lat = n.location
-           if trig.point_inside_polygon(lon, lat, cycle_polygon):
-               log("Node inside cycle detected! Coord: {}".format((lon,lat)),
-                                                                        "DEBUG")
-               break
-        else:
-            empty_cycles.append(cycle)
-
-    return empty_cycles
-
-# return the list of building ways for a given road cycle
-def building_density(nodes,ways,cycle):
-    # print("Calculating building density...")
-    # print("Cycle nodes: {}".format(cycle))
-    matrix, lon_range, lat_range = split_into_matrix(*handler.get_bounds(
-                                                        nodes.values()),
-                                                        nodes)
-
-    min_lat, min_lon, max_lat, max_lon = handler.get_bounds(
-                                                [nodes[x] for x in cycle], ex=0)
-    x_min, y_min, x_max, y_max = nodes_in_area(min_lat, min_lon,
-                                 max_lat, max_lon, lat_range, lon_range)
-    # print("Bounding rectangle of cycle: {}".format((min_lon, max_lon,
-    #                                                         min_lat, max_lat)))
-
-    detected_nodes = {}
-    for x in range(x_min, x_max+1):
-        for y in range(y_min, y_max+1):
-            node_ids_list = matrix[x][y]
-            for n_id in node_ids_list:
-                detected_nodes[n_id] = nodes[n_id]
-
-    # remove cycle nodes from the detected nodes dict
-    # obs: we use set(cycle) in case the cycle list has the same node at
-    # the beginning and end of the list, so we only del it once
-    for n_id in set(cycle):
-       del detected_nodes[n_id]
-
-    # print("Total nodes detected in the area: ")
-    # print(detected_nodes.keys())
-
-    cycle_polygon = []
-    for n_id in cycle:
-        cycle_polygon.append(nodes[n_id].location)
-
-    inner_nodes = {}
-    for id, n in detected_nodes.items():
-       lon, lat = n.location
-       if trig.point_inside_polygon(lon, lat, cycle_polygon):
-           inner_nodes[id] = n
-
-    # print("Total nodes effectively inside cycle: ")
-    # print(inner_nodes.keys())
-
-    detected_ways = {}
-    for w_id, way in ways.items():
-        for n_id in inner_nodes.keys():
-            if n_id in way.nodes:
-                detected_ways[w_id] = way
-                break
-
-    # import pprint
-    # print("Total detected ways inside cycle:")
-    # pp = pprint.PrettyPrinter(indent=4)
-    # pp.pprint([(x.id, x.tags) for x in detected_ways.values()])
-
-    building_ways = {}
-    for w_id, way in detected_ways.items():
-        if "building" in way.tags:
-            building_ways[w_id] = way
-
-    # print("Total building ways inside cycle: {}".format(len(building_ways)))
-    # if len(inner_nodes) > 0:
-    #     import sys
-    #     print("Found inner nodes in the previous cycle: ")
-    #     sys.exit()
-
-    return building_ways
+# some road nodes inside the cycle). The nodes inside every cycle are found
+# at once with a spatial index over the map (built here if not passed, in
+# which case it only holds the passed nodes), optionally testing them in
+# several processes (see SpatialIndex.node_positions_in_polygons)
+def remove_nonempty_cycles(nodes, cycles, processes=1, index=None):
+    if len(cycles) == 0: return []
+    if index == None: index = SpatialIndex(nodes)
+    polygons = [nodes.xy(cycle) for cycle in cycles]
+    point_index, cycle_index = index.node_positions_in_polygons(polygons,
+                                                                processes)
+
+    # only the passed nodes count, and the nodes of a cycle are not checked
+    # against it
+    node_ids = index.node_ids
+    sorter = np.argsort(node_ids)
+    lengths = [len(cycle) for cycle in cycles]
+    members = sorter[np.searchsorted(node_ids, np.concatenate(cycles),
+                                     sorter=sorter)]
+    own = np.repeat(np.arange(len(cycles)), lengths) * len(node_ids) + members
+    candidates = cycle_index * len(node_ids) + point_index
+    keep = ~np.isin(candidates, own) & np.isin(node_ids[point_index], nodes.ids)
+    cycle_index = cycle_index[keep]
+
+    occupied = np.bincount(cycle_index, minlength=len(cycles))
+    log("Nodes found inside {} of {} cycles".format(
+                        np.count_nonzero(occupied), len(cycles)), "DEBUG")
+    return [cycle for cycle, count in zip(cycles, occupied.tolist())
+                                                            if count == 0]
+
+# assigns every building way to the cycle (block) containing it, for all
+# cycles at once: each building is represented by the mean of its nodes,
+# which is located among the cycles whose bounding box holds it and tested
+# against them in a single batch (if several cycles contain it, the first
+# one gets it)
+# returns: for each cycle, an array with the ids of its building ways (in
+# the order of the ways store)
+def assign_buildings(nodes, ways, cycles, processes=1):
+    if len(cycles) == 0: return []
+    w_ids = ways.query({"building": None})
+    refs, lengths = ways.node_refs(w_ids)
+    owner = np.repeat(np.arange(len(w_ids)), lengths)
+
+    # closed ways repeat their first node at the end, which is left out
+    ends = np.cumsum(lengths) - 1
+    long = np.flatnonzero(lengths > 1)
+    closed = long[refs[ends[long] - lengths[long] + 1] == refs[ends[long]]]
+    keep = np.isin(refs, nodes.ids)
+    keep[ends[closed]] = False
+    owner, coordinates = owner[keep], nodes.xy(refs[keep])
+    count = np.bincount(owner, minlength=len(w_ids))
+    located = count > 0
+    points = np.column_stack([np.bincount(owner, coordinates[:,k],
+                              minlength=len(w_ids)) for k in (0, 1)])
+    points = points[located] / count[located,None]
+    w_ids = w_ids[located]
+
+    polygons = [nodes.xy(cycle) for cycle in cycles]
+    point_index, cycle_index = trig.polygon_candidates(points, polygons)
+    inside = trig.points_inside_polygons(points, polygons, point_index,
+                                         cycle_index, processes)
+    point_index, cycle_index = point_index[inside], cycle_index[inside]
+
+    order = np.lexsort((cycle_index, point_index))
+    point_index, cycle_index = point_index[order], cycle_index[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = point_index[1:] != point_index[:-1]
+    point_index, cycle_index = point_index[first], cycle_index[first]
+
+    order = np.lexsort((point_index, cycle_index))
+    count = np.bincount(cycle_index, minlength=len(cycles))
+    return np.split(w_ids[point_index[order]], np.cumsum(count)[:-1])
 
 # calculate the centroid for a sequence of points
 def centroid(vertexes):
@@ -352,29 +214,19 @@ def filter_cycles_by_type(nodes, cycles, wanted_type):
     return cycles
 
 def filter_by_tag(nodes, ways, tags):
-    _nodes, _ways = {}, {}
-    for way in ways.values():
-        # try to find intersection of keys between two dictionaries
-        intersection = set(way.tags.keys()) & set(tags.keys())
-
-        # check if way[key] is an element of the list in tags[key]
-        # otherwise, if tags[key] is an empty list, accept any value of way[key]
-        if intersection:
-            for key in intersection:
-                if tags[key] == None:
-                    _ways[way.id] = way
-                    for n_id in way.nodes:
-                        _nodes[n_id] = nodes[n_id]
-
-                elif way.tags[key] in tags[key]:
-                    _ways[way.id] = way
-                    for n_id in way.nodes:
-                        _nodes[n_id] = nodes[n_id]
-
-    return _nodes, _ways
+    # ways having any of the keys in tags, where tags[key] is either None to
+    # accept any value of way[key] or a list with the accepted values
+    _ways = ways.subset(ways.query(tags))
+    _node_ids, _ = _ways.node_refs()
+    return nodes.subset(_node_ids), _ways
 
 # this can be used to avoid setting id numbers that arleady exist to new nodes
 def update_id_counter(nodes):
+    if isinstance(nodes, StoreValues):
+        if len(nodes) > 0:
+            settings.id_counter = max(settings.id_counter,
+                                      int(nodes.store.ids.max()) + 1)
+        return
     for n in nodes:
         if n.id >= settings.id_counter:
             settings.id_counter = n.id + 1
@@ -382,47 +234,6 @@ def update_id_counter(nodes):
 index = 0
 colors = ["b","g","c","m","y"]
 
-# fetch largest and smallest side of an obb
-def get_obb_data(nodes, cycle):
-    import lib.obb as obb
-    polygon = []
-    for n_id in cycle:
-        polygon.append(nodes[n_id].location)
-
-    # returns 2D obb, uses convex hulls
-    # yields decent results for symmetric shapes such as rectangles/squares
-    box = obb.minimum_bounding_rectangle(np.array(polygon))
-
-    def largest_edge(polygon):
-        if len(polygon) < 2: return None
-        largest = (0, None)
-        p_size = len(polygon)
-        for i in range(len(polygon)):
-            p1 = polygon[i]
-            p2 = polygon[(i+1)%p_size]
-            dist = trig.dist(p1[0], p1[1], p2[0], p2[1])
-            #print("Length {}: between points {}".format(dist, (p1,p2)))
-            if dist > largest[0]:
-                largest = (dist, (p1, p2), (polygon[(i+2)%p_size], polygon[(i+1+2)%p_size]))
-        return largest[0]
-
-    def shortest_edge(polygon):
-        if len(polygon) < 2: return None
-        shortest = (trig.dist(*polygon[0], *polygon[1]), None)
-        p_size = len(polygon)
-        for i in range(len(polygon)):
-            p1 = polygon[i]
-            p2 = polygon[(i+1)%p_size]
-            dist = trig.dist(p1[0], p1[1], p2[0], p2[1])
-            if dist < shortest[0]:
-                shortest = (dist, (p1, p2), (polygon[(i+2)%p_size], polygon[(i+1+2)%p_size]))
-        return shortest[0]
-
-    largest = largest_edge(box)
-    shortest = shortest_edge(box)
-
-    return largest, shortest
-
 def create_folder(foldername):
     try:
         os.mkdir(foldername)
@@ -0,0 +1,54 @@
+import numpy as np
+from lib import settings
+
+# Ids of the objects generated in a map. By default they are taken from the
+# global counter (settings.id_counter) in the order they are created, so they
+# depend on everything generated before. Blocks generated on their own (e.g.
+# in other processes, see parcel.generate_parcels_parallel) take them from a
+# range of their own instead, given by the index of the block and a seed
+# (e.g. the elite being generated): the ranges never overlap, and the ids of
+# a block only depend on the block, the seed and its partitions.
+
+# ids in the range of a block, and blocks in the ranges of a seed
+BLOCK_IDS = 1 << 16
+SEED_BLOCKS = 1 << 16
+
+# consecutive ids from start (included) to stop (excluded)
+class IdRange():
+    def __init__(self, start, stop):
+        self.start = int(start)
+        self.stop = int(stop)
+        self.next = self.start
+
+    def __len__(self):
+        return self.stop - self.next
+
+    # returns: the next count ids of the range
+    def take(self, count=1):
+        if self.next + count > self.stop:
+            raise ValueError("Id range [{}, {}) exhausted".format(self.start,
+                                                                  self.stop))
+        ids = np.arange(self.next, self.next + count, dtype=np.int64)
+        self.next += count
+        return ids
+
+    def __repr__(self):
+        return "IdRange({}, {})".format(self.start, self.stop)
+
+# returns: count new ids from the global counter
+def take(count=1):
+    ids = np.arange(settings.id_counter, settings.id_counter + count,
+                    dtype=np.int64)
+    settings.id_counter += count
+    return ids
+
+# params: the index of a block, a seed and the first id of the ranges (by
+# default the global counter, the first id not used by the map)
+# returns: the IdRange of the block for that seed
+def block_range(block, seed=0, base=None):
+    if not 0 <= block < SEED_BLOCKS:
+        raise ValueError("Block index {} out of [0, {})".format(block,
+                                                                SEED_BLOCKS))
+    if base == None: base = settings.id_counter
+    start = base + (seed * SEED_BLOCKS + block) * BLOCK_IDS
+    return IdRange(start, start + BLOCK_IDS)
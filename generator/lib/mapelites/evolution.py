@@ -16,7 +16,8 @@ def density_error(full_chrom, chrom_idx, neigh_idx, areas):
     def get_error(main, neighbors, minimum_error=0):
         # error returns how far the current density is from being within
         # 80% ~ 120% of the neighbouring maximum density value
-        maximum = max(neighbors)
+        # (a block with no neighbors has nothing to be compared to)
+        maximum = max(neighbors) if len(neighbors) > 0 else 0
         if maximum == 0:
             if main == 0:
                 error = minimum_error
@@ -0,0 +1,95 @@
+import numpy as np
+from scipy.spatial import cKDTree, Delaunay
+
+# Neighbor graphs between points (e.g. the centroids of the blocks of a map),
+# all returned the same way: CSR arrays (offsets, indices), the neighbors of
+# point i being indices[offsets[i]:offsets[i+1]], sorted. The graphs are
+# built on a KD-tree or a Delaunay triangulation of the points, so they cost
+# O(n log n) and are cheap enough to recompute every run.
+
+MODES = ("mst", "knn", "radius")
+
+# params: the pairs (i, j) of an undirected graph over n items
+# returns: its CSR arrays, with both directions of every pair
+def from_pairs(n, pairs):
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    pairs = np.unique(np.concatenate((pairs, pairs[:,::-1])), axis=0)
+    offsets = np.searchsorted(pairs[:,0], np.arange(n+1))
+    return offsets, pairs[:,1]
+
+# the edges of the Delaunay triangulation of the points (every pair when
+# there are too few points to triangulate). The input is joggled so that
+# duplicate and collinear points are triangulated too
+def delaunay_edges(points):
+    n = len(points)
+    if n < 4:
+        i, j = np.triu_indices(n, 1)
+        return np.column_stack((i, j))
+    triangles = Delaunay(points, qhull_options="QJ").simplices
+    edges = np.concatenate((triangles[:,[0,1]], triangles[:,[1,2]],
+                            triangles[:,[2,0]])).astype(np.int64)
+    return np.unique(np.sort(edges, axis=1), axis=0)
+
+# params: an (n, 2) array of points
+# returns: the CSR arrays of their euclidean minimum spanning tree. The tree
+# is a subgraph of the Delaunay triangulation, so Kruskal only runs on its
+# O(n) edges
+def mst(points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    edges = delaunay_edges(points)
+    delta = points[edges[:,0]] - points[edges[:,1]]
+    order = np.argsort((delta**2).sum(axis=1), kind="stable")
+
+    parent = list(range(len(points)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    tree = []
+    for i, j in edges[order].tolist():
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j: continue
+        parent[root_j] = root_i
+        tree.append((i, j))
+        if len(tree) == len(points) - 1: break
+    return from_pairs(len(points), tree)
+
+# params: an (n, 2) array of points and the number of neighbors
+# returns: the CSR arrays of the k nearest points to each one. The graph is
+# directed (j can be among the nearest of i but not the other way around)
+def knn(points, k=3):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    k = min(k, n - 1)
+    if k <= 0: return np.zeros(n+1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    _, found = cKDTree(points).query(points, k+1)
+    # a point is its own nearest neighbor unless it has duplicates
+    found = found.reshape(n, k+1)
+    own = found == np.arange(n)[:,None]
+    own[~own.any(axis=1), k] = True
+    indices = np.sort(found[~own].reshape(n, k), axis=1).ravel()
+    return np.arange(0, n*k+1, k), indices.astype(np.int64)
+
+# params: an (n, 2) array of points and a distance
+# returns: the CSR arrays of the points at most radius away from each one
+def within(points, radius):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    pairs = cKDTree(points).query_pairs(radius, output_type="ndarray")
+    return from_pairs(len(points), pairs)
+
+# params: an (n, 2) array of points, the kind of graph (see MODES) and its
+# parameter: the number of neighbors for knn, the distance for radius
+# returns: the CSR arrays (offsets, indices) of the graph
+def neighbor_graph(points, mode="mst", k=3, radius=100):
+    if mode == "mst": return mst(points)
+    if mode == "knn": return knn(points, k)
+    if mode == "radius": return within(points, radius)
+    raise ValueError("Unknown neighbor mode {}, use one of {}".format(mode,
+                                                                   MODES))
+
+# returns: the neighbors of each point as a list of lists
+def to_lists(offsets, indices):
+    return [indices[offsets[i]:offsets[i+1]].tolist()
+                                        for i in range(len(offsets) - 1)]
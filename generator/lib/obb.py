@@ -1,9 +1,9 @@
 
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy.spatial import ConvexHull
 
-# source: https://gis.stackexchange.com/a/169633
+# source: https://gis.stackexchange.com/a/169633 (now computed by
+# minimum_bounding_rectangles, see below)
 def minimum_bounding_rectangle(points):
     """
     Find the smallest bounding rectangle for a set of points.
@@ -12,62 +12,88 @@ def minimum_bounding_rectangle(points):
     :param points: an nx2 matrix of coordinates
     :rval: an nx2 matrix of coordinates
     """
-    from scipy.ndimage.interpolation import rotate
-    pi2 = np.pi/2.
-
-    # get the convex hull for the points
-    hull_points = points[ConvexHull(points).vertices]
-
-    # calculate edge angles
-    edges = np.zeros((len(hull_points)-1, 2))
-    edges = hull_points[1:] - hull_points[:-1]
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return minimum_bounding_rectangles(points, [0, len(points)])[0]
 
-    angles = np.zeros((len(edges)))
-    angles = np.arctan2(edges[:, 1], edges[:, 0])
+# params: a ragged set of polygons (or point sets) as an (n, 2) array of
+# their points one after the other and the offsets where each one starts
+# returns: their convex hulls the same way, each going counterclockwise
+def convex_hulls(points, offsets):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    hulls = [points[s:e][ConvexHull(points[s:e]).vertices]
+             for s, e in zip(offsets[:-1], offsets[1:])]
+    sizes = [len(hull) for hull in hulls]
+    if len(hulls) == 0: return np.zeros((0, 2)), np.zeros(1, dtype=np.int64)
+    return np.concatenate(hulls), np.concatenate(([0], np.cumsum(sizes)))
 
-    angles = np.abs(np.mod(angles, pi2))
-    angles = np.unique(angles)
+# params: a ragged set of polygons as an (n, 2) array of their points one
+# after the other and the offsets where each one starts
+# returns: a (polygons, 4, 2) array with the corners of their bounding
+# rectangles, the same ones minimum_bounding_rectangle gave for each polygon:
+# the smallest box aligned with an edge of the convex hull, the edge closing
+# the hull (from its last vertex back to the first one) left out. For every
+# edge, rotating calipers find the hull vertices extreme along it and across
+# it (a search on the hull edge angles, which turn monotonically), done for
+# every hull at once with a sort of the batch, so a batch of n points costs
+# O(n log n) instead of the O(h^2) of rotating each hull whole once per
+# edge. Each box only depends on its own polygon, not on the others in the
+# batch
+def minimum_bounding_rectangles(points, offsets):
+    pi2 = np.pi/2.
+    hull, hull_offsets = convex_hulls(points, offsets)
+    n = len(hull_offsets) - 1
+    sizes = np.diff(hull_offsets)
+    owner = np.repeat(np.arange(n), sizes)
+    starts = hull_offsets[:-1]
+    position = np.arange(len(hull)) - starts[owner]
+    after = starts[owner] + (position + 1) % sizes[owner]
 
-    # find rotation matrices
-    # XXX both work
-    rotations = np.vstack([
-        np.cos(angles),
-        np.cos(angles-pi2),
-        np.cos(angles+pi2),
-        np.cos(angles)]).T
-#     rotations = np.vstack([
-#         np.cos(angles),
-#         -np.sin(angles),
-#         np.sin(angles),
-#         np.cos(angles)]).T
-    rotations = rotations.reshape((-1, 2, 2))
+    # edge angles (counterclockwise, so turning monotonically) relative to
+    # the first edge of each hull, in [0, 2pi)
+    edges = hull[after] - hull
+    angles = np.arctan2(edges[:,1], edges[:,0])
+    relative = np.mod(angles - angles[starts][owner], 2*np.pi)
+    groups = np.concatenate((owner, owner))
+    is_edge = np.concatenate((np.ones(len(hull), dtype=bool),
+                              np.zeros(len(hull), dtype=bool)))
 
-    # apply rotations to the hull
-    rot_points = np.dot(rotations, hull_points.T)
+    # the hull vertex farthest along direction phi of each edge: the start
+    # of the first edge turned at least 90 degrees past phi. The angles are
+    # sorted together with the edge angles of their hull (before equal
+    # ones), the edges sorted before each one being those turned less, so
+    # the result of a hull does not depend on the others in the batch
+    def support(phi):
+        t = np.mod(phi + pi2 - angles[starts][owner], 2*np.pi)
+        order = np.lexsort((is_edge, np.concatenate((relative, t)), groups))
+        before = np.cumsum(is_edge[order]) - is_edge[order]
+        j = np.empty(len(hull), dtype=np.int64)
+        j[order[~is_edge[order]] - len(hull)] = before[~is_edge[order]]
+        j = np.where(j >= starts[owner] + sizes[owner], starts[owner], j)
+        return hull[j]
 
-    # find the bounding points
-    min_x = np.nanmin(rot_points[:, 0], axis=1)
-    max_x = np.nanmax(rot_points[:, 0], axis=1)
-    min_y = np.nanmin(rot_points[:, 1], axis=1)
-    max_y = np.nanmax(rot_points[:, 1], axis=1)
+    # each edge gives a rotation as in minimum_bounding_rectangle
+    a = np.abs(np.mod(angles, pi2))
+    r00, r01, r10 = np.cos(a), np.cos(a-pi2), np.cos(a+pi2)
+    def rotate(p):
+        return r00*p[:,0] + r01*p[:,1], r10*p[:,0] + r00*p[:,1]
+    max_x = rotate(support(a))[0]
+    min_x = rotate(support(a + np.pi))[0]
+    max_y = rotate(support(a + pi2))[1]
+    min_y = rotate(support(a - pi2))[1]
 
-    # find the box with the best area
+    # the best box of each hull (the lowest angle among equal areas), not
+    # aligned with its closing edge
     areas = (max_x - min_x) * (max_y - min_y)
-    best_idx = np.argmin(areas)
-
-    # return the best box
-    x1 = max_x[best_idx]
-    x2 = min_x[best_idx]
-    y1 = max_y[best_idx]
-    y2 = min_y[best_idx]
-    r = rotations[best_idx]
-
-    rval = np.zeros((4, 2))
-    rval[0] = np.dot([x1, y2], r)
-    rval[1] = np.dot([x2, y2], r)
-    rval[2] = np.dot([x2, y1], r)
-    rval[3] = np.dot([x1, y1], r)
+    areas[hull_offsets[1:] - 1] = np.inf
+    order = np.lexsort((a, areas, owner))
+    best = order[np.searchsorted(owner[order], np.arange(n))]
+    x1, x2, y1, y2 = max_x[best], min_x[best], max_y[best], min_y[best]
+    r00, r01, r10 = r00[best], r01[best], r10[best]
 
+    rval = np.zeros((n, 4, 2))
+    for i, (x, y) in enumerate(((x1, y2), (x2, y2), (x2, y1), (x1, y1))):
+        rval[:,i,0] = x*r00 + y*r10
+        rval[:,i,1] = x*r01 + y*r00
     return rval
 
 def demo():
@@ -1,164 +1,292 @@
 import lib.building as building
-import lib.helper as helper
 import lib.obb as obb
-import lib.trigonometry as trig
-from lib.plotter import plot
 import numpy as np
 from lib.logger import log
 
-# partitioning algorithm for a road cycle
-# partitions_left tells the algorithm how many times to partitioning the polygon
-# min_obb_ration and min_area are the minimum conditions for partitioning
-def generate_parcel_density(nodes, ways, cycle, partitions_left, min_obb_ratio=0.25, min_area=3000):
-
-    polygon = [nodes[n_id].location for n_id in cycle]
-
-    # returns 2D obb, uses convex hulls
-    # yields decent results for symmetric shapes such as rectangles/squares
-    box = obb.minimum_bounding_rectangle(np.array(polygon))
-    log("Identified Box: {}".format(box), "DEBUG")
-
-    def largest_edge(polygon):
-        if len(polygon) < 2: return None
-        largest = (0, (None, None), (None,None))
-        p_size = len(polygon)
-        for i in range(len(polygon)):
-            p1 = polygon[i]
-            p2 = polygon[(i+1)%p_size]
-            dist = trig.dist(p1[0], p1[1], p2[0], p2[1])
-            #print("Length {}: between points {}".format(dist, (p1,p2)))
-            if dist > largest[0]:
-                largest = (dist, (p1, p2), (polygon[(i+2)%p_size], polygon[(i+1+2)%p_size]))
-        return largest[0], *largest[1], *largest[2]
-
-    # def shortest_edge(polygon):
-    #     if len(polygon) < 2: return None
-    #     shortest = (trig.dist(*polygon[0], *polygon[1]), (None, None), (None,None))
-    #     p_size = len(polygon)
-    #     for i in range(len(polygon)):
-    #         p1 = polygon[i]
-    #         p2 = polygon[(i+1)%p_size]
-    #         dist = trig.dist(p1[0], p1[1], p2[0], p2[1])
-    #         if dist < shortest[0]:
-    #             shortest = (dist, (p1, p2), (polygon[(i+2)%p_size], polygon[(i+1+2)%p_size]))
-    #     return shortest[0], *shortest[1], *shortest[2]
-
-    def get_midpoint(p1, p2):
-        x = p1[0] + (p2[0] - p1[0])/2
-        y = p1[1] + (p2[1] - p1[1])/2
-        return x, y
-
-    dist_larger, p1, p2, p1_opposite, p2_opposite = largest_edge(box)
-    # dist_shorter, _, _, _, _ = shortest_edge(box)
-    #
-    # if dist_shorter/dist_larger < 0.25:
-    #     return
-
-    midpoint = get_midpoint(p1, p2)
-    midpoint_opposite = get_midpoint(p1_opposite, p2_opposite)
-
-    # extend the lines a little bit just to make sure they will
-    # intersect with the edges of the polygon
-    midpoint_opposite = trig.extend_line(*midpoint, *midpoint_opposite)
-    midpoint = trig.extend_line(*midpoint_opposite, *midpoint)
-
-    p3 = midpoint
-    p4 = midpoint_opposite
-    p_size = len(polygon)
-    intersected = []
-
-    for i in range(len(polygon)):
-        p1 = polygon[i]
-        p2 = polygon[(i+1)%p_size]
-
-        intersect = trig.my_intersect(*p1, *p2, *p3, *p4)
-        if intersect:
-            intersected.append((intersect,i))
-
-    if len(intersected) > 2:
-        log("Perpendicular line from OBB intersected with > 2 edges.", "DEBUG")
-        return   # this polygon is a bit more complex
-                 # than what we hoped for, so just skip it
+# Partitioning algorithm for many road cycles at once (e.g. every block of
+# an individual). Each polygon is split in two by the line through the
+# middle of its obb, across its longest side, and each half is split again
+# until partitions_left runs out, when a building is placed in it: a
+# polygon split with p partitions left gives p/2 to its first half (split
+# again if >= 1) and p/2-1 to the second one (split again if > 0).
+# The polygons are processed breadth first: all the ones pending at a depth
+# are split as one batch, as flat arrays of their vertices (node ids, x, y
+# and the road segment each edge lies on) with the offsets where each one
+# starts, so the obbs, split lines and intersections are computed for all
+# of them at once.
+# The nodes created where the split lines cross the roads are added to the
+# road ways once every block is done, sorted along the segment they lie on.
+# params: the nodes and ways of the map (changed in place), the cycles
+# (lists of node ids), the partitions of each and, optionally, their obbs
+# and the IdRange to take the ids of the objects created in each one from
+# (see lib.ids, by default they are taken from the global counter)
+def generate_parcels(nodes, ways, cycles, partitions, boxes=None,
+                     ranges=None):
+    cycles = [cycle for cycle in cycles]
+    if len(cycles) == 0: return
+    ids, lengths = _pack(cycles)
+    _merge(nodes, ways, *_subdivide(ids, nodes.xy(ids), lengths, partitions,
+                                    boxes, ranges))
 
-    if len(intersected) < 2:
-        # for some reason we did not manage to find the two edges of the
-        # polygon that intersect with the line splitting the OBB in two.
-        # this is not meant to happen
-        log("Partitioning with OBB failed for cycle {}".format(cycle), "WARN")
-        return
+# Same as generate_parcels, with the blocks split among the processes of a
+# concurrent.futures.ProcessPoolExecutor. Blocks are given to the workers
+# largest first (by partitions), each one to the least loaded worker, and
+# their results are merged back in the order generate_parcels would create
+# them. Every block takes its ids from an IdRange of its own (see
+# lib.ids.block_range), so the result is the same for any number of workers.
+# params: as in generate_parcels, the pool and its number of workers
+def generate_parcels_parallel(nodes, ways, cycles, partitions, boxes, ranges,
+                              pool, workers):
+    cycles = [cycle for cycle in cycles]
+    if len(cycles) == 0: return
+    if boxes is not None: boxes = np.asarray(boxes, dtype=np.float64)
+    jobs = []
+    for group in _balance(np.asarray(partitions, dtype=np.float64) + 1,
+                          workers):
+        ids, lengths = _pack([cycles[i] for i in group])
+        jobs.append((group, pool.submit(_subdivide, ids, nodes.xy(ids),
+                     lengths, [partitions[i] for i in group],
+                     None if boxes is None else boxes[group],
+                     [ranges[i] for i in group])))
 
-    # get the two edges that intersect with the line dividing the OBB
-    # and create two nodes and a way connecting them
-    pos1, polygon_idx1 = intersected[0]
-    pos2, polygon_idx2 = intersected[1]
+    splits, buildings = [], []
+    for group, job in jobs:
+        (n_ids, points, road, block, depth), created = job.result()
+        splits.append((n_ids, points, road, group[block], depth))
+        buildings += [(n, w, group[b], d) for n, w, b, d in created]
+    n_ids, points, road, block, depth = [np.concatenate(column)
+                                         for column in zip(*splits)]
+    # generate_parcels goes depth by depth, through the blocks in order
+    order = np.lexsort((block, depth))
+    buildings.sort(key=lambda created: (created[3], created[2]))
+    _merge(nodes, ways, (n_ids[order], points[order], road[order],
+                         block[order], depth[order]), buildings)
 
-    def update_way(ways, n1, n2, n_new):
-        # when a new street is created between two other streets,
-        # we need to add the newly created nodes to the original street ways
-        for w_idx, w in ways.items():
-            for i in range(len(w.nodes)):
-                if w.nodes[i] == n1 or w.nodes[i] == n2:
-                    j = (i+1)%len(w.nodes)
-                    if w.nodes[j] == n1 or w.nodes[j] == n2:
-                        w.nodes.insert(j, n_new)
-                        break
-
-    n1 = building.new_node(*pos1)
-    nodes[n1.id] = n1
-    update_way(ways, cycle[polygon_idx1], cycle[(polygon_idx1+1)%p_size], n1.id)
-
-    n2 = building.new_node(*pos2)
-    nodes[n2.id] = n2
-    update_way(ways, cycle[polygon_idx2], cycle[(polygon_idx2+1)%p_size], n2.id)
-
-    polygon.insert((polygon_idx1+1)%len(polygon), pos1)
-    polygon.insert((polygon_idx2+2)%len(polygon), pos2)
-
-    # w = building.new_way([n1.id, n2.id], {"highway":"residential"})
-    # ways[w.id] = w
-
-    p1_index = intersected[0][1]+1
-    p2_index = (intersected[1][1]+1)%(len(cycle))
-
-    subcycle1 = [n1.id]
-    it = p1_index
-    while it != p2_index:
-        subcycle1.append(cycle[it])
-        it = (it+1)%len(cycle)
-    subcycle1.append(n2.id)
-
-    subcycle2 = [n2.id]
-    it = p2_index
-    while it != p1_index:
-        subcycle2.append(cycle[it])
-        it = (it+1)%len(cycle)
-    subcycle2.append(n1.id)
-
-    colored_labels = helper.color_highways(ways,nodes)
-    #colored_labels = None
-    #plot(nodes, ways, tags=None, ways_labels=colored_labels)
-    #input("Press any key to continue...")
-
-    # generate parcel recursively in subcycle1
-    partitions_left /= 2
-    if partitions_left >= 1:
-        #print("Executing recursion Sub1...")
-        generate_parcel_density(nodes, ways, subcycle1, partitions_left)
-    else:
-        # place building here
-        points = [nodes[n_id].location for n_id in subcycle1]
-        created_nodes, created_ways = building.generate_offset_polygon_iterative(points)
-        nodes.update(created_nodes)
-        ways.update(created_ways)
+# node ids of a list of cycles, packed, and the length of each cycle
+def _pack(cycles):
+    ids = np.concatenate([np.asarray(cycle, dtype=np.int64)
+                                                for cycle in cycles])
+    lengths = np.array([len(cycle) for cycle in cycles], dtype=np.int64)
+    return ids, lengths
+
+# params: the work of each item and the number of workers
+# returns: the (sorted) indexes of the items given to each worker that got
+# any, largest items first, each to the least loaded worker
+def _balance(costs, workers):
+    load = np.zeros(max(1, min(workers, len(costs))))
+    groups = [[] for _ in range(len(load))]
+    for i in np.argsort(-costs, kind="stable").tolist():
+        worker = int(np.argmin(load))
+        load[worker] += costs[i]
+        groups[worker].append(i)
+    return [np.array(sorted(group), dtype=np.int64) for group in groups]
+
+# generate_parcels on arrays, without the nodes and ways stores, so that it
+# can also run in other processes (see generate_parcels_parallel)
+# params: the node ids of the cycles, their x, y, the length of each cycle
+# and its partitions, obb and IdRange (as in generate_parcels)
+# returns: the nodes created where the split lines cross the polygons, as
+# arrays (node ids, x y, road segment crossed or -1, block, depth), and the
+# buildings, a list of (nodes, ways, block, depth), in the order created
+def _subdivide(ids, xy, lengths, partitions, boxes=None, ranges=None):
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    # the road segment (u, v) the edge leaving each vertex lies on
+    owner, position, after = _ring_index(offsets)
+    road = np.column_stack((ids, ids[after]))
+    parts = np.asarray(partitions, dtype=np.float64)
+    # the cycle (block) each polygon comes from
+    block = np.arange(len(lengths))
+    if boxes is not None: boxes = np.asarray(boxes, dtype=np.float64)
+
+    splits, leaves, depth = [], [], 0
+    while len(offsets) > 1:
+        if boxes is None:
+            boxes = obb.minimum_bounding_rectangles(xy, offsets)
+        p3, p4 = _split_lines(boxes)
+        found = _split(ids, xy, offsets, p3, p4)
+        if found == None: break
+        first, second, points = found
+        n_split = len(first)
+        split = owner[first]
+
+        # the two new nodes of each split polygon
+        new_ids = _new_ids(block[split], ranges)
+        splits.append((new_ids.ravel(), points.reshape(-1, 2),
+                       road[np.column_stack((first, second)).ravel()],
+                       np.repeat(block[split], 2),
+                       np.full(2 * n_split, depth)))
+
+        # both halves: a new node, the run of vertices after it up to the
+        # other new node, and that node (closing the split line)
+        start, size = offsets[split], np.diff(offsets)[split]
+        i1, i2 = first - start, second - start
+        run_start = np.column_stack((i1 + 1, i2 + 1)).ravel() % \
+                    np.repeat(size, 2)
+        run_length = np.column_stack((i2 - i1, size - i2 + i1)).ravel()
+        front = new_ids.ravel()
+        back = new_ids[:,::-1].ravel()
+        front_road = road[np.column_stack((first, second)).ravel()]
+        front_xy = points.reshape(-1, 2)
+        back_xy = points.reshape(n_split, 2, 2)[:,::-1].reshape(-1, 2)
+
+        half_parts = np.repeat(parts[split] / 2, 2)
+        half_parts[1::2] -= 1
+        go_on = half_parts > 0
+        go_on[0::2] = half_parts[0::2] >= 1
+
+        sub_lengths = run_length + 2
+        sub_offsets = np.concatenate(([0], np.cumsum(sub_lengths)))
+        sub_owner = np.repeat(np.arange(len(sub_lengths)), sub_lengths)
+        k = np.arange(sub_offsets[-1]) - sub_offsets[:-1][sub_owner]
+        parent_start = np.repeat(start, 2)[sub_owner]
+        parent_size = np.repeat(size, 2)[sub_owner]
+        source = parent_start + (run_start[sub_owner] + k - 1) % parent_size
+        is_front = k == 0
+        is_back = k == sub_lengths[sub_owner] - 1
+        sub_ids = np.where(is_front, front[sub_owner],
+                           np.where(is_back, back[sub_owner], ids[source]))
+        sub_xy = np.where(is_front[:,None], front_xy[sub_owner],
+                          np.where(is_back[:,None], back_xy[sub_owner],
+                                   xy[source]))
+        sub_road = np.where(is_front[:,None], front_road[sub_owner],
+                            np.where(is_back[:,None], -1, road[source]))
+
+        # halves out of partitions get a building, the rest are split again
+        half_block = np.repeat(block[split], 2)
+        for half in np.flatnonzero(~go_on).tolist():
+            leaves.append((sub_xy[sub_offsets[half]:sub_offsets[half+1]],
+                           half_block[half], depth))
+        keep = np.repeat(go_on, sub_lengths)
+        ids, xy, road = sub_ids[keep], sub_xy[keep], sub_road[keep]
+        offsets = np.concatenate(([0], np.cumsum(sub_lengths[go_on])))
+        parts, block = half_parts[go_on], half_block[go_on]
+        owner, position, after = _ring_index(offsets)
+        boxes = None
+        depth += 1
 
-    # generate parcel recursively in subcycle2
-    partitions_left -= 1
-    if partitions_left > 0:
-        #print("Executing recursion Sub2...")
-        generate_parcel_density(nodes, ways, subcycle2, partitions_left)
-    else:
-         # place building here
-        points = [nodes[n_id].location for n_id in subcycle2]
-        created_nodes, created_ways = building.generate_offset_polygon_iterative(points)
+    if len(splits) == 0:
+        splits = [(np.zeros(0, dtype=np.int64), np.zeros((0, 2)),
+                   np.zeros((0, 2), dtype=np.int64),
+                   np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))]
+    # the footprints of every lot are found in one batch
+    buildings = []
+    footprints = building.inset_polygons([points for points, _, _ in leaves])
+    for footprint, (_, b, d) in zip(footprints, leaves):
+        if footprint is None: continue
+        created_nodes, created_ways = building.new_building(footprint,
+                                None if ranges == None else ranges[b])
+        buildings.append((created_nodes, created_ways, b, d))
+    return [np.concatenate(column) for column in zip(*splits)], buildings
+
+# returns: two new ids for every split polygon, taken from the IdRange of
+# the block it comes from or, without ranges, from the global counter
+def _new_ids(block, ranges):
+    if ranges == None: return building.new_ids(2 * len(block)).reshape(-1, 2)
+    new_ids = np.empty((len(block), 2), dtype=np.int64)
+    for b in np.unique(block).tolist():
+        mine = block == b
+        new_ids[mine] = ranges[b].take(2 * mine.sum()).reshape(-1, 2)
+    return new_ids
+
+# adds what _subdivide created to the nodes and ways of the map
+def _merge(nodes, ways, splits, buildings):
+    n_ids, points, road, block, depth = splits
+    for n_id, (x, y) in zip(n_ids.tolist(), points.tolist()):
+        nodes.add_xy(n_id, x, y)
+    nodes.set_attr("color", "black", n_ids)
+    _add_crossings(nodes, ways, road, n_ids)
+    for created_nodes, created_ways, b, d in buildings:
         nodes.update(created_nodes)
         ways.update(created_ways)
+
+# for the vertices of ragged rings given by their offsets: the ring each one
+# is in, its position there and the vertex after it
+def _ring_index(offsets):
+    lengths = np.diff(offsets)
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(offsets[-1]) - offsets[:-1][owner]
+    after = offsets[:-1][owner] + (position + 1) % lengths[owner]
+    return owner, position, after
+
+# params: a (polygons, 4, 2) array of obbs
+# returns: the ends of the line splitting each obb in two across its
+# longest side, from the middle of that side to the middle of the opposite
+# one, extended on both ends so that it crosses the polygon inside
+def _split_lines(boxes):
+    delta = np.roll(boxes, -1, axis=1) - boxes
+    longest = np.argmax(np.sqrt(delta[:,:,0]**2 + delta[:,:,1]**2), axis=1)
+    rows = np.arange(len(boxes))
+    corner = [boxes[rows, (longest + k) % 4] for k in range(4)]
+    midpoint = corner[0] + (corner[1] - corner[0])/2
+    midpoint_opposite = corner[2] + (corner[3] - corner[2])/2
+    midpoint_opposite = _extend_lines(midpoint, midpoint_opposite)
+    midpoint = _extend_lines(midpoint_opposite, midpoint)
+    return midpoint, midpoint_opposite
+
+# trig.extend_line for arrays of lines from p1 to p2
+def _extend_lines(p1, p2, ext=0.1):
+    length = np.sqrt((p2[:,0] - p1[:,0])**2 + (p2[:,1] - p1[:,1])**2)
+    return p2 + (p2 - p1) / length[:,None] * (ext * length)[:,None]
+
+# crosses every edge of the polygons with the split line (p3, p4) of its
+# polygon, as trig.my_intersect does. Only the polygons crossed exactly
+# twice can be split, the rest are left as they are
+# returns: the (flat) index of the first and second edge crossed in every
+# polygon split, and the (split, 2, 2) crossing points, or None
+def _split(ids, xy, offsets, p3, p4):
+    owner, position, after = _ring_index(offsets)
+    p, r = xy, xy[after] - xy
+    q, s = p3[owner], p4[owner] - p3[owner]
+    rs = r[:,0]*s[:,1] - r[:,1]*s[:,0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = ((q[:,0]-p[:,0])*s[:,1] - (q[:,1]-p[:,1])*s[:,0]) / rs
+        u = ((p[:,0]-q[:,0])*r[:,1] - (p[:,1]-q[:,1])*r[:,0]) / \
+            (s[:,0]*r[:,1] - s[:,1]*r[:,0])
+    hit = (rs != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    count = np.bincount(owner[hit], minlength=len(offsets) - 1)
+
+    for i in np.flatnonzero(count > 2).tolist():
+        log("Perpendicular line from OBB intersected with > 2 edges.", "DEBUG")
+    for i in np.flatnonzero(count < 2).tolist():
+        # this is not meant to happen
+        log("Partitioning with OBB failed for cycle {}".format(
+                    ids[offsets[i]:offsets[i+1]].tolist()), "WARN")
+
+    edges = np.flatnonzero(hit & (count[owner] == 2))
+    if len(edges) == 0: return None
+    points = p[edges] + r[edges] * t[edges,None]
+    return edges[0::2], edges[1::2], points.reshape(-1, 2, 2)
+
+# params: the nodes and ways of the map, the road segments (u, v) crossed by
+# split lines (-1 where they cross another split line) and the nodes
+# created there
+# adds the nodes to the ways going through each segment, in their order
+# along it
+def _add_crossings(nodes, ways, road, new_ids):
+    on_road = road[:,0] >= 0
+    # the blocks on both sides of a street walk it in opposite directions
+    road, new_ids = np.sort(road[on_road], axis=1), new_ids[on_road]
+    if len(road) == 0: return
+    a, b = nodes.xy(road[:,0]), nodes.xy(road[:,1])
+    along = ((nodes.xy(new_ids) - a) * (b - a)).sum(axis=1)
+    order = np.lexsort((along, road[:,1], road[:,0]))
+    road, new_ids = road[order], new_ids[order]
+    first = np.ones(len(road), dtype=bool)
+    first[1:] = (road[1:] != road[:-1]).any(axis=1)
+    bounds = np.append(np.flatnonzero(first), len(road))
+    for s, e in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        n1, n2 = road[s].tolist()
+        inserted = tuple(new_ids[s:e].tolist())
+        # when a new street is created between two other streets,
+        # we need to add the newly created nodes to the original street ways
+        # (found through the node -> ways index of the store)
+        for w_idx in ways.ways_with_edge(n1, n2).tolist():
+            w = ways[w_idx]
+            w_nodes = w.nodes
+            for i in range(len(w_nodes)-1):
+                if w_nodes[i] == n1 and w_nodes[i+1] == n2:
+                    w.nodes = w_nodes[:i+1] + inserted + w_nodes[i+1:]
+                    break
+                if w_nodes[i] == n2 and w_nodes[i+1] == n1:
+                    w.nodes = w_nodes[:i+1] + inserted[::-1] + w_nodes[i+1:]
+                    break
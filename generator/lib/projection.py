@@ -0,0 +1,40 @@
+import numpy as np
+
+# WGS84 ellipsoid: semi-major axis and first eccentricity squared
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+# Local metric projection of a map: a plane tangent to the WGS84 ellipsoid at
+# an origin (the center of the map), x going east and y going north in
+# meters. Degrees are scaled by the radii of curvature at the origin, so over
+# a city the error is far below the precision of the data. The projection is
+# linear: polygons keep their shape and topology, and going back to lon/lat
+# (only needed when writing a map) is exact.
+class LocalProjection():
+    def __init__(self, lon0, lat0):
+        self.lon0 = float(lon0)
+        self.lat0 = float(lat0)
+        phi = np.radians(self.lat0)
+        w = 1 - WGS84_E2 * np.sin(phi)**2
+        # meters per degree of longitude and of latitude at the origin
+        self.kx = float(np.radians(1) * WGS84_A / np.sqrt(w) * np.cos(phi))
+        self.ky = float(np.radians(1) * WGS84_A * (1 - WGS84_E2) / w**1.5)
+
+    # the projection centered on the bounding box of a (k, 2) array of
+    # lon, lat coordinates
+    @classmethod
+    def around(cls, lonlat):
+        if len(lonlat) == 0: return cls(0, 0)
+        lon0, lat0 = (lonlat.min(axis=0) + lonlat.max(axis=0)) / 2
+        return cls(lon0, lat0)
+
+    # lon, lat (numbers or arrays) to x, y in meters
+    def forward(self, lon, lat):
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky
+
+    # x, y in meters (numbers or arrays) to lon, lat
+    def inverse(self, x, y):
+        return self.lon0 + x / self.kx, self.lat0 + y / self.ky
+
+    def __repr__(self):
+        return "LocalProjection({}, {})".format(self.lon0, self.lat0)
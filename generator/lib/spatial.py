@@ -0,0 +1,84 @@
+import numpy as np
+import lib.trigonometry as trig
+
+# Spatial index over the nodes of a map, built once after loading the map
+# and passed to the stages that look for nodes in an area (finding the empty
+# road cycles, see helper.remove_nonempty_cycles). It is a uniform grid
+# packed in arrays: the nodes sorted by the cell they fall in, with the
+# offsets where every cell starts. A query (by bbox, or by polygon through
+# its bbox) only visits the cells it overlaps, so it costs O(local) instead
+# of O(map). Coordinates are the projected ones (NodeStore.xy, in meters).
+# The index is not updated when the map changes.
+class SpatialIndex():
+    # params: the nodes to index and the average number of nodes per cell
+    # the grid is sized for
+    def __init__(self, nodes, per_cell=4):
+        self.node_ids = nodes.ids
+        self.coordinates = nodes.xy()
+
+        points = self.coordinates
+        if len(points) == 0: points = np.zeros((1, 2))
+        self.min_x, self.min_y = points.min(axis=0)
+        width, height = np.maximum(points.max(axis=0) - (self.min_x,
+                                                         self.min_y), 1e-9)
+        cells = max(1, len(self.node_ids) // per_cell)
+        self.cell = max(np.sqrt(width * height / cells),
+                        max(width, height) / (2 * cells))
+        self.nx = int(width // self.cell) + 1
+        self.ny = int(height // self.cell) + 1
+
+        # nodes sorted by cell
+        cx, cy = self._cells(self.coordinates[:,0], self.coordinates[:,1])
+        self.node_order, self.node_offsets = self._pack(cx * self.ny + cy)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    # grid cell (column, row) of coordinates, clipped to the grid
+    def _cells(self, x, y):
+        cx = np.floor((np.asarray(x) - self.min_x) / self.cell)
+        cy = np.floor((np.asarray(y) - self.min_y) / self.cell)
+        return np.clip(cx, 0, self.nx - 1).astype(np.int64), \
+               np.clip(cy, 0, self.ny - 1).astype(np.int64)
+
+    # sorts items by cell, returns the order and where each cell starts
+    def _pack(self, cells):
+        order = np.argsort(cells, kind="stable")
+        offsets = np.searchsorted(cells[order], np.arange(self.nx*self.ny+1))
+        return order, offsets
+
+    # positions (in order) of the items of the cells overlapping a bbox
+    def _visit(self, order, offsets, min_x, min_y, max_x, max_y):
+        (x0, x1), (y0, y1) = self._cells((min_x, max_x), (min_y, max_y))
+        chunks = [order[offsets[x*self.ny+y0]:offsets[x*self.ny+y1+1]]
+                                                for x in range(x0, x1+1)]
+        return np.concatenate(chunks)
+
+    # returns: the positions (in node_ids and coordinates) of the nodes
+    # inside a bbox, borders included
+    def node_positions(self, min_x, min_y, max_x, max_y):
+        pos = self._visit(self.node_order, self.node_offsets,
+                          min_x, min_y, max_x, max_y)
+        x, y = self.coordinates[pos,0], self.coordinates[pos,1]
+        return pos[(x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)]
+
+    # params: a (Q, 4) array of bboxes (min_x, min_y, max_x, max_y)
+    # returns: the pairs (node position, bbox index) of the nodes inside
+    # each bbox
+    def node_positions_in_bboxes(self, bboxes):
+        found = [self.node_positions(*bbox) for bbox in np.asarray(bboxes)]
+        query = np.repeat(np.arange(len(found)), [len(f) for f in found])
+        if len(found) == 0: return query, query
+        return np.concatenate(found), query
+
+    # params: a list of polygons ((k, 2) arrays of coordinates) and the
+    # processes to test the nodes with (see trig.points_inside_polygons)
+    # returns: the pairs (node position, polygon index) of the nodes inside
+    # each polygon, tested among the ones inside its bbox
+    def node_positions_in_polygons(self, polygons, processes=1):
+        bboxes = [(*polygon.min(axis=0), *polygon.max(axis=0))
+                                                    for polygon in polygons]
+        positions, query = self.node_positions_in_bboxes(bboxes)
+        inside = trig.points_inside_polygons(self.coordinates, polygons,
+                                             positions, query, processes)
+        return positions[inside], query[inside]
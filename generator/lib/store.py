@@ -0,0 +1,1033 @@
+import os
+import pickle
+import datetime
+import numpy as np
+from collections.abc import MutableMapping, ValuesView, ItemsView
+
+# marks an extra attribute (e.g. color, type) that was never set for a row
+_UNSET = object()
+
+# returns flat[starts[0]:starts[0]+lengths[0]] + flat[starts[1]:...] + ...
+# as a single array without a python loop
+def _gather(flat, starts, lengths):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    if total == 0: return flat[:0].copy()
+    offsets = np.cumsum(lengths) - lengths
+    index = np.repeat(np.asarray(starts, dtype=np.int64) - offsets, lengths)
+    index += np.arange(total)
+    return flat[index]
+
+# appends values at the end of a growable flat array and returns the
+# (possibly reallocated) array and the position they were written at
+def _append_flat(flat, size, values):
+    needed = size + len(values)
+    if needed > len(flat):
+        capacity = max(len(flat), 1)
+        while capacity < needed:
+            capacity *= 2
+        new = np.zeros(capacity, dtype=flat.dtype)
+        new[:size] = flat[:size]
+        flat = new
+    flat[size:needed] = values
+    return flat, size
+
+# compares the flat[start:start+length] slices of two CSR arrays row by row
+# and returns a boolean array telling which rows differ
+def _slices_differ(flat_a, starts_a, lengths_a, flat_b, starts_b, lengths_b):
+    differ = lengths_a != lengths_b
+    same = np.flatnonzero(~differ)
+    lengths = lengths_a[same]
+    a = _gather(flat_a, starts_a[same], lengths)
+    b = _gather(flat_b, starts_b[same], lengths)
+    owner = np.repeat(np.arange(len(same)), lengths)
+    differ[same] = np.bincount(owner, weights=(a != b),
+                               minlength=len(same)) > 0
+    return differ
+
+# reads the osm metadata present in a node/way-like object
+def _object_meta(obj):
+    meta = {}
+    for attr in ("version", "visible", "changeset", "uid"):
+        if hasattr(obj, attr): meta[attr] = getattr(obj, attr)
+    timestamp = getattr(obj, "timestamp", None)
+    if isinstance(timestamp, datetime.datetime):
+        meta["timestamp"] = int(timestamp.timestamp())
+    return meta
+
+# reads the tags of a node/way-like object as a dict
+def _object_tags(obj):
+    tags = getattr(obj, "tags", None)
+    if tags is not None and not isinstance(tags, dict):
+        tags = {key: value for key, value in tags}
+    return tags
+
+# Interns tag keys and values: every distinct string is stored once and
+# referred to by a small integer id. Copies of a store share their dictionary,
+# which is fine since it only ever grows.
+class TagDictionary():
+    def __init__(self, strings=None):
+        self.strings = list(strings) if strings != None else []
+        self._ids = {string: i for i, string in enumerate(self.strings)}
+
+    def intern(self, string):
+        string_id = self._ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self._ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+    # returns the id of a string or -1 if it was never interned
+    def get(self, string):
+        return self._ids.get(string, -1)
+
+    def __len__(self):
+        return len(self.strings)
+
+# Common part of the columnar stores: one row per OSM object with the id and
+# metadata in contiguous numpy arrays, an id -> row index and extra (non OSM)
+# attributes such as the plotting colors. Stores behave like the dicts of
+# objects used before (store[id].attr, values(), items(), store[o.id] = o),
+# returning a light view object for each row.
+class _Store(MutableMapping):
+    _columns = {"_ids": np.int64, "_alive": bool, "_version": np.int32,
+                "_visible": bool, "_changeset": np.int64,
+                "_timestamp": np.int64, "_uid": np.int64}
+    _view = None
+
+    def __init__(self, capacity=1024):
+        capacity = max(int(capacity), 1)
+        self._size = 0
+        self._count = 0
+        for name, dtype in self._columns.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self._attrs = {}  # attribute name -> object array with one slot per row
+        # id -> row index: while ids are appended in ascending order (the
+        # order of OSM files and of settings.id_counter) the id column is
+        # already sorted. Otherwise a sorting permutation is built on demand
+        # and rows appended after it are kept in a small dict until there
+        # are enough of them to be worth sorting again
+        self._ascending = True
+        self._perm = None
+        self._sorted = None
+        self._recent = {}
+
+    def _grow(self, needed):
+        # a store loaded from the cache of an empty one has no rows at all
+        capacity = max(len(self._ids), 1)
+        if needed <= len(self._ids): return
+        while capacity < needed:
+            capacity *= 2
+        for name in self._columns:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+        for name, old in self._attrs.items():
+            new = np.full(capacity, _UNSET, dtype=object)
+            new[:self._size] = old[:self._size]
+            self._attrs[name] = new
+
+    def _reset_index(self):
+        self._perm = None
+        self._sorted = None
+        self._recent = {}
+
+    def _sorted_ids(self):
+        if self._ascending: return self._ids[:self._size], None
+        if self._perm is None:
+            self._perm = np.argsort(self._ids[:self._size], kind="stable")
+            self._sorted = self._ids[self._perm]
+            self._recent = {}
+        return self._sorted, self._perm
+
+    # returns the row of an id, or -1 if it is not in the store
+    def _find(self, o_id, include_dead=False):
+        if self._size == 0: return -1
+        row = self._recent.get(o_id, -1)
+        if row < 0:
+            sorted_ids, perm = self._sorted_ids()
+            pos = int(np.searchsorted(sorted_ids, o_id))
+            if pos >= len(sorted_ids) or sorted_ids[pos] != o_id: return -1
+            row = pos if perm is None else int(perm[pos])
+        if not include_dead and not self._alive[row]: return -1
+        return row
+
+    # vectorized version of _find, raises KeyError for unknown ids
+    def rows(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._size == 0:
+            if len(ids) > 0: raise KeyError(int(ids[0]))
+            return ids
+        if self._recent: self._reset_index()
+        sorted_ids, perm = self._sorted_ids()
+        pos = np.searchsorted(sorted_ids, ids)
+        pos[pos >= self._size] = 0
+        found = sorted_ids[pos] == ids
+        rows = pos if perm is None else perm[pos]
+        found &= self._alive[rows]
+        if not found.all():
+            raise KeyError(int(ids[np.argmin(found)]))
+        return rows
+
+    # returns the row for an id, creating a new one (or reviving a deleted
+    # one) if needed, and fills its metadata
+    def _row_for(self, o_id, version=0, visible=True, changeset=0,
+                 timestamp=0, uid=0):
+        o_id = int(o_id)
+        row = self._find(o_id, include_dead=True)
+        if row < 0:
+            row = self._size
+            self._grow(row+1)
+            self._ids[row] = o_id
+            self._size += 1
+            if self._ascending and row > 0 and o_id <= self._ids[row-1]:
+                self._ascending = False
+                self._reset_index()
+            elif not self._ascending and self._perm is not None:
+                self._recent[o_id] = row
+                if len(self._recent) > max(1024, row//4):
+                    self._reset_index()
+        if not self._alive[row]:
+            self._alive[row] = True
+            self._count += 1
+        # version 0 means the object has no metadata (e.g. generated ones)
+        self._version[row] = version
+        self._visible[row] = visible
+        self._changeset[row] = changeset
+        self._timestamp[row] = timestamp
+        self._uid[row] = uid
+        for column in self._attrs.values():
+            column[row] = _UNSET
+        return row
+
+    # carry over extra attributes (e.g. color) from an object being stored
+    def _copy_extras(self, obj, row):
+        if isinstance(obj, _View):
+            extras = obj.extras()
+        else:
+            extras = getattr(obj, "__dict__", {})
+        for name, value in extras.items():
+            if name in self._view._builtin: continue
+            self._set_attr(name, row, value)
+
+    def _add_object(self, obj):
+        raise NotImplementedError
+
+    # MutableMapping interface (compatibility with the old dicts of objects)
+    def __getitem__(self, o_id):
+        row = self._find(o_id)
+        if row < 0: raise KeyError(o_id)
+        return self._view(self, row)
+
+    def __setitem__(self, o_id, obj):
+        if o_id != obj.id:
+            raise ValueError("object id {} stored under key {}".format(
+                                                            obj.id, o_id))
+        if isinstance(obj, _View) and obj._store is self: return
+        self._add_object(obj)
+
+    def __delitem__(self, o_id):
+        row = self._find(o_id)
+        if row < 0: raise KeyError(o_id)
+        self._alive[row] = False
+        self._count -= 1
+        self._clear_row(row)
+
+    def _clear_row(self, row):
+        pass
+
+    def __contains__(self, o_id):
+        try:
+            return self._find(o_id) >= 0
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return self._count
+
+    def values(self):
+        return StoreValues(self)
+
+    def items(self):
+        return StoreItems(self)
+
+    def __repr__(self):
+        return "{}({} objects)".format(type(self).__name__, len(self))
+
+    # live rows in insertion order
+    def live_rows(self):
+        return np.flatnonzero(self._alive[:self._size])
+
+    @property
+    def ids(self):
+        return self._ids[:self._size][self._alive[:self._size]]
+
+    # drops repeated ids but keeps the order in which they were passed
+    def _unique_rows(self, ids):
+        rows = self.rows(ids)
+        _, first = np.unique(rows, return_index=True)
+        return rows[np.sort(first)]
+
+    # fills a new (empty) store with the fixed size columns of rows
+    def _subset_columns(self, sub, rows):
+        n = len(rows)
+        sub._grow(n)
+        for name in self._columns:
+            getattr(sub, name)[:n] = getattr(self, name)[rows]
+        sub._size = sub._count = n
+        sub._ascending = bool(np.all(np.diff(sub._ids[:n]) > 0))
+        sub._reset_index()
+        for name, column in self._attrs.items():
+            sub._attrs[name] = np.full(len(sub._ids), _UNSET, dtype=object)
+            sub._attrs[name][:n] = column[rows]
+
+    def _copy_columns(self, new):
+        new._size, new._count = self._size, self._count
+        for name in self._columns:
+            setattr(new, name, getattr(self, name).copy())
+        new._attrs = {name: column.copy() for name, column in self._attrs.items()}
+        new._ascending = self._ascending
+        new._reset_index()
+
+    def __copy__(self):
+        return self.copy()
+
+    # compares the store with base, an earlier version of it (e.g. the store
+    # it was copied from), and returns the ids of the objects created,
+    # modified and deleted since then, in store order
+    def diff(self, base):
+        ids, base_ids = self.ids, base.ids
+        in_base = np.isin(ids, base_ids)
+        common = ids[in_base]
+        changed = self._changed(base, self.rows(common), base.rows(common))
+        return ids[~in_base], common[changed], base_ids[~np.isin(base_ids, ids)]
+
+    def _changed(self, base, rows, base_rows):
+        raise NotImplementedError
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    # writes every column (up to the last row) as a .npy file in folder.
+    # Extra attributes are not saved
+    def _save_columns(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        for name in self._columns:
+            np.save(os.path.join(folder, name[1:]+".npy"),
+                    getattr(self, name)[:self._size])
+
+    # reads the columns written by _save_columns. With mmap_mode "c" the
+    # files are memory-mapped copy-on-write: pages are only read when used
+    # and changes made to the store stay in memory
+    def _load_columns(self, folder, mmap_mode):
+        for name in self._columns:
+            setattr(self, name, np.load(os.path.join(folder, name[1:]+".npy"),
+                                        mmap_mode=mmap_mode))
+        self._size = len(self._ids)
+        self._count = int(np.count_nonzero(self._alive))
+        self._ascending = bool(np.all(np.diff(self._ids) > 0))
+        self._reset_index()
+
+    # extra (non OSM) attributes, e.g. color and type used for plotting
+    def _get_attr(self, name, row):
+        column = self._attrs.get(name)
+        if column is None or column[row] is _UNSET:
+            raise AttributeError(name)
+        return column[row]
+
+    def _set_attr(self, name, row, value):
+        column = self._attrs.get(name)
+        if column is None:
+            column = np.full(len(self._ids), _UNSET, dtype=object)
+            self._attrs[name] = column
+        column[row] = value
+
+    # set an extra attribute for the passed ids (or for every row),
+    # value can be a single value or one value per id
+    def set_attr(self, name, value, ids=None):
+        if name not in self._attrs:
+            self._attrs[name] = np.full(len(self._ids), _UNSET, dtype=object)
+        rows = self.live_rows() if ids is None else self.rows(ids)
+        self._attrs[name][rows] = value
+
+# Columnar storage for OSM nodes: coordinates are two float64 columns and
+# tags are only stored for the few nodes that actually have them. Once the
+# store is projected (see project) every node also has x, y columns in
+# meters, which is what the geometry of the generator works on. Nodes created
+# in meters (add_xy) get their lon/lat computed when they are first read.
+class NodeStore(_Store):
+    _columns = dict(_Store._columns, _lon=np.float64, _lat=np.float64,
+                    _x=np.float64, _y=np.float64, _stale=bool)
+
+    def __init__(self, capacity=1024):
+        _Store.__init__(self, capacity)
+        self._tags = {}   # row -> {key: value}, only for tagged nodes
+        self.projection = None
+
+    # appends a node (or overwrites it if the id already exists) and
+    # returns its row
+    def add(self, n_id, lon, lat, tags=None, **meta):
+        row = self._row_for(n_id, **meta)
+        self._lon[row] = lon
+        self._lat[row] = lat
+        self._stale[row] = False
+        if self.projection != None:
+            self._x[row], self._y[row] = self.projection.forward(lon, lat)
+        if tags: self._tags[row] = dict(tags)
+        else: self._tags.pop(row, None)
+        return row
+
+    # appends a node at x, y (meters) of a projected store
+    def add_xy(self, n_id, x, y, tags=None, **meta):
+        if self.projection == None: self.project()
+        row = self._row_for(n_id, **meta)
+        self._x[row] = x
+        self._y[row] = y
+        self._stale[row] = True
+        if tags: self._tags[row] = dict(tags)
+        else: self._tags.pop(row, None)
+        return row
+
+    # params: a lib.projection.LocalProjection (by default one centered on
+    # the nodes of the store)
+    # computes x, y of every node. Copies and subsets of the store keep
+    # the projection, and nodes added later are projected as they come
+    def project(self, projection=None):
+        from lib.projection import LocalProjection
+        self._sync()
+        if projection == None:
+            projection = LocalProjection.around(self.lonlat())
+        self.projection = projection
+        size = self._size
+        self._x[:size], self._y[:size] = projection.forward(self._lon[:size],
+                                                            self._lat[:size])
+        return self
+
+    # computes lon/lat of the nodes added with add_xy since the last call
+    def _sync(self):
+        rows = np.flatnonzero(self._stale[:self._size])
+        if len(rows) == 0: return
+        self._lon[rows], self._lat[rows] = self.projection.inverse(
+                                                self._x[rows], self._y[rows])
+        self._stale[rows] = False
+
+    # copies a node object handed by osmium during apply_file
+    def add_osmium_node(self, n):
+        tags = {key: value for key, value in n.tags} if len(n.tags) else None
+        return self.add(n.id, n.location.lon, n.location.lat, tags,
+                        version=n.version, visible=n.visible,
+                        changeset=n.changeset,
+                        timestamp=int(n.timestamp.timestamp()), uid=n.uid)
+
+    # copies any node-like object (OSMNode, NodeView, osmium node). Nodes
+    # with no location but an xy (created by the generator) are added in
+    # meters
+    def _add_object(self, node):
+        location = getattr(node, "location", None)
+        if location is None:
+            row = self.add_xy(node.id, node.xy[0], node.xy[1],
+                              _object_tags(node), **_object_meta(node))
+            self._copy_extras(node, row)
+            return row
+        try:
+            lon, lat = location[0], location[1]
+        except TypeError:
+            lon, lat = location.lon, location.lat
+        row = self.add(node.id, lon, lat, _object_tags(node),
+                       **_object_meta(node))
+        self._copy_extras(node, row)
+        return row
+
+    def _clear_row(self, row):
+        self._tags.pop(row, None)
+
+    # (k, 2) array with the lon, lat of the passed ids (or of every node)
+    def lonlat(self, ids=None):
+        self._sync()
+        rows = self.live_rows() if ids is None else self.rows(ids)
+        return np.column_stack((self._lon[rows], self._lat[rows]))
+
+    # (k, 2) array with the x, y in meters of the passed ids (or of every
+    # node), projecting the store first if it was not
+    def xy(self, ids=None):
+        if self.projection == None: self.project()
+        rows = self.live_rows() if ids is None else self.rows(ids)
+        return np.column_stack((self._x[rows], self._y[rows]))
+
+    # returns min_lon, min_lat, max_lon, max_lat of the passed ids
+    # (or of every node in the store)
+    def bounds(self, ids=None):
+        self._sync()
+        rows = self.live_rows() if ids is None else self.rows(ids)
+        lon, lat = self._lon[rows], self._lat[rows]
+        return lon.min(), lat.min(), lon.max(), lat.max()
+
+    # a new store containing only the passed ids (extra attributes included)
+    def subset(self, ids):
+        rows = self._unique_rows(ids)
+        sub = NodeStore(len(rows))
+        self._subset_columns(sub, rows)
+        sub.projection = self.projection
+        remap = {int(r): i for i, r in enumerate(rows)}
+        sub._tags = {remap[r]: dict(t) for r, t in self._tags.items()
+                                                           if r in remap}
+        return sub
+
+    def copy(self):
+        new = NodeStore.__new__(NodeStore)
+        self._copy_columns(new)
+        new._tags = {r: dict(t) for r, t in self._tags.items()}
+        new.projection = self.projection
+        return new
+
+    def _changed(self, base, rows, base_rows):
+        self._sync()
+        base._sync()
+        changed = (self._lon[rows] != base._lon[base_rows]) | \
+                  (self._lat[rows] != base._lat[base_rows])
+        # only the few tagged nodes need their tags compared
+        tagged = np.isin(rows, list(self._tags)) | \
+                 np.isin(base_rows, list(base._tags))
+        for i in np.flatnonzero(tagged):
+            if self._tags.get(rows[i]) != base._tags.get(base_rows[i]):
+                changed[i] = True
+        return changed
+
+    def save(self, folder):
+        self._sync()
+        self._save_columns(folder)
+        with open(os.path.join(folder, "tags.pkl"), "wb") as f:
+            pickle.dump(self._tags, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, folder, mmap_mode="c"):
+        store = cls(1)
+        store._load_columns(folder, mmap_mode)
+        with open(os.path.join(folder, "tags.pkl"), "rb") as f:
+            store._tags = pickle.load(f)
+        return store
+
+# Columnar storage for OSM ways. Node refs of all ways live in one flat array
+# and each way points to its slice (CSR-like, with an explicit length so a
+# way can be relocated to the end of the array when its nodes change). Tags
+# are encoded as pairs of interned key/value ids, and an inverted index
+# key -> (rows, value ids) is built once so that tag queries return the
+# matching ways without rescanning every way.
+class WayStore(_Store):
+    _columns = dict(_Store._columns, _start=np.int64, _length=np.int32,
+                    _tag_start=np.int64, _tag_length=np.int32)
+
+    def __init__(self, capacity=1024, tag_dictionary=None):
+        _Store.__init__(self, capacity)
+        self._refs = np.zeros(max(int(capacity), 1)*8, dtype=np.int64)
+        self._refs_size = 0
+        self._tag_keys = np.zeros(max(int(capacity), 1)*2, dtype=np.int32)
+        self._tag_values = np.zeros(max(int(capacity), 1)*2, dtype=np.int32)
+        self._tags_size = 0
+        self.strings = tag_dictionary if tag_dictionary != None else \
+                                                            TagDictionary()
+        self._index = None  # key id -> (rows, value ids)
+        self._pending = []  # rows added after the index was built
+        self._node_index = None  # (refs sorted by node id, their way rows)
+        self._node_added = {}  # node id -> rows given it after the build
+        self._node_dirty = set()  # rows whose refs changed after the build
+
+    def _set_refs(self, row, refs):
+        refs = np.asarray(refs, dtype=np.int64)
+        self._refs, start = _append_flat(self._refs, self._refs_size, refs)
+        self._refs_size += len(refs)
+        self._start[row] = start
+        self._length[row] = len(refs)
+        if self._node_index != None:
+            self._node_dirty.add(row)
+            for n_id in refs.tolist():
+                self._node_added.setdefault(n_id, []).append(row)
+
+    def _set_tags(self, row, tags):
+        pairs = list(tags.items()) if tags else []
+        keys = [self.strings.intern(k) for k, v in pairs]
+        values = [self.strings.intern(v) for k, v in pairs]
+        size = self._tags_size
+        self._tag_keys, start = _append_flat(self._tag_keys, size, keys)
+        self._tag_values, _ = _append_flat(self._tag_values, size, values)
+        self._tags_size += len(pairs)
+        self._tag_start[row] = start
+        self._tag_length[row] = len(pairs)
+
+    # appends a way (or overwrites it if the id already exists) and
+    # returns its row
+    def add(self, w_id, refs, tags=None, **meta):
+        existing = self._find(w_id, include_dead=True) >= 0
+        row = self._row_for(w_id, **meta)
+        self._set_refs(row, refs)
+        self._set_tags(row, tags)
+        if existing: self._index = None
+        elif self._index != None: self._pending.append(row)
+        return row
+
+    # copies a way object handed by osmium during apply_file
+    def add_osmium_way(self, w):
+        refs = [n.ref for n in w.nodes]
+        tags = {key: value for key, value in w.tags}
+        return self.add(w.id, refs, tags, version=w.version,
+                        visible=w.visible, changeset=w.changeset,
+                        timestamp=int(w.timestamp.timestamp()), uid=w.uid)
+
+    # copies any way-like object (OSMWay, WayView, osmium way)
+    def _add_object(self, way):
+        refs = [n if isinstance(n, (int, np.integer)) else n.ref
+                                                        for n in way.nodes]
+        row = self.add(way.id, refs, _object_tags(way), **_object_meta(way))
+        self._copy_extras(way, row)
+        return row
+
+    def _clear_row(self, row):
+        self._index = None
+
+    # node refs of a single row as an array (do not modify in place)
+    def _row_refs(self, row):
+        start = self._start[row]
+        return self._refs[start:start+self._length[row]]
+
+    def _row_tags(self, row):
+        start = self._tag_start[row]
+        end = start + self._tag_length[row]
+        strings = self.strings.strings
+        return {strings[k]: strings[v] for k, v in zip(
+                self._tag_keys[start:end].tolist(),
+                self._tag_values[start:end].tolist())}
+
+    # the node refs of the passed way ids (or of every way) concatenated in
+    # a single array, plus the number of refs of each way
+    def node_refs(self, ids=None):
+        rows = self.live_rows() if ids is None else self.rows(ids)
+        lengths = self._length[rows]
+        return _gather(self._refs, self._start[rows], lengths), lengths
+
+    # builds the node -> ways reverse index for every way currently in the
+    # store. Ways changed afterwards (e.g. when parcel generation inserts a
+    # node in a street) are recorded by _set_refs and checked against their
+    # current refs on lookup, so the index stays correct without rebuilding
+    def build_node_index(self):
+        rows = self.live_rows()
+        refs, lengths = self.node_refs()
+        ref_rows = np.repeat(rows, lengths)
+        order = np.lexsort((ref_rows, refs))
+        self._node_index = (refs[order], ref_rows[order])
+        self._node_added = {}
+        self._node_dirty = set()
+
+    # rows (in store order) of the live ways having any of the passed nodes
+    def _rows_with_nodes(self, ids):
+        if self._node_index == None: self.build_node_index()
+        sorted_refs, ref_rows = self._node_index
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        start = np.searchsorted(sorted_refs, ids, side="left")
+        end = np.searchsorted(sorted_refs, ids, side="right")
+        rows = _gather(ref_rows, start, end - start)
+        if self._node_dirty:
+            dirty = self._node_dirty
+            wanted = set(ids.tolist())
+            changed = {row for row in rows.tolist() if row in dirty}
+            for n_id in wanted:
+                changed.update(self._node_added.get(n_id, ()))
+            rows = rows[~np.isin(rows, list(changed))]
+            changed = [row for row in changed if self._alive[row] and
+                       not wanted.isdisjoint(self._row_refs(row).tolist())]
+            rows = np.concatenate((rows, np.array(changed, dtype=np.int64)))
+        rows = np.unique(rows)
+        return rows[self._alive[rows]]
+
+    # ids (in store order) of the ways where n1 and n2 are consecutive nodes
+    # (in either order)
+    def ways_with_edge(self, n1, n2):
+        rows = self._rows_with_nodes([n1, n2]).tolist()
+        found = []
+        for row in rows:
+            refs = self._row_refs(row)
+            a, b = refs[:-1], refs[1:]
+            if (((a == n1) & (b == n2)) | ((a == n2) & (b == n1))).any():
+                found.append(row)
+        return self._ids[np.array(found, dtype=np.int64)]
+
+    # builds the inverted tag index for every way currently in the store
+    def build_index(self):
+        rows = self.live_rows()
+        lengths = self._tag_length[rows]
+        starts = self._tag_start[rows]
+        keys = _gather(self._tag_keys, starts, lengths)
+        values = _gather(self._tag_values, starts, lengths)
+        pair_rows = np.repeat(rows, lengths)
+        order = np.argsort(keys, kind="stable") # rows stay in store order
+        keys, values, pair_rows = keys[order], values[order], pair_rows[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        self._index = {}
+        for k, r, v in zip(np.split(keys, bounds), np.split(pair_rows, bounds),
+                           np.split(values, bounds)):
+            if len(k) > 0: self._index[int(k[0])] = (r, v)
+        self._pending = []
+
+    def _ensure_index(self):
+        if self._index == None:
+            self.build_index()
+        elif self._pending:
+            added = {}
+            for row in self._pending:
+                if not self._alive[row]: continue
+                start = self._tag_start[row]
+                end = start + self._tag_length[row]
+                for k, v in zip(self._tag_keys[start:end].tolist(),
+                                self._tag_values[start:end].tolist()):
+                    added.setdefault(k, ([], []))
+                    added[k][0].append(row)
+                    added[k][1].append(v)
+            for k, (rows, values) in added.items():
+                old_rows, old_values = self._index.get(k,
+                     (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)))
+                self._index[k] = (np.concatenate((old_rows, rows)),
+                                  np.concatenate((old_values, values)))
+            self._pending = []
+        return self._index
+
+    # rows of the ways having the tag key (and one of values, if given)
+    def rows_with_tag(self, key, values=None):
+        index = self._ensure_index()
+        key_id = self.strings.get(key)
+        if key_id < 0 or key_id not in index:
+            return np.zeros(0, dtype=np.int64)
+        rows, value_ids = index[key_id]
+        if values != None:
+            if isinstance(values, str): values = [values]
+            wanted = [self.strings.get(v) for v in values]
+            rows = rows[np.isin(value_ids, wanted)]
+        return rows[self._alive[rows]]
+
+    # ids (in store order) of the ways matching any of the passed tags,
+    # given as {key: None} for any value or {key: [values]}
+    def query(self, tags):
+        matches = [self.rows_with_tag(key, values)
+                                            for key, values in tags.items()]
+        if not matches: return np.zeros(0, dtype=np.int64)
+        rows = np.unique(np.concatenate(matches))
+        return self._ids[rows]
+
+    # a new store containing only the passed ids (extra attributes included)
+    def subset(self, ids):
+        rows = self._unique_rows(ids)
+        sub = WayStore(len(rows), self.strings)
+        self._subset_columns(sub, rows)
+        lengths = self._length[rows]
+        sub._refs = _gather(self._refs, self._start[rows], lengths)
+        sub._refs_size = len(sub._refs)
+        sub._start[:len(rows)] = np.cumsum(lengths) - lengths
+        tag_lengths = self._tag_length[rows]
+        tag_starts = self._tag_start[rows]
+        sub._tag_keys = _gather(self._tag_keys, tag_starts, tag_lengths)
+        sub._tag_values = _gather(self._tag_values, tag_starts, tag_lengths)
+        sub._tags_size = len(sub._tag_keys)
+        sub._tag_start[:len(rows)] = np.cumsum(tag_lengths) - tag_lengths
+        return sub
+
+    def copy(self):
+        new = WayStore.__new__(WayStore)
+        self._copy_columns(new)
+        new._refs = self._refs.copy()
+        new._refs_size = self._refs_size
+        new._tag_keys = self._tag_keys.copy()
+        new._tag_values = self._tag_values.copy()
+        new._tags_size = self._tags_size
+        new.strings = self.strings
+        # index arrays are never modified in place, so they can be shared
+        new._index = dict(self._index) if self._index != None else None
+        new._pending = list(self._pending)
+        new._node_index = self._node_index
+        new._node_added = {n_id: list(rows) for n_id, rows in
+                                                    self._node_added.items()}
+        new._node_dirty = set(self._node_dirty)
+        return new
+
+    def _changed(self, base, rows, base_rows):
+        changed = _slices_differ(self._refs, self._start[rows],
+                                 self._length[rows], base._refs,
+                                 base._start[base_rows], base._length[base_rows])
+        base_keys = base._tag_keys[:base._tags_size]
+        base_values = base._tag_values[:base._tags_size]
+        if base.strings is not self.strings:
+            # translate the string ids of base (-1 for unknown strings)
+            translate = np.array([self.strings.get(string) for string in
+                                  base.strings.strings], dtype=np.int32)
+            base_keys, base_values = translate[base_keys], translate[base_values]
+        tag_starts, tag_lengths = self._tag_start[rows], self._tag_length[rows]
+        base_starts = base._tag_start[base_rows]
+        base_lengths = base._tag_length[base_rows]
+        changed |= _slices_differ(self._tag_keys, tag_starts, tag_lengths,
+                                  base_keys, base_starts, base_lengths)
+        changed |= _slices_differ(self._tag_values, tag_starts, tag_lengths,
+                                  base_values, base_starts, base_lengths)
+        return changed
+
+    def save(self, folder):
+        self._save_columns(folder)
+        np.save(os.path.join(folder, "refs.npy"), self._refs[:self._refs_size])
+        np.save(os.path.join(folder, "tag_keys.npy"),
+                self._tag_keys[:self._tags_size])
+        np.save(os.path.join(folder, "tag_values.npy"),
+                self._tag_values[:self._tags_size])
+        with open(os.path.join(folder, "strings.pkl"), "wb") as f:
+            pickle.dump(self.strings.strings, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, folder, mmap_mode="c"):
+        store = cls(1)
+        store._load_columns(folder, mmap_mode)
+        store._refs = np.load(os.path.join(folder, "refs.npy"),
+                              mmap_mode=mmap_mode)
+        store._refs_size = len(store._refs)
+        store._tag_keys = np.load(os.path.join(folder, "tag_keys.npy"),
+                                  mmap_mode=mmap_mode)
+        store._tag_values = np.load(os.path.join(folder, "tag_values.npy"),
+                                    mmap_mode=mmap_mode)
+        store._tags_size = len(store._tag_keys)
+        with open(os.path.join(folder, "strings.pkl"), "rb") as f:
+            store.strings = TagDictionary(pickle.load(f))
+        return store
+
+class StoreValues(ValuesView):
+    def __init__(self, store):
+        super().__init__(store)
+        self.store = store
+
+    def __iter__(self):
+        store = self.store
+        for row in store.live_rows().tolist():
+            yield store._view(store, row)
+
+class StoreItems(ItemsView):
+    def __init__(self, store):
+        super().__init__(store)
+        self.store = store
+
+    def __iter__(self):
+        store = self.store
+        rows = store.live_rows()
+        for o_id, row in zip(store._ids[rows].tolist(), rows.tolist()):
+            yield o_id, store._view(store, row)
+
+# a row of a store, exposing the same attributes as the OSMNode/OSMWay
+# objects; any other attribute set on it is kept as an extra column
+# the tags of a node or way view: a copy of them (a dict, as osmium wants
+# it) whose changes (tags[k] = v, del tags[k], update...) are written back to
+# the store through the view
+class _Tags(dict):
+    __slots__ = ("_view",)
+
+    def __init__(self, view):
+        dict.__init__(self, view._tags())
+        self._view = view
+
+    def _write(self):
+        self._view.tags = dict(self)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._write()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._write()
+
+    def pop(self, *args):
+        value = dict.pop(self, *args)
+        self._write()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._write()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = dict.setdefault(self, key, default)
+        self._write()
+        return value
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._write()
+
+    def clear(self):
+        dict.clear(self)
+        self._write()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    # a plain dict when copied or pickled, not bound to the view
+    def copy(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+class _View():
+    __slots__ = ("_store", "_row")
+    _builtin = ("id", "tags", "version", "visible", "changeset", "timestamp",
+                "uid")
+
+    def __init__(self, store, row):
+        object.__setattr__(self, "_store", store)
+        object.__setattr__(self, "_row", row)
+
+    @property
+    def id(self):
+        return int(self._store._ids[self._row])
+
+    # metadata raises AttributeError for objects without it (like the
+    # generated OSMNode/OSMWay), so that the osmium writer skips those fields
+    def _meta(self, column):
+        if self._store._version[self._row] == 0:
+            raise AttributeError(column)
+        return getattr(self._store, "_"+column)[self._row]
+
+    @property
+    def version(self):
+        return int(self._meta("version"))
+
+    @property
+    def visible(self):
+        return bool(self._meta("visible"))
+
+    @property
+    def changeset(self):
+        return int(self._meta("changeset"))
+
+    @property
+    def uid(self):
+        return int(self._meta("uid"))
+
+    @property
+    def timestamp(self):
+        return datetime.datetime.fromtimestamp(int(self._meta("timestamp")),
+                                               datetime.timezone.utc)
+
+    def extras(self):
+        store, row = self._store, self._row
+        return {name: column[row] for name, column in store._attrs.items()
+                                                if column[row] is not _UNSET}
+
+    def __getattr__(self, name):
+        if name.startswith("__"): raise AttributeError(name)
+        return self._store._get_attr(name, self._row)
+
+    def __setattr__(self, name, value):
+        if hasattr(type(self), name):
+            object.__setattr__(self, name, value)
+        else:
+            self._store._set_attr(name, self._row, value)
+
+    # views are pickled (e.g. by helper.save) as standalone objects
+    def __reduce__(self):
+        return (_detached, (type(self).__name__, self._detach_state()))
+
+class NodeView(_View):
+    __slots__ = ()
+    _builtin = _View._builtin + ("location", "xy")
+
+    @property
+    def location(self):
+        store, row = self._store, self._row
+        if store._stale[row]:
+            return tuple(float(c) for c in store.projection.inverse(
+                                             store._x[row], store._y[row]))
+        return (float(store._lon[row]), float(store._lat[row]))
+
+    @location.setter
+    def location(self, value):
+        store, row = self._store, self._row
+        store._lon[row], store._lat[row] = value
+        store._stale[row] = False
+        if store.projection != None:
+            store._x[row], store._y[row] = store.projection.forward(*value)
+
+    # x, y in meters (see NodeStore.project)
+    @property
+    def xy(self):
+        store, row = self._store, self._row
+        if store.projection == None: store.project()
+        return (float(store._x[row]), float(store._y[row]))
+
+    @xy.setter
+    def xy(self, value):
+        store, row = self._store, self._row
+        if store.projection == None: store.project()
+        store._x[row], store._y[row] = value
+        store._stale[row] = True
+
+    def _tags(self):
+        return self._store._tags.get(self._row, {})
+
+    @property
+    def tags(self):
+        return _Tags(self)
+
+    @tags.setter
+    def tags(self, value):
+        if value: self._store._tags[self._row] = dict(value)
+        else: self._store._tags.pop(self._row, None)
+
+    def _detach_state(self):
+        return dict(self.extras(), id=self.id, location=self.location,
+                    tags=dict(self.tags))
+
+    def __repr__(self):
+        return str(self._detach_state())
+
+class WayView(_View):
+    __slots__ = ()
+    _builtin = _View._builtin + ("nodes",)
+
+    # a tuple, use "way.nodes = ..." to change it
+    @property
+    def nodes(self):
+        return tuple(self._store._row_refs(self._row).tolist())
+
+    @nodes.setter
+    def nodes(self, value):
+        self._store._set_refs(self._row, value)
+
+    def _tags(self):
+        return self._store._row_tags(self._row)
+
+    @property
+    def tags(self):
+        return _Tags(self)
+
+    @tags.setter
+    def tags(self, value):
+        self._store._set_tags(self._row, value)
+        self._store._index = None
+
+    def _detach_state(self):
+        return dict(self.extras(), id=self.id, nodes=list(self.nodes),
+                    tags=dict(self.tags))
+
+    def __repr__(self):
+        return ("w{}: nodes={} tags={}".format(self.id, list(self.nodes),
+                                                                  self.tags))
+
+# rebuilds a pickled view as a plain OSMNode/OSMWay object
+def _detached(kind, state):
+    from lib.Map import OSMNode, OSMWay
+    obj = OSMNode() if kind == "NodeView" else OSMWay()
+    for name, value in state.items():
+        setattr(obj, name, value)
+    return obj
+
+NodeStore._view = NodeView
+WayStore._view = WayView
@@ -1,5 +1,4 @@
 import math
-import matplotlib
 import numpy as np
 
 def dist(x1, y1, x2, y2):
@@ -48,10 +47,107 @@ def has_intersection(polygon1, polygon2):
     return False
 
 def point_inside_polygon(x, y, polygon):
-    # source: https://stackoverflow.com/a/23453678
-    test_polygon = [point for point in polygon]
-    bb_path = matplotlib.path.Path(np.array(test_polygon))
-    return bb_path.contains_point((x, y))
+    return bool(points_inside_polygon([(x, y)], polygon)[0])
+
+# crossing test of a horizontal ray from (px, py) with the edges (x0, y0) ->
+# (x1, y1), element-wise: the same test matplotlib.path.Path.contains_point
+# does (points exactly on the border are classified the same way)
+def _crossings(px, py, x0, y0, x1, y1):
+    above0 = y0 >= py
+    above1 = y1 >= py
+    return (above0 != above1) & \
+           (((y1 - py) * (x0 - x1) >= (x1 - px) * (y0 - y1)) == above1)
+
+# params: an (N, 2) array of points and a polygon as a list of (x, y)
+# (closed implicitly)
+# returns: a boolean mask of the points inside the polygon
+def points_inside_polygon(points, polygon):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    polygon = np.asarray(polygon, dtype=np.float64)
+    px, py = points[:,0], points[:,1]
+    inside = np.zeros(len(points), dtype=bool)
+    for (x0, y0), (x1, y1) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        inside ^= _crossings(px, py, x0, y0, x1, y1)
+    return inside
+
+# packs a list of polygons as their vertices one after the other and the
+# offsets where each one starts
+def pack_polygons(polygons):
+    lengths = np.array([len(polygon) for polygon in polygons], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    if len(polygons) == 0: return np.zeros((0, 2)), offsets
+    flat = np.concatenate([np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+                           for polygon in polygons])
+    return flat, offsets
+
+# returns: the pairs (point index, polygon index) of the points inside the
+# bounding box of each polygon, the only ones that can be inside it
+def polygon_candidates(points, polygons):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    flat, offsets = pack_polygons(polygons)
+    if len(flat) == 0: return (np.zeros(0, dtype=np.int64),) * 2
+    starts = offsets[:-1]
+    min_x, min_y = np.minimum.reduceat(flat, starts).T
+    max_x, max_y = np.maximum.reduceat(flat, starts).T
+    order = np.argsort(points[:,0], kind="stable")
+    sorted_x = points[order,0]
+    first = np.searchsorted(sorted_x, min_x, side="left")
+    last = np.searchsorted(sorted_x, max_x, side="right")
+    count = last - first
+    polygon_index = np.repeat(np.arange(len(polygons)), count)
+    point_index = order[np.arange(count.sum()) -
+                        np.repeat(np.cumsum(count) - count, count) +
+                        np.repeat(first, count)]
+    y = points[point_index,1]
+    keep = (y >= min_y[polygon_index]) & (y <= max_y[polygon_index])
+    return point_index[keep], polygon_index[keep]
+
+# the crossing test for each point against the polygon of the same position,
+# walking the edges of all of them at once (longest polygons first, so the
+# ones still having edges are always a prefix)
+def _inside_pairs(points, flat, offsets, polygon_index):
+    lengths = np.diff(offsets)[polygon_index]
+    order = np.argsort(-lengths, kind="stable")
+    px, py = points[order,0], points[order,1]
+    start, lengths = offsets[polygon_index[order]], lengths[order]
+    active = np.searchsorted(-lengths, -np.arange(lengths.max(initial=0)),
+                             side="left")
+    inside = np.zeros(len(order), dtype=bool)
+    for k, n in enumerate(active.tolist()):
+        v0 = flat[start[:n] + k]
+        v1 = flat[start[:n] + (k+1) % lengths[:n]]
+        inside[:n] ^= _crossings(px[:n], py[:n], v0[:,0], v0[:,1],
+                                 v1[:,0], v1[:,1])
+    mask = np.empty(len(order), dtype=bool)
+    mask[order] = inside
+    return mask
+
+# params: an (N, 2) array of points and a list of M polygons (lists of
+# (x, y)), optionally the pairs of indexes (point_index[i], polygon_index[i])
+# to test (e.g. from polygon_candidates), and the number of processes to
+# split the pairs between for very large inputs
+# returns: a boolean mask with the result of each pair or, when no pairs are
+# given, an (N, M) mask of every point against every polygon
+def points_inside_polygons(points, polygons, point_index=None,
+                           polygon_index=None, processes=1):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    dense = point_index is None
+    if dense:
+        point_index = np.repeat(np.arange(len(points)), len(polygons))
+        polygon_index = np.tile(np.arange(len(polygons)), len(points))
+    flat, offsets = pack_polygons(polygons)
+    if processes > 1 and len(point_index) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        chunks = np.array_split(np.arange(len(point_index)), processes)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_inside_pairs, points[point_index[chunk]],
+                                   flat, offsets, polygon_index[chunk])
+                       for chunk in chunks]
+            mask = np.concatenate([future.result() for future in futures])
+    else:
+        mask = _inside_pairs(points[point_index], flat, offsets, polygon_index)
+    if dense: return mask.reshape(len(points), len(polygons))
+    return mask
 
 def is_inside(polygon1, polygon2):
     #print("Checking if poylgon1: \n {}".format(polygon1))
@@ -8,12 +8,15 @@ def parse_args(args):
     parser = optparse.OptionParser(usage=usage)
     parser.add_option('-i', action="store", type="string", dest="filename",
 	   help="OSM input file", default="data/sumidaku.osm")
+    parser.add_option('-l', action="store", type="string", dest="index",
+        help="Osmium node location index used to read ways in a single pass "\
+             "(e.g. \"sparse_file_array,nodes.idx\")", default=None)
     return parser.parse_args()
 
 def main():
     opt, args = parse_args(sys.argv[1:])
     input = opt.filename
-    map = readFile(input)
+    map = readFile(input, opt.index)
     render(map, script_run=True)
 
 if __name__ == '__main__':
@@ -0,0 +1,47 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import lib.neighbors as neighbors
+from lib.blocks import BlockTable
+from lib.store import NodeStore
+
+# the blocks of a 4x4 grid of junctions (ids 10*row + column), counter-
+# clockwise from different corners, and a block away from them that only
+# touches the grid at one corner
+def _table():
+    nodes = NodeStore()
+    for row in range(4):
+        for column in range(4):
+            nodes.add(10*row + column, 140 + column * 0.001, 36 + row * 0.001)
+    nodes.add(50, 139.999, 36.004)
+    nodes.add(51, 139.999, 36.003)
+    nodes.project()
+    cycles = []
+    for row in range(3):
+        for column in range(3):
+            ring = [10*row + column, 10*row + column + 1,
+                    10*(row+1) + column + 1, 10*(row+1) + column]
+            shift = (row + column) % 4
+            cycles.append(ring[shift:] + ring[:shift])
+    cycles.append([30, 50, 51])
+    return BlockTable.from_cycles(nodes, cycles), cycles
+
+def _brute_force(cycles, shared):
+    def keys(cycle):
+        if shared == "nodes": return set(cycle)
+        return {frozenset(s) for s in zip(cycle, cycle[1:] + cycle[:1])}
+    return [[j for j in range(len(cycles)) if j != i and
+             keys(cycles[i]) & keys(cycles[j])] for i in range(len(cycles))]
+
+def test_adjacency():
+    table, cycles = _table()
+    for shared in ("edges", "nodes"):
+        assert neighbors.to_lists(*table.adjacency(shared)) == \
+            _brute_force(cycles, shared)
+    # the corner block only touches the grid at a node
+    assert neighbors.to_lists(*table.adjacency("edges"))[9] == []
+    assert neighbors.to_lists(*table.adjacency("nodes"))[9] == [6]
+    with pytest.raises(ValueError):
+        table.adjacency("ways")
@@ -0,0 +1,54 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import lib.building as building
+
+def _area(polygon):
+    x, y = np.asarray(polygon, dtype=np.float64).T
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+def _lots(seed=0):
+    rng = np.random.RandomState(seed)
+    lots = [[(0, 0), (20, 0), (20, 20), (0, 20)],
+            [(0, 0), (60, 0), (60, 8), (0, 8)],
+            [(0, 0), (30, 0), (10, 25)],
+            [(0, 0), (40, 0), (40, 10), (10, 10), (10, 40), (0, 40)],
+            [(0, 0), (30, 0), (30, 30), (20, 30), (20, 10), (10, 10),
+             (10, 30), (0, 30)]]
+    angles = np.linspace(0, 2*np.pi, 13)[:-1]
+    lots.append(np.column_stack((15*np.cos(angles), 15*np.sin(angles))))
+    for _ in range(30):
+        n = rng.randint(3, 12)
+        angles = np.sort(rng.uniform(0, 2*np.pi, n))
+        radius = rng.uniform(5, 60)
+        lots.append(rng.uniform(-500, 500, 2) +
+                    np.column_stack((radius*np.cos(angles),
+                                     radius*np.sin(angles))))
+    return [np.asarray(lot, dtype=np.float64) for lot in lots]
+
+# the footprint of lots of any shape (convex or not, thin, with clockwise
+# or counterclockwise vertices) covers FOOTPRINT_AREA of it
+def test_footprints_cover_the_area_wanted():
+    lots = _lots()
+    lots += [lot[::-1] for lot in lots[:6]]
+    footprints = building.inset_polygons(lots, tolerance=0.01)
+    for lot, footprint in zip(lots, footprints):
+        assert footprint is not None
+        fraction = _area(footprint / building.CLIPPER_SCALE) / _area(lot)
+        assert abs(fraction - building.FOOTPRINT_AREA) <= 0.01
+
+# a lot solved alone gets the footprint it gets in a batch
+def test_footprints_do_not_depend_on_the_batch():
+    lots = _lots()
+    together = building.inset_polygons(lots)
+    for lot, footprint in zip(lots, together):
+        assert np.array_equal(building.inset_polygons([lot])[0], footprint)
+
+# lots with no area have no footprint
+def test_degenerate_lots():
+    lots = [[(0, 0), (10, 0), (20, 0)], [(5, 5), (5, 5), (5, 5)],
+            [(0, 0), (0.0001, 0), (0.0001, 0.0001)]]
+    assert building.inset_polygons(lots) == [None] * len(lots)
+    assert building.inset_polygons([]) == []
@@ -0,0 +1,25 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib.cache as map_cache
+from lib.store import NodeStore, WayStore
+
+def _map(n):
+    nodes, ways = NodeStore(), WayStore()
+    for i in range(n): nodes.add(10 + i, 140.1, 36.1)
+    ways.add(1, list(range(10, 10 + n)), {"highway": "road"})
+    return nodes, ways
+
+# the maps parsed with other params stay cached, the same key is replaced
+def test_save_map_keeps_other_keys(tmp_path):
+    filename = str(tmp_path / "map.osm")
+    with open(filename, "w") as f: f.write("<osm/>")
+    a = map_cache.cache_key(filename, None, None, False)
+    b = map_cache.cache_key(filename, None, [0, 0, 1, 1], False)
+    map_cache.save_map(filename, a, *_map(2))
+    map_cache.save_map(filename, b, *_map(3))
+    map_cache.save_map(filename, a, *_map(4))
+    assert len(map_cache.load_map(filename, a)[0]) == 4
+    assert len(map_cache.load_map(filename, b)[0]) == 3
+    assert sorted(os.listdir(map_cache.cache_folder(filename))) == sorted([a, b])
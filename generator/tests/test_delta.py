@@ -0,0 +1,43 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import lib.delta as delta
+from lib.store import NodeStore, WayStore
+
+def _base():
+    nodes, ways = NodeStore(), WayStore()
+    for i, (lon, lat) in enumerate([(140.1, 36.1), (140.2, 36.1),
+                                    (140.2, 36.2), (140.1, 36.2)]):
+        nodes.add(10 + i, lon, lat, {"name": str(i)} if i == 0 else None)
+    ways.add(1, [10, 11, 12], {"highway": "road"})
+    ways.add(2, [12, 13], {"highway": "path"})
+    return nodes, ways
+
+def _summary(nodes, ways):
+    return ({n.id: (round(n.location[0], 7), round(n.location[1], 7),
+                    dict(n.tags)) for n in nodes.values()},
+            {w.id: (list(w.nodes), dict(w.tags)) for w in ways.values()})
+
+# a map written as the changes to its base is loaded back as it was
+def test_change_round_trip(tmp_path):
+    folder = str(tmp_path)
+    nodes, ways = _base()
+    manifest = delta.write_base(folder, nodes, ways)
+
+    _nodes, _ways = nodes.copy(), ways.copy()
+    _nodes.add(20, 140.15, 36.15, {"building": "residential"})
+    _ways.add(3, [20, 11, 20], {"building": "residential"})
+    _ways[1].tags["surface"] = "asphalt"
+    _ways[1].nodes = [10, 11, 12, 13]
+    del _ways[2]
+    _nodes[10].tags = {}
+    delta.add_map(folder, manifest, "elite", nodes, ways, _nodes, _ways,
+                  accuracy=0.5)
+
+    loaded = delta.load_map(folder, "elite", use_cache=False)
+    assert _summary(*loaded) == _summary(_nodes, _ways)
+    assert delta.load_manifest(folder)["maps"]["elite"]["accuracy"] == 0.5
+    # the base is left as it was
+    assert _summary(nodes, ways) == _summary(*_base())
@@ -0,0 +1,102 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from lib.graph import RoadGraph
+from lib.store import NodeStore, WayStore
+
+# A 3x3 grid of junctions (ids 100 + 3*row + column, 100 m apart) whose
+# streets have a shape node halfway, plus:
+#   a spur into the lower left block from the shape node of its bottom side
+#   a dangling street leaving the grid from its lower left corner
+#   a ring with no junction, away from the grid
+#   a ring leaving and coming back to the upper right corner of the grid
+def _roads():
+    nodes, ways = NodeStore(), WayStore()
+    points = {}
+    def node(n_id, x, y):
+        points[n_id] = (x, y)
+        nodes.add(n_id, 140 + x * 0.001, 36 + y * 0.001)
+    def junction(row, column): return 100 + 3*row + column
+    for row in range(3):
+        for column in range(3):
+            node(junction(row, column), column, row)
+    w_id = 1
+    for row in range(3):
+        refs = []
+        for column in range(3):
+            if column > 0:
+                node(200 + 10*row + column, column - 0.5, row)
+                refs.append(200 + 10*row + column)
+            refs.append(junction(row, column))
+        ways.add(w_id, refs, {"highway": "residential"})
+        w_id += 1
+    for column in range(3):
+        refs = []
+        for row in range(3):
+            if row > 0:
+                node(300 + 10*column + row, column, row - 0.5)
+                refs.append(300 + 10*column + row)
+            refs.append(junction(row, column))
+        ways.add(w_id, refs, {"highway": "residential"})
+        w_id += 1
+    node(400, 0.5, 0.3)
+    node(401, 0.4, 0.5)
+    ways.add(20, [201, 400, 401], {"highway": "service"})
+    node(410, -0.5, -0.2)
+    node(411, -1, -0.2)
+    ways.add(21, [100, 410, 411], {"highway": "service"})
+    for i, (x, y) in enumerate([(5, 0), (6, 0), (6, 1), (5, 1)]):
+        node(420 + i, x, y)
+    ways.add(22, [420, 421, 422, 423, 420], {"highway": "service"})
+    for i, (x, y) in enumerate([(3, 2), (3, 3), (2, 3)]):
+        node(430 + i, x, y)
+    ways.add(23, [108, 430, 431, 432, 108], {"highway": "service"})
+    nodes.project()
+    return nodes, ways, points
+
+def _blocks():
+    cell = lambda r, c: {100 + 3*r + c, 100 + 3*r + c + 1,
+                         100 + 3*(r+1) + c, 100 + 3*(r+1) + c + 1,
+                         200 + 10*r + c + 1, 200 + 10*(r+1) + c + 1,
+                         300 + 10*c + r + 1, 300 + 10*(c+1) + r + 1}
+    blocks = [cell(r, c) for r in range(2) for c in range(2)]
+    return blocks + [{420, 421, 422, 423}, {108, 430, 431, 432}]
+
+def _area(ring, points):
+    x, y = np.array([points[n] for n in ring]).T
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+# every bounded face is a block going counterclockwise, without the spur,
+# the dangling street or the repeated first node of the rings
+def test_faces_are_the_blocks():
+    nodes, ways, points = _roads()
+    faces = RoadGraph.from_ways(nodes, ways).faces(nodes)
+    assert sorted(map(sorted, faces)) == sorted(map(sorted, _blocks()))
+    for face in faces:
+        assert len(face) == len(set(face))
+        assert _area(face, points) > 0
+
+# chains of shape nodes become single edges (loops for the rings), which
+# expand back to every segment of the roads, and give the same blocks
+def test_contraction():
+    nodes, ways, _ = _roads()
+    graph = RoadGraph.from_ways(nodes, ways)
+    contracted = graph.contract()
+    # the junctions (not the two corners of the grid with only two streets),
+    # the shape node the spur leaves from, the dead ends and one node of the
+    # ring with no junction
+    assert sorted(contracted.node_ids.tolist()) == \
+        [100, 101, 103, 104, 105, 107, 108, 201, 401, 411, 420]
+    loops = contracted.edges[contracted.edges[:,0] == contracted.edges[:,1]]
+    assert sorted(loops[:,0].tolist()) == [108, 420]
+
+    segments = []
+    for e, (u, v) in enumerate(contracted.edges.tolist()):
+        line = contracted.polyline(e)
+        assert line[0] == u and line[-1] == v
+        segments += [tuple(sorted(s)) for s in zip(line[:-1], line[1:])]
+    assert sorted(segments) == sorted(map(tuple, np.sort(graph.edges, axis=1)))
+
+    assert contracted.faces(nodes) == graph.faces(nodes)
@@ -0,0 +1,45 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy.sparse.csgraph import minimum_spanning_tree
+import lib.neighbors as neighbors
+
+def _points(n=200, seed=0):
+    return np.random.RandomState(seed).uniform(0, 1000, (n, 2))
+
+def _distances(points):
+    return np.sqrt(((points[:,None] - points[None])**2).sum(axis=2))
+
+def _pairs(offsets, indices):
+    return {(i, j) for i, n_ids in enumerate(neighbors.to_lists(offsets,
+                                                                indices))
+                                                        for j in n_ids}
+
+# the tree over the Delaunay edges is the one over every pair of points,
+# also for collinear points
+def test_mst():
+    for points in (_points(), _points(5), np.column_stack((np.arange(10.),
+                                                          np.arange(10.)))):
+        tree = minimum_spanning_tree(_distances(points)).toarray()
+        i, j = np.nonzero(tree)
+        expected = set(zip(i.tolist(), j.tolist())) | \
+                   set(zip(j.tolist(), i.tolist()))
+        assert _pairs(*neighbors.mst(points)) == expected
+
+def test_knn():
+    points = _points()
+    distances = _distances(points)
+    np.fill_diagonal(distances, np.inf)
+    nearest = np.argsort(distances, axis=1)[:,:3]
+    expected = {(i, j) for i in range(len(points)) for j in nearest[i]}
+    assert _pairs(*neighbors.knn(points, 3)) == expected
+
+def test_within():
+    points = _points()
+    distances = _distances(points)
+    np.fill_diagonal(distances, np.inf)
+    i, j = np.nonzero(distances <= 100)
+    assert _pairs(*neighbors.within(points, 100)) == \
+        set(zip(i.tolist(), j.tolist()))
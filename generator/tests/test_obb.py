@@ -0,0 +1,64 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy.spatial import ConvexHull
+import lib.obb as obb
+
+def random_polygons(count=300, seed=0):
+    rng = np.random.RandomState(seed)
+    polygons = []
+    for _ in range(count):
+        n = rng.randint(3, 30)
+        angles = np.sort(rng.uniform(0, 2*np.pi, n))
+        radius = rng.uniform(5, 100, n)
+        center = rng.uniform(-2000, 2000, 2)
+        polygons.append(center + np.column_stack((radius*np.cos(angles),
+                                                  radius*np.sin(angles))))
+    # rectangles, whose edges meet at right angles, are ties for the search
+    for _ in range(50):
+        w, h, a = rng.uniform(10, 80), rng.uniform(10, 80), rng.uniform(0, 2*np.pi)
+        corners = np.array([(0, 0), (w, 0), (w, h), (0, h)])
+        rotation = np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]])
+        polygons.append(corners.dot(rotation.T) + rng.uniform(-2000, 2000, 2))
+    return polygons
+
+def batch(polygons):
+    offsets = np.concatenate(([0], np.cumsum([len(p) for p in polygons])))
+    return obb.minimum_bounding_rectangles(np.concatenate(polygons), offsets)
+
+def box_area(box):
+    return np.linalg.norm(box[1] - box[0]) * np.linalg.norm(box[2] - box[1])
+
+# the box of a polygon is the same alone, in a batch, and anywhere in it
+def test_boxes_do_not_depend_on_the_batch():
+    polygons = random_polygons()
+    together = batch(polygons)
+    alone = np.array([batch([p])[0] for p in polygons])
+    order = np.random.RandomState(1).permutation(len(polygons))
+    shuffled = np.empty_like(together)
+    shuffled[order] = batch([polygons[i] for i in order])
+    assert np.array_equal(together, alone)
+    assert np.array_equal(together, shuffled)
+
+# the box has the smallest area among the ones aligned with each hull edge
+# but the closing one, as in the original per-polygon version
+def test_boxes_are_the_smallest_aligned_with_the_hull():
+    polygons = random_polygons()
+    for polygon, box in zip(polygons, batch(polygons)):
+        hull = polygon[ConvexHull(polygon).vertices]
+        edges = hull[1:] - hull[:-1]
+        best = np.inf
+        for angle in np.arctan2(edges[:,1], edges[:,0]):
+            u = np.array((np.cos(angle), np.sin(angle)))
+            v = np.array((-u[1], u[0]))
+            along, across = hull.dot(u), hull.dot(v)
+            best = min(best, np.ptp(along) * np.ptp(across))
+        assert abs(box_area(box) - best) <= 1e-9 * best
+        # and it holds the polygon
+        u = (box[1] - box[0]) / np.linalg.norm(box[1] - box[0])
+        v = np.array((-u[1], u[0]))
+        for axis in (u, v):
+            p, b = polygon.dot(axis), box.dot(axis)
+            assert p.min() >= b.min() - 1e-6 and p.max() <= b.max() + 1e-6
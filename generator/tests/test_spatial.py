@@ -0,0 +1,41 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import lib.trigonometry as trig
+from lib.spatial import SpatialIndex
+from lib.store import NodeStore
+
+def _index(n=500, seed=0):
+    rng = np.random.RandomState(seed)
+    nodes = NodeStore()
+    for i, (lon, lat) in enumerate(rng.uniform(0, 0.01, (n, 2)).tolist()):
+        nodes.add(i + 1, 140 + lon, 36 + lat)
+    nodes.project()
+    return SpatialIndex(nodes)
+
+# the queries find the nodes a test against every node finds
+def test_queries_match_brute_force():
+    index = _index()
+    x, y = index.coordinates.T
+    rng = np.random.RandomState(1)
+    polygons = []
+    for _ in range(20):
+        center = rng.uniform(x.min(), x.max()), rng.uniform(y.min(), y.max())
+        angles = np.sort(rng.uniform(0, 2*np.pi, 6))
+        radii = rng.uniform(20, 200, 6)
+        polygons.append(np.column_stack((center[0] + radii*np.cos(angles),
+                                         center[1] + radii*np.sin(angles))))
+    for polygon in polygons:
+        min_x, min_y = polygon.min(axis=0)
+        max_x, max_y = polygon.max(axis=0)
+        expected = np.flatnonzero((x >= min_x) & (x <= max_x) &
+                                  (y >= min_y) & (y <= max_y))
+        found = index.node_positions(min_x, min_y, max_x, max_y)
+        assert sorted(found.tolist()) == expected.tolist()
+
+    positions, query = index.node_positions_in_polygons(polygons)
+    mask = trig.points_inside_polygons(index.coordinates, polygons)
+    expected = sorted(zip(*np.nonzero(mask)))
+    assert sorted(zip(positions.tolist(), query.tolist())) == expected
@@ -0,0 +1,53 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from lib.store import NodeStore, WayStore
+
+# a store loaded from the cache of an empty store has no rows to grow from
+def test_add_to_loaded_empty_stores(tmp_path):
+    for store, add in ((WayStore(), lambda s: s.add(1, [10, 11],
+                                                    {"highway": "road"})),
+                       (NodeStore(), lambda s: s.add(10, 140.1, 36.1))):
+        folder = str(tmp_path / type(store).__name__)
+        os.makedirs(folder)
+        store.save(folder)
+        loaded = type(store).load(folder)
+        add(loaded)
+        assert len(loaded) == 1
+
+# changing the tags of a view in place changes them in the store
+def test_tags_are_written_through():
+    nodes, ways = NodeStore(), WayStore()
+    nodes.add(10, 140.1, 36.1, {"amenity": "bank"})
+    ways.add(1, [10, 11], {"highway": "road"})
+    for view in (nodes[10], ways[1]):
+        view.tags["name"] = "x"
+        del view.tags[next(k for k in view.tags if k != "name")]
+    assert dict(nodes[10].tags) == {"name": "x"}
+    assert dict(ways[1].tags) == {"name": "x"}
+    ways[1].tags.pop("name")
+    assert len(ways[1].tags) == 0 and ways[1].tags == {}
+
+# the ways with an edge, found through the node index, are the ones a scan
+# finds, also after ways are changed, added and deleted once it is built
+def test_ways_with_edge():
+    rng = np.random.RandomState(0)
+    ways = WayStore()
+    for w_id in range(1, 60):
+        ways.add(w_id, rng.randint(0, 30, rng.randint(2, 8)).tolist())
+    ways.build_node_index()
+    for w_id in range(1, 60, 7):
+        ways[w_id].nodes = rng.randint(0, 30, rng.randint(2, 8)).tolist()
+    for w_id in range(60, 70):
+        ways.add(w_id, rng.randint(0, 30, rng.randint(2, 8)).tolist())
+    for w_id in range(2, 60, 9):
+        del ways[w_id]
+
+    def scan(n1, n2):
+        return [w.id for w in ways.values() if {(n1, n2), (n2, n1)} &
+                set(zip(w.nodes[:-1], w.nodes[1:]))]
+    for n1 in range(30):
+        for n2 in range(n1, 30):
+            assert ways.ways_with_edge(n1, n2).tolist() == scan(n1, n2)